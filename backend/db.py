@@ -4,9 +4,10 @@ import json
 import logging
 import os
 from contextlib import contextmanager
-from typing import Any, Dict, Iterator, Optional
+from typing import Any, Dict, Iterable, Iterator, Optional, Sequence, Tuple
 
 import psycopg2
+from psycopg2.extras import execute_values
 from psycopg2.pool import ThreadedConnectionPool
 
 logger = logging.getLogger(__name__)
@@ -14,6 +15,11 @@ logger = logging.getLogger(__name__)
 _pool: Optional[ThreadedConnectionPool] = None
 
 
+def is_configured() -> bool:
+    """Whether a database is configured; optional features skip their queries otherwise."""
+    return bool(os.environ.get("DATABASE_URL"))
+
+
 def init_pool() -> ThreadedConnectionPool:
     global _pool
     if _pool is not None:
@@ -106,6 +112,43 @@ def insert_optimized_route(pending_route_id: str, status: str, result: Dict[str,
         conn.commit()
 
 
+def fetch_latest_optimized_result(pending_route_id: str) -> Optional[Dict[str, Any]]:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                select result
+                from optimized_routes
+                where pending_route_id = %s and status = 'ok'
+                order by created_at desc
+                limit 1
+                """,
+                (pending_route_id,),
+            )
+            row = cur.fetchone()
+        conn.commit()
+    return row[0] if row else None
+
+
+def fetch_recent_optimized_results(limit: int = 20) -> list[tuple[str, Dict[str, Any]]]:
+    """Latest successful results, newest first (candidates for warm-starting similar plans)."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                select pending_route_id::text, result
+                from optimized_routes
+                where status = 'ok'
+                order by created_at desc
+                limit %s
+                """,
+                (limit,),
+            )
+            rows = cur.fetchall()
+        conn.commit()
+    return [(pr_id, result) for pr_id, result in rows]
+
+
 def load_vehicles_from_db() -> list[dict[str, Any]]:
     with get_conn() as conn:
         with conn.cursor() as cur:
@@ -125,3 +168,264 @@ def load_vehicles_from_db() -> list[dict[str, Any]]:
             }
         )
     return vehicles
+
+
+def fetch_travel_times(
+    profile: str, keys: Sequence[Tuple[int, int]]
+) -> Dict[Tuple[Tuple[int, int], Tuple[int, int]], int]:
+    """Return every stored cell between the given quantized (lon, lat) keys in one query."""
+    unique = sorted(set(keys))
+    if not unique:
+        return {}
+
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                with pts as (
+                  select * from unnest(%s::integer[], %s::integer[]) as p(lon_q, lat_q)
+                )
+                select t.src_lon_q, t.src_lat_q, t.dst_lon_q, t.dst_lat_q, t.duration_s
+                from travel_times t
+                join pts s on s.lon_q = t.src_lon_q and s.lat_q = t.src_lat_q
+                join pts d on d.lon_q = t.dst_lon_q and d.lat_q = t.dst_lat_q
+                where t.profile = %s
+                """,
+                ([k[0] for k in unique], [k[1] for k in unique], profile),
+            )
+            rows = cur.fetchall()
+        conn.commit()
+
+    return {((a, b), (c, d)): int(dur) for (a, b, c, d, dur) in rows}
+
+
+def upsert_travel_times(
+    profile: str, cells: Iterable[Tuple[Tuple[int, int], Tuple[int, int], int]]
+) -> int:
+    rows = [(profile, s[0], s[1], d[0], d[1], int(dur)) for (s, d, dur) in cells]
+    if not rows:
+        return 0
+
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            execute_values(
+                cur,
+                """
+                insert into travel_times (profile, src_lon_q, src_lat_q, dst_lon_q, dst_lat_q, duration_s)
+                values %s
+                on conflict (profile, src_lon_q, src_lat_q, dst_lon_q, dst_lat_q)
+                do update set duration_s = excluded.duration_s, updated_at = now()
+                """,
+                rows,
+                page_size=1000,
+            )
+        conn.commit()
+    return len(rows)
+
+
+def fetch_travel_time_cells(profile: str, limit: int = 2_000_000) -> list[tuple[int, int, int, int, int]]:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                select src_lon_q, src_lat_q, dst_lon_q, dst_lat_q, duration_s
+                from travel_times
+                where profile = %s
+                order by updated_at desc
+                limit %s
+                """,
+                (profile, limit),
+            )
+            rows = cur.fetchall()
+        conn.commit()
+    return rows
+
+
+def insert_route_matrix(
+    pending_route_id: str,
+    profile: str,
+    depot_key: str,
+    location_keys: list[list[int]],
+    durations: bytes,
+) -> None:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                insert into route_matrices (pending_route_id, profile, depot_key, location_keys, durations)
+                values (%s, %s, %s, %s::jsonb, %s)
+                on conflict (pending_route_id) do update
+                  set profile = excluded.profile,
+                      depot_key = excluded.depot_key,
+                      location_keys = excluded.location_keys,
+                      durations = excluded.durations,
+                      created_at = now()
+                """,
+                (pending_route_id, profile, depot_key, json.dumps(location_keys), psycopg2.Binary(durations)),
+            )
+        conn.commit()
+
+
+def fetch_route_matrix(pending_route_id: str, profile: str) -> Optional[Dict[str, Any]]:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                select pending_route_id::text, location_keys, durations
+                from route_matrices
+                where pending_route_id = %s and profile = %s
+                """,
+                (pending_route_id, profile),
+            )
+            row = cur.fetchone()
+        conn.commit()
+
+    if not row:
+        return None
+    pr_id, keys, durations = row
+    return {"pending_route_id": pr_id, "location_keys": keys, "durations": bytes(durations)}
+
+
+def fetch_recent_route_matrix_keys(profile: str, depot_key: str, limit: int = 20) -> list[tuple[str, list]]:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                select pending_route_id::text, location_keys
+                from route_matrices
+                where profile = %s and depot_key = %s
+                order by created_at desc
+                limit %s
+                """,
+                (profile, depot_key, limit),
+            )
+            rows = cur.fetchall()
+        conn.commit()
+    return [(pr_id, keys) for (pr_id, keys) in rows]
+
+
+def fetch_pending_route_payloads(limit: int = 50) -> list[Dict[str, Any]]:
+    """Pending routes without claiming them (used to warm caches ahead of optimization)."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                select id::text, payload
+                from pending_routes
+                where status = 'pending'
+                order by created_at asc
+                limit %s
+                """,
+                (limit,),
+            )
+            rows = cur.fetchall()
+        conn.commit()
+    return [{"id": pr_id, "payload": payload} for pr_id, payload in rows]
+
+
+def fetch_strategy_stats() -> Dict[str, Dict[str, Any]]:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("select strategy, stats from matrix_strategy_stats")
+            rows = cur.fetchall()
+        conn.commit()
+    return {strategy: stats for strategy, stats in rows}
+
+
+def upsert_strategy_stats(strategy: str, stats: Dict[str, Any]) -> None:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                insert into matrix_strategy_stats (strategy, stats)
+                values (%s, %s::jsonb)
+                on conflict (strategy) do update
+                  set stats = excluded.stats, updated_at = now()
+                """,
+                (strategy, json.dumps(stats)),
+            )
+        conn.commit()
+
+
+def insert_solver_run(run: Dict[str, Any]) -> None:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                insert into solver_runs
+                  (n_orders, n_vehicles, tw_tightness, time_limit_s, time_to_best_s, elapsed_s, stopped_by)
+                values (%s, %s, %s, %s, %s, %s, %s)
+                """,
+                (
+                    run["n_orders"],
+                    run["n_vehicles"],
+                    run["tw_tightness"],
+                    run["time_limit_s"],
+                    run["time_to_best_s"],
+                    run["elapsed_s"],
+                    run["stopped_by"],
+                ),
+            )
+        conn.commit()
+
+
+def fetch_solver_runs(limit: int = 500) -> list[Dict[str, Any]]:
+    """Most recent solver runs, newest first (training data for the time-limit model)."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                select n_orders, n_vehicles, tw_tightness, time_limit_s, time_to_best_s, elapsed_s, stopped_by
+                from solver_runs
+                order by created_at desc
+                limit %s
+                """,
+                (limit,),
+            )
+            rows = cur.fetchall()
+        conn.commit()
+    keys = ("n_orders", "n_vehicles", "tw_tightness", "time_limit_s", "time_to_best_s", "elapsed_s", "stopped_by")
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def fetch_order_locations_for_date(delivery_date: str) -> list[tuple[float, float]]:
+    """(lon, lat) of the customer orders still to be delivered on a date."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                select lon::float8, lat::float8
+                from customer_orders
+                where delivery_date = %s
+                  and status not in ('cancelled', 'delivered')
+                """,
+                (delivery_date,),
+            )
+            rows = cur.fetchall()
+        conn.commit()
+    return [(float(lon), float(lat)) for lon, lat in rows]
+
+
+@contextmanager
+def ors_quota_transaction() -> Iterator[Dict[str, Any]]:
+    """Shared ORS quota state, serialized across processes by an advisory lock."""
+    with get_conn() as conn:
+        conn.autocommit = False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("select pg_advisory_xact_lock(hashtext('ors_quota_state'))")
+                cur.execute("select state from ors_quota_state where id = 1")
+                row = cur.fetchone()
+                state: Dict[str, Any] = dict(row[0]) if row else {}
+                yield state
+                cur.execute(
+                    """
+                    insert into ors_quota_state (id, state) values (1, %s::jsonb)
+                    on conflict (id) do update set state = excluded.state, updated_at = now()
+                    """,
+                    (json.dumps(state),),
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
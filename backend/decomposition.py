@@ -0,0 +1,324 @@
+from __future__ import annotations
+
+import logging
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Set
+
+import numpy as np
+
+from backend.solver import solve_cvrptw
+from backend.solver_time_limit import (
+    SOLVER_ADAPTIVE_TIME_LIMIT,
+    choose_time_limit,
+    instance_features,
+    record_solver_run,
+)
+
+logger = logging.getLogger(__name__)
+
+# Orders per cluster; a single RoutingModel degrades past a few hundred stops.
+DECOMPOSITION_MAX_CLUSTER_ORDERS = int(os.environ.get("DECOMPOSITION_MAX_CLUSTER_ORDERS", "150"))
+# `kmeans` groups by proximity, `sweep` cuts demand-balanced angular sectors around the depot.
+DECOMPOSITION_METHOD = os.environ.get("DECOMPOSITION_METHOD", "kmeans")
+DECOMPOSITION_WORKERS = int(os.environ.get("DECOMPOSITION_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+_METERS_PER_DEG_LAT = 111_320.0
+_KMEANS_ITERATIONS = 50
+# Clusters this much larger than the target size are split again.
+_OVERSIZE = 1.5
+# Priority offset for clusters whose allotted capacity is below their weight or volume.
+_SHORTFALL = 1e6
+
+
+def _planar(points_lonlat: np.ndarray, origin_lonlat: Sequence[float]) -> np.ndarray:
+    """Equirectangular projection (meters) around `origin_lonlat`; plenty for city-scale clustering."""
+    scale = np.array([math.cos(math.radians(origin_lonlat[1])), 1.0]) * _METERS_PER_DEG_LAT
+    return (points_lonlat - np.asarray(origin_lonlat, dtype=np.float64)) * scale
+
+
+def kmeans_labels(points: np.ndarray, k: int, seed: int = 0, iterations: int = _KMEANS_ITERATIONS) -> np.ndarray:
+    """Lloyd's k-means with k-means++ seeding over planar points; returns a label per point."""
+    n = len(points)
+    k = max(1, min(k, n))
+    if k == 1:
+        return np.zeros(n, dtype=np.intp)
+    rng = np.random.default_rng(seed)
+    centers = np.empty((k, 2), dtype=np.float64)
+    centers[0] = points[rng.integers(n)]
+    closest = ((points - centers[0]) ** 2).sum(axis=1)
+    for c in range(1, k):
+        total = closest.sum()
+        pick = rng.choice(n, p=closest / total) if total > 0 else rng.integers(n)
+        centers[c] = points[pick]
+        closest = np.minimum(closest, ((points - centers[c]) ** 2).sum(axis=1))
+
+    labels = np.full(n, -1, dtype=np.intp)
+    for _ in range(iterations):
+        dist = ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+        new = dist.argmin(axis=1)
+        if np.array_equal(new, labels):
+            break
+        labels = new
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros((k, 2))
+        np.add.at(sums, labels, points)
+        filled = counts > 0
+        centers[filled] = sums[filled] / counts[filled, None]
+        # Reseed empty clusters on the point farthest from its center.
+        for c in np.flatnonzero(~filled):
+            far = int(dist[np.arange(n), labels].argmax())
+            centers[c] = points[far]
+            labels[far] = c
+    return labels
+
+
+def sweep_labels(points: np.ndarray, k: int, demand: Optional[np.ndarray] = None) -> np.ndarray:
+    """Angular sectors around the origin (the depot) holding equal shares of demand.
+
+    The sweep starts at the widest angular gap so no dense group is cut by the seam.
+    """
+    n = len(points)
+    k = max(1, min(k, n))
+    if k == 1:
+        return np.zeros(n, dtype=np.intp)
+    angles = np.arctan2(points[:, 1], points[:, 0])
+    order = np.argsort(angles)
+    sorted_angles = angles[order]
+    gaps = np.diff(np.append(sorted_angles, sorted_angles[0] + 2 * np.pi))
+    order = np.roll(order, -(int(gaps.argmax()) + 1))
+
+    weight = np.ones(n) if demand is None or not np.any(demand > 0) else np.maximum(demand, 0) + 1e-9
+    cumulative = np.cumsum(weight[order])
+    sector = np.minimum((cumulative - weight[order] / 2) / cumulative[-1] * k, k - 1).astype(np.intp)
+    labels = np.empty(n, dtype=np.intp)
+    labels[order] = sector
+    return labels
+
+
+def cluster_points(
+    points_lonlat: Sequence[Sequence[float]],
+    depot_lonlat: Sequence[float],
+    demand: Optional[Sequence[float]] = None,
+    max_cluster_orders: int = DECOMPOSITION_MAX_CLUSTER_ORDERS,
+    method: str = DECOMPOSITION_METHOD,
+    max_clusters: Optional[int] = None,
+) -> List[List[int]]:
+    """Group order locations into zones of at most about `max_cluster_orders` orders.
+
+    Returns clusters as lists of order indices, largest first. `max_clusters`
+    (usually the fleet size) caps the count so every zone can get a vehicle.
+    """
+    pts = _planar(np.asarray(points_lonlat, dtype=np.float64).reshape(-1, 2), depot_lonlat)
+    n = len(pts)
+    if not n:
+        return []
+    k = max(1, math.ceil(n / max(1, max_cluster_orders)))
+    if max_clusters is not None:
+        k = max(1, min(k, max_clusters))
+    weights = None if demand is None else np.asarray(demand, dtype=np.float64)
+
+    if method == "sweep":
+        labels = sweep_labels(pts, k, weights)
+    else:
+        if method != "kmeans":
+            logger.warning("Unknown decomposition method %r, using kmeans", method)
+        labels = kmeans_labels(pts, k)
+
+    clusters = [np.flatnonzero(labels == c) for c in range(int(labels.max()) + 1)]
+    clusters = [c for c in clusters if len(c)]
+    if method != "sweep" and (max_clusters is None or len(clusters) < max_clusters):
+        # k-means ignores size; split zones that ended up far over the target.
+        out: List[np.ndarray] = []
+        while clusters:
+            c = clusters.pop()
+            room = max_clusters is None or len(out) + len(clusters) + 1 < max_clusters
+            if len(c) > _OVERSIZE * max_cluster_orders and room:
+                halves = kmeans_labels(pts[c], 2)
+                clusters.extend(c[halves == h] for h in (0, 1) if (halves == h).any())
+            else:
+                out.append(c)
+        clusters = out
+    clusters.sort(key=len, reverse=True)
+    return [c.tolist() for c in clusters]
+
+
+def allot_vehicles(
+    demands: np.ndarray,
+    capacities: np.ndarray,
+    required_skills: Optional[List[Set[str]]] = None,
+    vehicle_skills: Optional[List[Set[str]]] = None,
+) -> List[List[int]]:
+    """Share the fleet between clusters in proportion to their load.
+
+    `demands` is (clusters, 3): orders, weight, volume. `capacities` is
+    (vehicles, 2): weight, volume. Vehicles go largest first to the cluster
+    with the highest load per allotted capacity, so every cluster gets a
+    vehicle before any gets a second. Clusters short of weight or volume
+    capacity come first; after that orders count against the fleet's average
+    orders per vehicle. A vehicle carrying a skill some cluster still lacks
+    goes to such a cluster first.
+    """
+    demands = np.asarray(demands, dtype=np.float64).reshape(-1, 3)
+    capacities = np.asarray(capacities, dtype=np.float64).reshape(-1, 2)
+    k, m = len(demands), len(capacities)
+    required = required_skills or [set() for _ in range(k)]
+    skills = vehicle_skills or [set() for _ in range(m)]
+    allotted: List[List[int]] = [[] for _ in range(k)]
+    if not k or not m:
+        return allotted
+
+    orders_per_vehicle = max(demands[:, 0].sum() / m, 1.0)
+    assigned = np.zeros((k, 3))
+    missing = [set(r) for r in required]
+    for v in sorted(range(m), key=lambda i: (-capacities[i].sum(), i)):
+        cap = np.array([orders_per_vehicle, capacities[v, 0], capacities[v, 1]])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = np.where(assigned > 0, demands / assigned, np.where(demands > 0, np.inf, 0.0))
+        # Weight/volume shortfalls are hard and come first; the order count only balances the rest.
+        hard = ratio[:, 1:].max(axis=1)
+        load = np.where(hard > 1.0, _SHORTFALL + hard, np.maximum(hard, ratio[:, 0]))
+        load[np.array([not a for a in allotted])] = np.inf
+        wants_skill = np.array([bool(missing[c] & skills[v]) for c in range(k)])
+        candidates = np.flatnonzero(wants_skill) if wants_skill.any() else np.arange(k)
+        c = int(candidates[load[candidates].argmax()])
+        allotted[c].append(v)
+        assigned[c] += cap
+        missing[c] -= skills[v]
+    return allotted
+
+
+def _solve_cluster(job: Dict[str, Any]) -> Dict[str, Any]:
+    return solve_cvrptw(
+        pending_route_id=job["pending_route_id"],
+        depot=job["depot"],
+        orders=job["orders"],
+        vehicles=job["vehicles"],
+        duration_matrix=job["duration_matrix"],
+        reference_time_iso=job["reference_time_iso"],
+        service_time_seconds=job["service_time_seconds"],
+        time_limit_seconds=job["time_limit_seconds"],
+        portfolio=False,
+        # The parent picks each limit and logs each run, so workers stay off the database.
+        adaptive_time_limit=False,
+        log_run=False,
+    )
+
+
+def _failed(job: Dict[str, Any], error: str) -> Dict[str, Any]:
+    return {
+        "pending_route_id": job["pending_route_id"],
+        "reference_time": job["reference_time_iso"],
+        "status": "error",
+        "error": error[:200],
+        "vehicles": [],
+        "unassigned": [o.id for o in job["orders"]],
+    }
+
+
+def solve_clusters(
+    jobs: List[Dict[str, Any]],
+    workers: int = DECOMPOSITION_WORKERS,
+    adaptive_time_limit: Optional[bool] = None,
+) -> List[Dict[str, Any]]:
+    """Solve independent cluster jobs (`solve_cvrptw` keyword arguments) in worker processes.
+
+    Results come back in job order; a failed cluster leaves its orders unassigned.
+    Per-cluster time limits are predicted and runs logged here, in the parent.
+    """
+    if not jobs:
+        return []
+    features = [instance_features(job["orders"], len(job["vehicles"])) for job in jobs]
+    reports: List[Optional[Dict[str, Any]]] = [None] * len(jobs)
+    if SOLVER_ADAPTIVE_TIME_LIMIT if adaptive_time_limit is None else adaptive_time_limit:
+        jobs = [dict(job) for job in jobs]
+        for i, job in enumerate(jobs):
+            job["time_limit_seconds"], reports[i] = choose_time_limit(features[i], job["time_limit_seconds"])
+
+    results = _run_jobs(jobs, workers)
+    for job, feature, report, result in zip(jobs, features, reports, results):
+        search = result.get("solver_metadata", {}).get("search")
+        if search is not None and result.get("status") == "ok":
+            record_solver_run(feature, job["time_limit_seconds"], search)
+        if report is not None:
+            result.setdefault("solver_metadata", {})["time_limit_prediction"] = report
+    return results
+
+
+def _run_jobs(jobs: List[Dict[str, Any]], workers: int) -> List[Dict[str, Any]]:
+    if workers <= 1 or len(jobs) == 1:
+        results = []
+        for job in jobs:
+            try:
+                results.append(_solve_cluster(job))
+            except Exception as e:
+                logger.warning("Cluster solve failed: %s", e)
+                results.append(_failed(job, str(e)))
+        return results
+
+    # spawn: the parent may hold threads (matrix hedging, HTTP pools) that fork would copy mid-lock.
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs)), mp_context=ctx) as pool:
+        futures = [pool.submit(_solve_cluster, job) for job in jobs]
+        results = []
+        for job, future in zip(jobs, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.warning("Cluster solve failed: %s", e)
+                results.append(_failed(job, str(e)))
+    return results
+
+
+def merge_cluster_results(
+    pending_route_id: str,
+    reference_time_iso: str,
+    results: List[Dict[str, Any]],
+    cluster_ids: Optional[List[Any]] = None,
+) -> Dict[str, Any]:
+    """Combine per-cluster solver results into one standard result.
+
+    An order counts as unassigned only if no cluster (including a later
+    leftover pass) routed it.
+    """
+    cluster_ids = cluster_ids if cluster_ids is not None else list(range(len(results)))
+    routes: List[Dict[str, Any]] = []
+    served: Set[str] = set()
+    unassigned: List[str] = []
+    unreachable: List[str] = []
+    summary: List[Dict[str, Any]] = []
+    for cluster_id, result in zip(cluster_ids, results):
+        for route in result.get("vehicles", []):
+            routes.append({**route, "cluster_id": cluster_id})
+            served.update(s["id"] for s in route.get("stops", []) if s.get("kind") == "order")
+        unassigned.extend(result.get("unassigned", []))
+        unreachable.extend(result.get("unreachable", []))
+        search = result.get("solver_metadata", {}).get("search", {})
+        summary.append(
+            {
+                "cluster_id": cluster_id,
+                "status": result.get("status"),
+                "objective": result.get("objective"),
+                "routes": len(result.get("vehicles", [])),
+                "unassigned": len(result.get("unassigned", [])),
+                "seconds": search.get("seconds"),
+            }
+        )
+
+    seen: Set[str] = set()
+    remaining = [o for o in unassigned if o not in served and not (o in seen or seen.add(o))]
+    statuses = {r.get("status") for r in results}
+    status = "ok" if "ok" in statuses else ("no_solution" if "no_solution" in statuses else "error")
+    merged: Dict[str, Any] = {
+        "pending_route_id": pending_route_id,
+        "reference_time": reference_time_iso,
+        "status": status,
+        "vehicles": routes,
+        "unassigned": remaining,
+        "solver_metadata": {"decomposition": {"clusters": summary}},
+    }
+    if unreachable:
+        merged["unreachable"] = sorted(set(unreachable))
+    return merged
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+from typing import Any, Iterator, List, Sequence, Union
+
+import numpy as np
+
+
+class DurationMatrix:
+    """Square travel-time matrix (seconds) backed by one contiguous int32 buffer.
+
+    Rows are zero-copy NumPy views, so ``matrix[i][j]`` keeps working for code
+    written against nested lists; use ``tolist()`` when plain lists are needed.
+    """
+
+    __slots__ = ("_data",)
+
+    def __init__(self, data: Any):
+        arr = np.ascontiguousarray(data, dtype=np.int32)
+        if arr.size == 0:
+            arr = arr.reshape(0, 0)
+        if arr.ndim != 2 or arr.shape[0] != arr.shape[1]:
+            raise ValueError(f"duration matrix must be square, got shape {arr.shape}")
+        self._data = arr
+
+    @classmethod
+    def coerce(cls, value: "MatrixLike") -> "DurationMatrix":
+        if isinstance(value, cls):
+            return value
+        return cls(value)
+
+    @classmethod
+    def zeros(cls, n: int) -> "DurationMatrix":
+        return cls(np.zeros((n, n), dtype=np.int32))
+
+    @property
+    def array(self) -> np.ndarray:
+        return self._data
+
+    @property
+    def shape(self):
+        return self._data.shape
+
+    @property
+    def nbytes(self) -> int:
+        return int(self._data.nbytes)
+
+    def __len__(self) -> int:
+        return self._data.shape[0]
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        return iter(self._data)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, DurationMatrix):
+            return np.array_equal(self._data, other._data)
+        if isinstance(other, (list, np.ndarray)):
+            return np.array_equal(self._data, np.asarray(other))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"DurationMatrix({len(self)}x{len(self)}, {self.nbytes} bytes)"
+
+    def take(self, indices: Sequence[int]) -> "DurationMatrix":
+        """Sub-matrix for the given location indices (in that order)."""
+        idx = np.asarray(indices, dtype=np.intp)
+        return DurationMatrix(self._data[np.ix_(idx, idx)])
+
+    def tolist(self) -> List[List[int]]:
+        return self._data.tolist()
+
+    def tobytes(self) -> bytes:
+        """Little-endian int32 cells, row-major; the square shape is implied by the length."""
+        return self._data.astype("<i4", copy=False).tobytes()
+
+    @classmethod
+    def frombytes(cls, data: bytes) -> "DurationMatrix":
+        cells = np.frombuffer(data, dtype="<i4")
+        n = int(round(np.sqrt(cells.size)))
+        if n * n != cells.size:
+            raise ValueError(f"{cells.size} cells do not form a square duration matrix")
+        return cls(cells.reshape(n, n))
+
+
+MatrixLike = Union[DurationMatrix, np.ndarray, Sequence[Sequence[int]]]
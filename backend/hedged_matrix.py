@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from dataclasses import fields
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from backend.duration_matrix import DurationMatrix
+from backend.matrix_cache import MISSING, CacheStats, get_cache, location_keys
+from backend.ors import ORS_PROFILE, UNREACHABLE
+from backend.ors_fallback import estimate_duration_matrix
+from backend.traffic_buckets import active_bucket, congestion_factors
+
+logger = logging.getLogger(__name__)
+
+# Hard bound on the ORS matrix stage: past it, whatever ORS delivered is topped up with
+# estimates and the solver starts. 0 waits for ORS as before.
+MATRIX_HEDGE_DEADLINE_SECONDS = float(os.environ.get("MATRIX_HEDGE_DEADLINE_SECONDS", "0"))
+# How long a finishing process waits for late ORS results to reach the caches.
+MATRIX_HEDGE_DRAIN_SECONDS = float(os.environ.get("MATRIX_HEDGE_DRAIN_SECONDS", "60"))
+
+_late: List[threading.Thread] = []
+_late_lock = threading.Lock()
+
+
+def _merge_counts(into: CacheStats, other: CacheStats) -> None:
+    for f in fields(CacheStats):
+        value = getattr(other, f.name)
+        if isinstance(value, int):
+            setattr(into, f.name, getattr(into, f.name) + value)
+        elif value is not None:
+            setattr(into, f.name, value)
+
+
+def _partial_matrix(
+    locations_lonlat: Sequence[Sequence[float]],
+    estimate: np.ndarray,
+    reference_time_iso: Optional[str],
+) -> Tuple[np.ndarray, np.ndarray, float]:
+    """Cached ORS cells (tiles are cached as they land) with estimates everywhere else."""
+    keys = location_keys(locations_lonlat)
+    matrix = get_cache().lookup(ORS_PROFILE, keys, CacheStats())
+    known = (matrix != MISSING) & (matrix < UNREACHABLE)
+    np.fill_diagonal(known, True)
+
+    scaled = ~np.eye(len(matrix), dtype=bool) & known & (estimate > 0)
+    ratio = float(np.median(matrix[scaled] / estimate[scaled])) if scaled.any() else 1.0
+    ratio = float(np.clip(ratio, 0.5, 3.0))
+    out = np.where(known, matrix, np.rint(estimate * ratio)).astype(np.float64)
+
+    bucket = active_bucket(reference_time_iso)
+    if bucket is not None:
+        out *= congestion_factors()[bucket]
+    np.fill_diagonal(out, 0)
+    return np.rint(out).astype(np.int32), known, ratio
+
+
+def hedged_duration_matrix(
+    locations_lonlat: Sequence[Sequence[float]],
+    build: Callable[[CacheStats], DurationMatrix],
+    deadline_seconds: float,
+    stats: Optional[CacheStats] = None,
+    reference_time_iso: Optional[str] = None,
+) -> DurationMatrix:
+    """Race `build` (the ORS path) against the estimator, returning the best matrix at the deadline.
+
+    `build` keeps running after the deadline so late tiles still reach the
+    travel-time cache, the shared store and the lineage snapshot; call
+    `drain_late_builds` before the process exits.
+    """
+    stats = stats if stats is not None else CacheStats()
+    started = time.monotonic()
+    inner = CacheStats()
+    box: Dict[str, Any] = {}
+
+    def run() -> None:
+        try:
+            box["matrix"] = build(inner)
+        except Exception as e:
+            box["error"] = e
+            logger.warning("Hedged ORS matrix build failed: %s", e)
+        finally:
+            box["seconds"] = time.monotonic() - started
+
+    worker = threading.Thread(target=run, name="matrix-hedge", daemon=True)
+    worker.start()
+    estimate = estimate_duration_matrix(locations_lonlat)
+    worker.join(max(0.0, deadline_seconds - (time.monotonic() - started)))
+
+    if "matrix" in box:
+        _merge_counts(stats, inner)
+        stats.hedge = {"completed": True, "seconds": round(box["seconds"], 3)}
+        return box["matrix"]
+    if "error" in box:
+        # Failed before the deadline: let the caller fall through to its next strategy.
+        raise box["error"]
+    with _late_lock:
+        _late.append(worker)
+
+    matrix, known, ratio = _partial_matrix(locations_lonlat, estimate, reference_time_iso)
+    estimated = int((~known).sum())
+    stats.estimated += estimated
+    stats.hedge = {
+        "completed": False,
+        "deadline_seconds": deadline_seconds,
+        "ors_cells": int(known.sum()) - len(known),
+        "estimated_cells": estimated,
+        "estimate_ratio": round(ratio, 3),
+    }
+    logger.warning(
+        "ORS matrix missed the %.1fs deadline: %s cells from ORS/cache, %s estimated (ratio %.2f)",
+        deadline_seconds,
+        stats.hedge["ors_cells"],
+        estimated,
+        ratio,
+    )
+    return DurationMatrix(matrix)
+
+
+def drain_late_builds(timeout: float = MATRIX_HEDGE_DRAIN_SECONDS) -> None:
+    """Give ORS builds that missed their deadline up to `timeout` seconds to finish caching."""
+    deadline = time.monotonic() + timeout
+    with _late_lock:
+        pending = list(_late)
+        _late.clear()
+    for worker in pending:
+        worker.join(max(0.0, deadline - time.monotonic()))
+    still = sum(1 for w in pending if w.is_alive())
+    if still:
+        logger.warning("%s late ORS matrix build(s) still running at exit; their remaining tiles are lost", still)
@@ -0,0 +1,508 @@
+from __future__ import annotations
+
+import argparse
+import bz2
+import gzip
+import heapq
+import json
+import logging
+import os
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import orjson
+
+from backend.duration_matrix import DurationMatrix
+from backend.logging_utils import setup_logging
+from backend.matrix_cache import CacheStats
+from backend.ors_fallback import haversine_km_matrix
+
+logger = logging.getLogger(__name__)
+
+UNREACHABLE = 10**9
+
+# Artifact directory produced by `python -m backend.local_router build`.
+LOCAL_ROUTER_GRAPH = os.environ.get("LOCAL_ROUTER_GRAPH", "")
+# Speed used for the straight-line hop between a location and its snapped graph node.
+LOCAL_ROUTER_ACCESS_SPEED_KMH = float(os.environ.get("LOCAL_ROUTER_ACCESS_SPEED_KMH", "20"))
+# Witness searches stop after this many settled nodes (more shortcuts, faster build).
+LOCAL_ROUTER_WITNESS_LIMIT = int(os.environ.get("LOCAL_ROUTER_WITNESS_LIMIT", "60"))
+
+HIGHWAY_SPEEDS_KMH: Dict[str, float] = {
+    "motorway": 100,
+    "motorway_link": 60,
+    "trunk": 80,
+    "trunk_link": 50,
+    "primary": 60,
+    "primary_link": 40,
+    "secondary": 50,
+    "secondary_link": 40,
+    "tertiary": 40,
+    "tertiary_link": 30,
+    "unclassified": 30,
+    "residential": 25,
+    "road": 25,
+    "living_street": 10,
+    "service": 15,
+}
+
+_GRID_DEG = 0.01
+_ARTIFACT_FILES = (
+    "coords",
+    "fwd_indptr",
+    "fwd_indices",
+    "fwd_weights",
+    "bwd_indptr",
+    "bwd_indices",
+    "bwd_weights",
+)
+
+
+def _open_osm(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    return open(path, "rb")
+
+
+def _parse_maxspeed(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    m = re.match(r"\s*(\d+(?:\.\d+)?)\s*(mph)?", value)
+    if not m:
+        return None
+    speed = float(m.group(1))
+    return speed * 1.609 if m.group(2) else speed
+
+
+def parse_osm(path: str) -> Tuple[np.ndarray, List[Tuple[int, int, float]]]:
+    """Read drivable ways from an OSM XML extract into node coordinates and timed edges."""
+    node_coords: Dict[str, Tuple[float, float]] = {}
+    ways: List[Tuple[List[str], float, int]] = []
+
+    with _open_osm(path) as fh:
+        for _, elem in ET.iterparse(fh, events=("end",)):
+            if elem.tag == "node":
+                node_coords[elem.get("id")] = (float(elem.get("lon")), float(elem.get("lat")))
+            elif elem.tag == "way":
+                tags = {t.get("k"): t.get("v") for t in elem.iter("tag")}
+                highway = tags.get("highway")
+                if highway in HIGHWAY_SPEEDS_KMH and tags.get("access") not in ("no", "private") and tags.get("area") != "yes":
+                    speed = _parse_maxspeed(tags.get("maxspeed")) or HIGHWAY_SPEEDS_KMH[highway]
+                    oneway = tags.get("oneway")
+                    if oneway in ("yes", "true", "1"):
+                        direction = 1
+                    elif oneway in ("-1", "reverse"):
+                        direction = -1
+                    elif oneway != "no" and (tags.get("junction") == "roundabout" or highway == "motorway"):
+                        direction = 1
+                    else:
+                        direction = 0
+                    refs = [nd.get("ref") for nd in elem.iter("nd")]
+                    if len(refs) >= 2:
+                        ways.append((refs, speed, direction))
+                elem.clear()
+            elif elem.tag == "relation":
+                elem.clear()
+
+    index: Dict[str, int] = {}
+    coords: List[Tuple[float, float]] = []
+    raw_edges: List[Tuple[int, int]] = []
+    speeds: List[Tuple[float, int]] = []
+    for refs, speed, direction in ways:
+        refs = [r for r in refs if r in node_coords]
+        for a, b in zip(refs, refs[1:]):
+            for ref in (a, b):
+                if ref not in index:
+                    index[ref] = len(coords)
+                    coords.append(node_coords[ref])
+            raw_edges.append((index[a], index[b]))
+            speeds.append((speed, direction))
+
+    coords_arr = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if not raw_edges:
+        return coords_arr, []
+
+    pairs = np.asarray(raw_edges, dtype=np.int64)
+    a, b = coords_arr[pairs[:, 0]], coords_arr[pairs[:, 1]]
+    lat1, lat2 = np.radians(a[:, 1]), np.radians(b[:, 1])
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(np.radians(b[:, 0] - a[:, 0]) / 2) ** 2
+    km = 2 * 6371.0 * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+    edges: List[Tuple[int, int, float]] = []
+    for (u, v), dist, (speed, direction) in zip(raw_edges, km.tolist(), speeds):
+        seconds = dist / speed * 3600.0
+        if direction >= 0:
+            edges.append((u, v, seconds))
+        if direction <= 0:
+            edges.append((v, u, seconds))
+    return coords_arr, edges
+
+
+def _largest_component(n: int, edges: List[Tuple[int, int, float]]) -> np.ndarray:
+    parent = list(range(n))
+
+    def find(x: int) -> int:
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for u, v, _ in edges:
+        ru, rv = find(u), find(v)
+        if ru != rv:
+            parent[ru] = rv
+    roots = np.asarray([find(x) for x in range(n)], dtype=np.int64)
+    values, counts = np.unique(roots, return_counts=True)
+    return roots == values[counts.argmax()]
+
+
+def contract_graph(
+    n: int,
+    edges: List[Tuple[int, int, float]],
+    witness_limit: int = LOCAL_ROUTER_WITNESS_LIMIT,
+) -> Tuple[List[List[Tuple[int, float]]], List[List[Tuple[int, float]]]]:
+    """Contraction hierarchy: returns upward forward and upward backward adjacency."""
+    out: List[Dict[int, float]] = [dict() for _ in range(n)]
+    inn: List[Dict[int, float]] = [dict() for _ in range(n)]
+    for u, v, w in edges:
+        if u != v and w < out[u].get(v, float("inf")):
+            out[u][v] = w
+            inn[v][u] = w
+
+    deleted = [0] * n
+    up_fwd: List[List[Tuple[int, float]]] = [[] for _ in range(n)]
+    up_bwd: List[List[Tuple[int, float]]] = [[] for _ in range(n)]
+
+    def witness(source: int, skip: int, bound: float, targets: Dict[int, float]) -> Dict[int, float]:
+        dist = {source: 0.0}
+        heap = [(0.0, source)]
+        settled = 0
+        remaining = set(targets)
+        while heap and settled < witness_limit and remaining:
+            d, x = heapq.heappop(heap)
+            if d > dist.get(x, float("inf")):
+                continue
+            if d > bound:
+                break
+            settled += 1
+            remaining.discard(x)
+            for y, w in out[x].items():
+                if y == skip:
+                    continue
+                nd = d + w
+                if nd < dist.get(y, float("inf")):
+                    dist[y] = nd
+                    heapq.heappush(heap, (nd, y))
+        return dist
+
+    def shortcuts(v: int) -> List[Tuple[int, int, float]]:
+        result = []
+        outs = out[v]
+        if not outs:
+            return result
+        for u, wu in inn[v].items():
+            targets = {w: wu + ww for w, ww in outs.items() if w != u}
+            if not targets:
+                continue
+            dist = witness(u, v, max(targets.values()), targets)
+            for w, via in targets.items():
+                if dist.get(w, float("inf")) > via:
+                    result.append((u, w, via))
+        return result
+
+    def priority(v: int) -> Tuple[int, List[Tuple[int, int, float]]]:
+        sc = shortcuts(v)
+        return len(sc) - len(inn[v]) - len(out[v]) + deleted[v], sc
+
+    heap = [(priority(v)[0], v) for v in range(n)]
+    heapq.heapify(heap)
+    done = 0
+    started = time.monotonic()
+    while heap:
+        _, v = heapq.heappop(heap)
+        prio, sc = priority(v)
+        if heap and prio > heap[0][0]:
+            heapq.heappush(heap, (prio, v))
+            continue
+
+        up_fwd[v] = list(out[v].items())
+        up_bwd[v] = list(inn[v].items())
+        for w in out[v]:
+            del inn[w][v]
+            deleted[w] += 1
+        for u in inn[v]:
+            del out[u][v]
+            deleted[u] += 1
+        out[v] = {}
+        inn[v] = {}
+        for u, w, via in sc:
+            if via < out[u].get(w, float("inf")):
+                out[u][w] = via
+                inn[w][u] = via
+
+        done += 1
+        if done % 10000 == 0:
+            logger.info("Contracted %s/%s nodes (%.0fs)", done, n, time.monotonic() - started)
+
+    return up_fwd, up_bwd
+
+
+def _to_csr(adj: List[List[Tuple[int, float]]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    indptr = np.zeros(len(adj) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(a) for a in adj])
+    indices = np.fromiter((v for a in adj for v, _ in a), dtype=np.int32, count=int(indptr[-1]))
+    weights = np.fromiter((w for a in adj for _, w in a), dtype=np.float32, count=int(indptr[-1]))
+    return indptr, indices, weights
+
+
+def build_artifact(osm_path: str, out_dir: str) -> Dict[str, int]:
+    """Parse an OSM extract, contract it and write the memory-mappable artifact."""
+    started = time.monotonic()
+    coords, edges = parse_osm(osm_path)
+    if not edges:
+        raise RuntimeError(f"No drivable ways found in {osm_path}")
+
+    keep = _largest_component(len(coords), edges)
+    remap = np.full(len(coords), -1, dtype=np.int64)
+    remap[keep] = np.arange(int(keep.sum()))
+    coords = coords[keep]
+    edges = [(int(remap[u]), int(remap[v]), w) for u, v, w in edges if keep[u] and keep[v]]
+    logger.info("Parsed %s nodes / %s edges from %s", len(coords), len(edges), osm_path)
+
+    up_fwd, up_bwd = contract_graph(len(coords), edges)
+    arrays = {"coords": coords}
+    for prefix, adj in (("fwd", up_fwd), ("bwd", up_bwd)):
+        indptr, indices, weights = _to_csr(adj)
+        arrays[f"{prefix}_indptr"] = indptr
+        arrays[f"{prefix}_indices"] = indices
+        arrays[f"{prefix}_weights"] = weights
+
+    os.makedirs(out_dir, exist_ok=True)
+    for name in _ARTIFACT_FILES:
+        np.save(os.path.join(out_dir, f"{name}.npy"), arrays[name])
+
+    meta = {
+        "source": os.path.basename(osm_path),
+        "nodes": int(len(coords)),
+        "edges": int(len(edges)),
+        "upward_edges": int(len(arrays["fwd_indices"]) + len(arrays["bwd_indices"])),
+        "built_at": int(time.time()),
+    }
+    with open(os.path.join(out_dir, "meta.json"), "w") as fh:
+        json.dump(meta, fh)
+    logger.info("Local router artifact written to %s in %.0fs: %s", out_dir, time.monotonic() - started, meta)
+    return meta
+
+
+class LocalRouter:
+    """Many-to-many durations over a memory-mapped contraction hierarchy."""
+
+    def __init__(self, artifact_dir: str):
+        self.artifact_dir = artifact_dir
+        arrays = {name: np.load(os.path.join(artifact_dir, f"{name}.npy"), mmap_mode="r") for name in _ARTIFACT_FILES}
+        self.coords = arrays["coords"]
+        self._fwd = (arrays["fwd_indptr"], arrays["fwd_indices"], arrays["fwd_weights"])
+        self._bwd = (arrays["bwd_indptr"], arrays["bwd_indices"], arrays["bwd_weights"])
+
+        cells = np.floor(np.asarray(self.coords) / _GRID_DEG).astype(np.int64)
+        order = np.lexsort((cells[:, 1], cells[:, 0]))
+        keys, starts = np.unique(cells[order], axis=0, return_index=True)
+        ends = np.append(starts[1:], len(order))
+        self._grid = {(int(k[0]), int(k[1])): order[s:e] for k, s, e in zip(keys, starts, ends)}
+
+    def snap(self, locations_lonlat: Sequence[Sequence[float]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Nearest graph node per location plus the access time (seconds) to reach it."""
+        nodes = np.zeros(len(locations_lonlat), dtype=np.int64)
+        access = np.zeros(len(locations_lonlat), dtype=np.float64)
+        for k, (lon, lat) in enumerate(locations_lonlat):
+            cx, cy = int(np.floor(lon / _GRID_DEG)), int(np.floor(lat / _GRID_DEG))
+            candidates: List[np.ndarray] = []
+            ring = 1
+            while not candidates and ring <= 64:
+                candidates = [
+                    self._grid[(cx + dx, cy + dy)]
+                    for dx in range(-ring, ring + 1)
+                    for dy in range(-ring, ring + 1)
+                    if (cx + dx, cy + dy) in self._grid
+                ]
+                ring *= 2
+            if not candidates:
+                raise RuntimeError(f"Location {lon},{lat} is outside the local road graph")
+            ids = np.concatenate(candidates)
+            km = haversine_km_matrix([[lon, lat]], self.coords[ids])[0]
+            best = int(km.argmin())
+            nodes[k] = ids[best]
+            access[k] = km[best] / LOCAL_ROUTER_ACCESS_SPEED_KMH * 3600.0
+        return nodes, access
+
+    @staticmethod
+    def _upward(graph, node: int, offset: float) -> Dict[int, float]:
+        indptr, indices, weights = graph
+        dist = {node: offset}
+        heap = [(offset, node)]
+        settled: Dict[int, float] = {}
+        while heap:
+            d, x = heapq.heappop(heap)
+            if x in settled:
+                continue
+            settled[x] = d
+            lo, hi = int(indptr[x]), int(indptr[x + 1])
+            for y, w in zip(indices[lo:hi].tolist(), weights[lo:hi].tolist()):
+                nd = d + w
+                if nd < dist.get(y, float("inf")):
+                    dist[y] = nd
+                    heapq.heappush(heap, (nd, y))
+        return settled
+
+    def durations(
+        self,
+        sources_lonlat: Sequence[Sequence[float]],
+        destinations_lonlat: Sequence[Sequence[float]],
+    ) -> np.ndarray:
+        """Sources x destinations int32 seconds; UNREACHABLE where no path exists."""
+        src_nodes, src_access = self.snap(sources_lonlat)
+        dst_nodes, dst_access = self.snap(destinations_lonlat)
+
+        # Bucket many-to-many: backward upward searches fill per-node buckets,
+        # forward upward searches from each source scan them.
+        buckets: Dict[int, Tuple[List[int], List[float]]] = {}
+        for t, (node, off) in enumerate(zip(dst_nodes.tolist(), dst_access.tolist())):
+            for x, d in self._upward(self._bwd, node, off).items():
+                entry = buckets.setdefault(x, ([], []))
+                entry[0].append(t)
+                entry[1].append(d)
+        packed = {x: (np.asarray(ts, dtype=np.int64), np.asarray(ds)) for x, (ts, ds) in buckets.items()}
+
+        best = np.full((len(src_nodes), len(dst_nodes)), np.inf)
+        for s, (node, off) in enumerate(zip(src_nodes.tolist(), src_access.tolist())):
+            row = best[s]
+            for x, d in self._upward(self._fwd, node, off).items():
+                entry = packed.get(x)
+                if entry is not None:
+                    ts, ds = entry
+                    row[ts] = np.minimum(row[ts], ds + d)
+
+        out = np.full(best.shape, UNREACHABLE, dtype=np.int32)
+        finite = np.isfinite(best)
+        out[finite] = best[finite].astype(np.int32)
+        return out
+
+
+_router: Optional[LocalRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_router(artifact_dir: Optional[str] = None) -> LocalRouter:
+    global _router
+    with _router_lock:
+        if artifact_dir is None and _router is not None:
+            return _router
+        path = artifact_dir or LOCAL_ROUTER_GRAPH
+        if not path:
+            raise RuntimeError("LOCAL_ROUTER_GRAPH is required")
+        if _router is None or _router.artifact_dir != path:
+            _router = LocalRouter(path)
+        return _router
+
+
+def is_available() -> bool:
+    return bool(LOCAL_ROUTER_GRAPH) and os.path.exists(os.path.join(LOCAL_ROUTER_GRAPH, "meta.json"))
+
+
+def get_duration_matrix_local(
+    locations_lonlat: List[List[float]],
+    stats: Optional[CacheStats] = None,
+) -> DurationMatrix:
+    """Drop-in replacement for backend.ors.get_duration_matrix using the local graph."""
+    started = time.monotonic()
+    router = get_router()
+    matrix = router.durations(locations_lonlat, locations_lonlat)
+    np.fill_diagonal(matrix, 0)
+    logger.info(
+        "Local router matrix %sx%s in %.2fs",
+        len(locations_lonlat),
+        len(locations_lonlat),
+        time.monotonic() - started,
+    )
+    return DurationMatrix(matrix)
+
+
+class _MatrixHandler(BaseHTTPRequestHandler):
+    """ORS-compatible `POST /v2/matrix/<profile>` endpoint."""
+
+    def do_POST(self) -> None:
+        if not self.path.rstrip("/").startswith("/v2/matrix/"):
+            self._reply(404, {"error": "not found"})
+            return
+        try:
+            body = orjson.loads(self.rfile.read(int(self.headers.get("Content-Length", "0"))))
+            locations = body["locations"]
+            sources = body.get("sources") or list(range(len(locations)))
+            destinations = body.get("destinations") or list(range(len(locations)))
+            matrix = get_router().durations(
+                [locations[i] for i in sources],
+                [locations[j] for j in destinations],
+            )
+        except (KeyError, IndexError, TypeError, ValueError, RuntimeError) as e:
+            self._reply(400, {"error": str(e)})
+            return
+
+        durations = [[None if x >= UNREACHABLE else int(x) for x in row] for row in matrix.tolist()]
+        self._reply(
+            200,
+            {
+                "durations": durations,
+                "sources": [{"location": locations[i]} for i in sources],
+                "destinations": [{"location": locations[j]} for j in destinations],
+                "metadata": {"engine": "local_router"},
+            },
+        )
+
+    def _reply(self, status: int, payload: Dict) -> None:
+        data = orjson.dumps(payload)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, fmt: str, *args) -> None:
+        logger.debug(fmt, *args)
+
+
+def serve(host: str = "127.0.0.1", port: int = 8080) -> None:
+    server = ThreadingHTTPServer((host, port), _MatrixHandler)
+    logger.info("Local router serving ORS-compatible matrix API on http://%s:%s/v2/matrix/driving-car", host, port)
+    server.serve_forever()
+
+
+def main() -> None:
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description="Offline road-network matrix engine")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_cmd = sub.add_parser("build", help="preprocess an OSM XML extract")
+    build_cmd.add_argument("osm_path")
+    build_cmd.add_argument("out_dir")
+    serve_cmd = sub.add_parser("serve", help="expose the artifact as an ORS-compatible matrix API")
+    serve_cmd.add_argument("--graph", default=LOCAL_ROUTER_GRAPH)
+    serve_cmd.add_argument("--host", default="127.0.0.1")
+    serve_cmd.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_artifact(args.osm_path, args.out_dir)
+    else:
+        get_router(args.graph)
+        serve(args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+from __future__ import annotations
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 5 decimals ~= 1.1 m, enough to treat repeated geocodes of one address as one point.
+COORD_PRECISION = int(os.environ.get("TRAVEL_TIME_CACHE_PRECISION", "5"))
+
+# Marks cells of a looked-up matrix that no tier has seen yet.
+MISSING = -1
+
+LocationKey = Tuple[int, int]
+CellKey = Tuple[str, LocationKey, LocationKey]
+
+
+def quantize(lon: float, lat: float, precision: int = COORD_PRECISION) -> LocationKey:
+    scale = 10**precision
+    return (int(round(float(lon) * scale)), int(round(float(lat) * scale)))
+
+
+def location_keys(locations_lonlat: Sequence[Sequence[float]]) -> List[LocationKey]:
+    return [quantize(lon, lat) for lon, lat in locations_lonlat]
+
+
+@dataclass
+class CacheStats:
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    stored: int = 0
+    shared_loaded: int = 0
+    shared_written: int = 0
+    bucket_hits: int = 0
+    bucket_filled: int = 0
+    rate_limited: int = 0
+    estimated: int = 0
+    coalesced: int = 0
+    # Cells sent to ORS, counting the unwanted cells a sources x destinations tile also carries.
+    requested: int = 0
+    # Mirroring report of the symmetric directions mode (see ors_directions.mirror_upper).
+    asymmetry: Optional[Dict[str, Any]] = None
+    # Outcome of a hedged build (see hedged_matrix.hedged_duration_matrix).
+    hedge: Optional[Dict[str, Any]] = None
+
+    @property
+    def hits(self) -> int:
+        return self.memory_hits + self.disk_hits
+
+    def as_dict(self) -> Dict[str, Any]:
+        out = asdict(self)
+        out["hits"] = self.hits
+        return out
+
+
+class TravelTimeCache:
+    """Two-tier (LRU + SQLite) store of ORS durations keyed by quantized coordinates."""
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = 500_000):
+        self.path = path or None
+        self.max_entries = max(0, int(max_entries))
+        self._lru: "OrderedDict[CellKey, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if self.path:
+            self._db = self._open(self.path)
+
+    @staticmethod
+    def _open(path: str) -> Optional[sqlite3.Connection]:
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            conn.execute("pragma journal_mode=wal")
+            conn.execute("pragma synchronous=normal")
+            conn.execute(
+                """
+                create table if not exists travel_times (
+                  profile text not null,
+                  src_lon integer not null,
+                  src_lat integer not null,
+                  dst_lon integer not null,
+                  dst_lat integer not null,
+                  duration integer not null,
+                  updated_at real not null,
+                  primary key (profile, src_lon, src_lat, dst_lon, dst_lat)
+                ) without rowid
+                """
+            )
+            return conn
+        except sqlite3.Error as e:
+            logger.warning("Travel-time disk cache disabled (%s): %s", path, e)
+            return None
+
+    def _remember(self, key: CellKey, duration: int) -> None:
+        if not self.max_entries:
+            return
+        self._lru[key] = duration
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def lookup(
+        self,
+        profile: str,
+        keys: Sequence[LocationKey],
+        stats: Optional[CacheStats] = None,
+    ) -> np.ndarray:
+        """Return an NxN int32 matrix for `keys` with MISSING for cells never seen before."""
+        stats = stats if stats is not None else CacheStats()
+        n = len(keys)
+        matrix = np.full((n, n), MISSING, dtype=np.int32)
+        pending: List[Tuple[int, int]] = []
+
+        with self._lock:
+            for i, src in enumerate(keys):
+                row = [MISSING] * n
+                for j, dst in enumerate(keys):
+                    if i == j or src == dst:
+                        row[j] = 0
+                        continue
+                    cell = (profile, src, dst)
+                    value = self._lru.get(cell)
+                    if value is None:
+                        pending.append((i, j))
+                        continue
+                    self._lru.move_to_end(cell)
+                    row[j] = value
+                    stats.memory_hits += 1
+                matrix[i] = row
+
+            if pending and self._db is not None:
+                stored = self._fetch_disk(profile, keys)
+                still_missing = []
+                for i, j in pending:
+                    value = stored.get((keys[i], keys[j]))
+                    if value is None:
+                        still_missing.append((i, j))
+                        continue
+                    matrix[i, j] = value
+                    self._remember((profile, keys[i], keys[j]), value)
+                    stats.disk_hits += 1
+                pending = still_missing
+
+        stats.misses += len(pending)
+        return matrix
+
+    def lookup_pairs(
+        self,
+        profile: str,
+        keys: Sequence[LocationKey],
+        rows: np.ndarray,
+        cols: np.ndarray,
+        stats: Optional[CacheStats] = None,
+    ) -> np.ndarray:
+        """Durations for the given (row, col) cells only, MISSING where never seen."""
+        stats = stats if stats is not None else CacheStats()
+        out = np.full(len(rows), MISSING, dtype=np.int32)
+        pending: List[int] = []
+
+        with self._lock:
+            for p, (i, j) in enumerate(zip(np.asarray(rows).tolist(), np.asarray(cols).tolist())):
+                src, dst = keys[i], keys[j]
+                if src == dst:
+                    out[p] = 0
+                    continue
+                cell = (profile, src, dst)
+                value = self._lru.get(cell)
+                if value is None:
+                    pending.append(p)
+                    continue
+                self._lru.move_to_end(cell)
+                out[p] = value
+                stats.memory_hits += 1
+
+            if pending and self._db is not None:
+                stored = self._fetch_disk(profile, keys)
+                still_missing = []
+                for p in pending:
+                    src, dst = keys[int(rows[p])], keys[int(cols[p])]
+                    value = stored.get((src, dst))
+                    if value is None:
+                        still_missing.append(p)
+                        continue
+                    out[p] = value
+                    self._remember((profile, src, dst), value)
+                    stats.disk_hits += 1
+                pending = still_missing
+
+        stats.misses += len(pending)
+        return out
+
+    def _fetch_disk(self, profile: str, keys: Sequence[LocationKey]) -> Dict[Tuple[LocationKey, LocationKey], int]:
+        assert self._db is not None
+        cur = self._db.cursor()
+        try:
+            cur.execute("create temp table if not exists _loc (lon integer not null, lat integer not null)")
+            cur.execute("delete from _loc")
+            cur.executemany("insert into _loc (lon, lat) values (?, ?)", set(keys))
+            cur.execute(
+                """
+                select t.src_lon, t.src_lat, t.dst_lon, t.dst_lat, t.duration
+                from travel_times t
+                join _loc s on s.lon = t.src_lon and s.lat = t.src_lat
+                join _loc d on d.lon = t.dst_lon and d.lat = t.dst_lat
+                where t.profile = ?
+                """,
+                (profile,),
+            )
+            return {((a, b), (c, d)): int(dur) for a, b, c, d, dur in cur.fetchall()}
+        except sqlite3.Error as e:
+            logger.warning("Travel-time disk cache read failed: %s", e)
+            return {}
+        finally:
+            cur.close()
+
+    def store(
+        self,
+        profile: str,
+        cells: Iterable[Tuple[LocationKey, LocationKey, int]],
+        stats: Optional[CacheStats] = None,
+    ) -> None:
+        rows = []
+        now = time.time()
+        with self._lock:
+            for src, dst, duration in cells:
+                if src == dst:
+                    continue
+                self._remember((profile, src, dst), int(duration))
+                rows.append((profile, src[0], src[1], dst[0], dst[1], int(duration), now))
+
+            if rows and self._db is not None:
+                try:
+                    self._db.execute("begin")
+                    self._db.executemany(
+                        "insert or replace into travel_times values (?, ?, ?, ?, ?, ?, ?)",
+                        rows,
+                    )
+                    self._db.execute("commit")
+                except sqlite3.Error as e:
+                    logger.warning("Travel-time disk cache write failed: %s", e)
+                    try:
+                        self._db.execute("rollback")
+                    except sqlite3.Error:
+                        pass
+
+        if stats is not None:
+            stats.stored += len(rows)
+
+    def export_cells(self, profile: str) -> np.ndarray:
+        """All disk-tier cells for `profile` as an (n, 5) int64 array: src lon/lat, dst lon/lat, duration."""
+        if self._db is None:
+            return np.zeros((0, 5), dtype=np.int64)
+        with self._lock:
+            rows = self._db.execute(
+                "select src_lon, src_lat, dst_lon, dst_lat, duration from travel_times where profile = ?",
+                (profile,),
+            ).fetchall()
+        return np.asarray(rows, dtype=np.int64).reshape(-1, 5)
+
+
+_cache: Optional[TravelTimeCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> TravelTimeCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            default_path = os.path.join(os.path.expanduser("~"), ".cache", "route_optimizer", "travel_times.sqlite3")
+            _cache = TravelTimeCache(
+                path=os.environ.get("TRAVEL_TIME_CACHE_PATH", default_path),
+                max_entries=int(os.environ.get("TRAVEL_TIME_CACHE_MAX_ENTRIES", "500000")),
+            )
+        return _cache
+
+
+def cover_missing(missing: np.ndarray) -> List[Tuple[List[int], List[int]]]:
+    """Group missing cells into (sources, destinations) blocks to request from ORS.
+
+    Greedily picks the row or column with the most uncovered missing cells, so a
+    single new location costs one row plus one column instead of the full matrix.
+    """
+    remaining = np.array(missing, dtype=bool, copy=True)
+    row_counts = remaining.sum(axis=1)
+    col_counts = remaining.sum(axis=0)
+    n_rows, n_cols = remaining.shape
+
+    rows: List[int] = []
+    cols: List[int] = []
+    row_dests = np.zeros(n_cols, dtype=bool)
+    col_srcs = np.zeros(n_rows, dtype=bool)
+    while True:
+        best_row = int(row_counts.argmax()) if n_rows else 0
+        best_col = int(col_counts.argmax()) if n_cols else 0
+        row_best = int(row_counts[best_row]) if n_rows else 0
+        col_best = int(col_counts[best_col]) if n_cols else 0
+        if row_best == 0 and col_best == 0:
+            break
+        if row_best >= col_best:
+            line = remaining[best_row].copy()
+            rows.append(best_row)
+            row_dests |= line
+            remaining[best_row] = False
+            row_counts[best_row] = 0
+            col_counts -= line
+        else:
+            line = remaining[:, best_col].copy()
+            cols.append(best_col)
+            col_srcs |= line
+            remaining[:, best_col] = False
+            col_counts[best_col] = 0
+            row_counts -= line
+
+    blocks: List[Tuple[List[int], List[int]]] = []
+    if rows:
+        blocks.append((sorted(rows), np.flatnonzero(row_dests).tolist()))
+    if cols:
+        blocks.append((np.flatnonzero(col_srcs).tolist(), sorted(cols)))
+    return blocks
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from backend.matrix_cache import CacheStats, LocationKey, quantize
+
+logger = logging.getLogger(__name__)
+
+# Same sentinel as backend.ors, which imports this module.
+UNREACHABLE = 10**9
+
+FillFn = Callable[[Sequence[Sequence[float]], np.ndarray, np.ndarray, Optional[CacheStats]], int]
+
+# Per-context window set by `coalescing`; asyncio.to_thread copies it into worker threads.
+_window_override: ContextVar[Optional[float]] = ContextVar("matrix_coalesce_window", default=None)
+
+
+@contextmanager
+def coalescing(window_s: float) -> Iterator[None]:
+    """Coalesce matrix builds started inside this block, waiting `window_s` for peers.
+
+    Use it only around builds that really run concurrently in this process;
+    a lone build would just pay the wait.
+    """
+    token = _window_override.set(window_s)
+    try:
+        yield
+    finally:
+        _window_override.reset(token)
+
+
+class _Batch:
+    def __init__(self) -> None:
+        self.index: Dict[LocationKey, int] = {}
+        self.locations: List[List[float]] = []
+        self.requests: List[Tuple[np.ndarray, np.ndarray]] = []
+        self.done = threading.Event()
+        self.matrix: Optional[np.ndarray] = None
+        self.error: Optional[BaseException] = None
+        self.requests_made = 0
+
+    def add(self, locations_lonlat: Sequence[Sequence[float]], missing: np.ndarray) -> np.ndarray:
+        positions = np.empty(len(locations_lonlat), dtype=np.intp)
+        for i, (lon, lat) in enumerate(locations_lonlat):
+            key = quantize(lon, lat)
+            pos = self.index.get(key)
+            if pos is None:
+                pos = self.index[key] = len(self.locations)
+                self.locations.append([float(lon), float(lat)])
+            positions[i] = pos
+        self.requests.append((positions, missing))
+        return positions
+
+
+class MatrixCoalescer:
+    """Merges concurrent missing-cell fetches into one ORS pass over the union of locations.
+
+    The first caller in a window becomes the leader: it waits `window_s` for
+    other callers, fetches the union of everybody's missing cells (tiled by
+    `fill`) and each caller slices its own cells out of the shared result.
+    `window_s` is the process default; `coalescing` overrides it per context.
+    """
+
+    def __init__(self, fill: FillFn, window_s: float, max_locations: int = 3000):
+        self.fill = fill
+        self.window_s = window_s
+        self.max_locations = max_locations
+        self._lock = threading.Lock()
+        self._open: Optional[_Batch] = None
+
+    def fill_missing(
+        self,
+        locations_lonlat: Sequence[Sequence[float]],
+        matrix: np.ndarray,
+        missing: np.ndarray,
+        stats: Optional[CacheStats] = None,
+    ) -> int:
+        window_s = _window_override.get()
+        window_s = self.window_s if window_s is None else window_s
+        if window_s <= 0 or not missing.any():
+            return self.fill(locations_lonlat, matrix, missing, stats)
+
+        with self._lock:
+            batch = self._open
+            leader = batch is None or len(batch.locations) + len(locations_lonlat) > self.max_locations
+            if leader:
+                batch = self._open = _Batch()
+            positions = batch.add(locations_lonlat, missing)
+
+        if leader:
+            self._run(batch, window_s, stats)
+        else:
+            batch.done.wait()
+            if stats is not None and batch.error is None:
+                stats.coalesced += int(missing.sum())
+
+        if batch.error is not None:
+            raise batch.error
+        sub = batch.matrix[np.ix_(positions, positions)]
+        matrix[missing] = sub[missing]
+        return batch.requests_made if leader else 0
+
+    def _run(self, batch: _Batch, window_s: float, stats: Optional[CacheStats]) -> None:
+        try:
+            time.sleep(window_s)
+            with self._lock:
+                if self._open is batch:
+                    self._open = None
+
+            n = len(batch.locations)
+            union_missing = np.zeros((n, n), dtype=bool)
+            for positions, missing in batch.requests:
+                rows, cols = np.nonzero(missing)
+                union_missing[positions[rows], positions[cols]] = True
+            union = np.full((n, n), UNREACHABLE, dtype=np.int32)
+            np.fill_diagonal(union, 0)
+
+            asked = sum(int(m.sum()) for _, m in batch.requests)
+            batch.requests_made = self.fill(batch.locations, union, union_missing, stats)
+            batch.matrix = union
+            if len(batch.requests) > 1:
+                logger.info(
+                    "Coalesced %s matrix requests: %s cells asked, %s fetched over %s locations",
+                    len(batch.requests),
+                    asked,
+                    int(union_missing.sum()),
+                    n,
+                )
+        except BaseException as e:
+            batch.error = e
+        finally:
+            with self._lock:
+                if self._open is batch:
+                    self._open = None
+            batch.done.set()
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import logging
+import os
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from backend import db
+from backend.duration_matrix import DurationMatrix
+from backend.matrix_cache import MISSING, CacheStats, LocationKey, get_cache, location_keys
+from backend.ors import ORS_PROFILE, UNREACHABLE, fill_missing
+from backend.travel_time_store import load_shared_travel_times
+
+logger = logging.getLogger(__name__)
+
+# Reuse a same-depot snapshot only when it already covers this share of the locations.
+MATRIX_LINEAGE_MIN_OVERLAP = float(os.environ.get("MATRIX_LINEAGE_MIN_OVERLAP", "0.5"))
+MATRIX_LINEAGE_CANDIDATES = int(os.environ.get("MATRIX_LINEAGE_CANDIDATES", "20"))
+
+
+@dataclass
+class MatrixSnapshot:
+    pending_route_id: str
+    keys: List[LocationKey]
+    matrix: DurationMatrix
+
+
+def _depot_key(keys: Sequence[LocationKey]) -> str:
+    return f"{keys[0][0]},{keys[0][1]}"
+
+
+def _load(pending_route_id: str, profile: str) -> Optional[MatrixSnapshot]:
+    row = db.fetch_route_matrix(pending_route_id, profile)
+    if not row:
+        return None
+    keys = [tuple(k) for k in row["location_keys"]]
+    n = len(keys)
+    data = np.frombuffer(row["durations"], dtype="<i4")
+    if data.size != n * n:
+        logger.warning("Ignoring corrupt matrix snapshot for %s", pending_route_id)
+        return None
+    return MatrixSnapshot(pending_route_id, keys, DurationMatrix(data.reshape(n, n)))
+
+
+def find_previous_matrix(
+    locations_lonlat: Sequence[Sequence[float]],
+    parent_pending_route_id: Optional[str] = None,
+    exclude_pending_route_id: Optional[str] = None,
+    profile: str = ORS_PROFILE,
+) -> Optional[MatrixSnapshot]:
+    """Previous matrix by pending-route lineage, else the best same-depot location-set match."""
+    keys = location_keys(locations_lonlat)
+    try:
+        if parent_pending_route_id:
+            snapshot = _load(parent_pending_route_id, profile)
+            if snapshot is not None:
+                return snapshot
+
+        wanted = set(keys)
+        best_id, best_overlap = None, 0.0
+        for pr_id, candidate in db.fetch_recent_route_matrix_keys(profile, _depot_key(keys), MATRIX_LINEAGE_CANDIDATES):
+            if pr_id == exclude_pending_route_id:
+                continue
+            overlap = len(wanted & {tuple(k) for k in candidate}) / len(wanted)
+            if overlap > best_overlap:
+                best_id, best_overlap = pr_id, overlap
+        if best_id and best_overlap >= MATRIX_LINEAGE_MIN_OVERLAP:
+            return _load(best_id, profile)
+    except Exception as e:
+        logger.warning("Matrix lineage lookup failed: %s", e)
+    return None
+
+
+def derive_matrix(
+    previous: MatrixSnapshot,
+    locations_lonlat: Sequence[Sequence[float]],
+    stats: Optional[CacheStats] = None,
+) -> Tuple[DurationMatrix, np.ndarray]:
+    """Slice kept locations out of `previous` and fill rows/columns of new ones.
+
+    New cells come from the travel-time cache or the shared store where known and
+    from ORS otherwise. Returns the matrix and the mask of cells fetched from ORS.
+    """
+    keys = location_keys(locations_lonlat)
+    prev_index = {k: i for i, k in enumerate(previous.keys)}
+    old_pos = np.asarray([prev_index.get(k, -1) for k in keys], dtype=np.intp)
+    kept = np.flatnonzero(old_pos >= 0)
+
+    n = len(keys)
+    matrix = np.full((n, n), UNREACHABLE, dtype=np.int32)
+    matrix[np.ix_(kept, kept)] = previous.matrix.array[np.ix_(old_pos[kept], old_pos[kept])]
+    np.fill_diagonal(matrix, 0)
+
+    missing = np.ones((n, n), dtype=bool)
+    missing[np.ix_(kept, kept)] = False
+    np.fill_diagonal(missing, False)
+
+    # New rows/columns go through the local cache and the shared store like any other build;
+    # only cells neither has seen are fetched from ORS.
+    rows, cols = np.nonzero(missing)
+    cache = get_cache()
+    if rows.size and (cache.lookup_pairs(ORS_PROFILE, keys, rows, cols) == MISSING).any():
+        load_shared_travel_times(locations_lonlat, stats=stats)
+    found = cache.lookup_pairs(ORS_PROFILE, keys, rows, cols, stats)
+    hit = found != MISSING
+    matrix[rows[hit], cols[hit]] = found[hit]
+    missing[rows[hit], cols[hit]] = False
+
+    requests_made = fill_missing(locations_lonlat, matrix, missing, stats)
+    logger.info(
+        "Derived matrix from pending_route_id=%s: kept=%s new=%s removed=%s cached=%s ors_requests=%s",
+        previous.pending_route_id,
+        len(kept),
+        n - len(kept),
+        len(previous.keys) - len(kept),
+        int(hit.sum()),
+        requests_made,
+    )
+    return DurationMatrix(matrix), missing
+
+
+def save_matrix_snapshot(
+    pending_route_id: str,
+    locations_lonlat: Sequence[Sequence[float]],
+    duration_matrix: DurationMatrix,
+    profile: str = ORS_PROFILE,
+) -> None:
+    keys = location_keys(locations_lonlat)
+    try:
+        db.insert_route_matrix(
+            pending_route_id=pending_route_id,
+            profile=profile,
+            depot_key=_depot_key(keys),
+            location_keys=[list(k) for k in keys],
+            durations=duration_matrix.array.astype("<i4", copy=False).tobytes(),
+        )
+    except Exception as e:
+        logger.warning("Could not store matrix snapshot for %s: %s", pending_route_id, e)
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from backend import db
+from backend import local_router
+from backend.matrix_cache import MISSING, CacheStats, get_cache, location_keys
+from backend.ors import ORS_PROFILE, UNREACHABLE, fill_missing
+from backend.stops import dedupe_locations
+from backend.travel_time_store import load_shared_travel_times, save_shared_travel_times
+
+logger = logging.getLogger(__name__)
+
+MATRIX_PREFETCH_ENABLED = os.environ.get("MATRIX_PREFETCH_ENABLED", "true").lower() == "true"
+# Orders arriving within this window are fetched together (fewer, larger ORS blocks).
+MATRIX_PREFETCH_BATCH_SECONDS = float(os.environ.get("MATRIX_PREFETCH_BATCH_SECONDS", "5"))
+MATRIX_PREFETCH_QUEUE_SIZE = int(os.environ.get("MATRIX_PREFETCH_QUEUE_SIZE", "1000"))
+
+
+def _depot() -> Optional[List[float]]:
+    lon, lat = os.environ.get("DEPOT_LON"), os.environ.get("DEPOT_LAT")
+    if lon is None or lat is None:
+        return None
+    return [float(lon), float(lat)]
+
+
+def prefetch_for_date(delivery_date: str, new_locations: List[List[float]], stats: Optional[CacheStats] = None) -> int:
+    """Fetch travel times between new orders and the depot / same-date orders into the cache.
+
+    Only rows and columns of `new_locations` that no cache tier has yet are
+    requested. Returns the number of ORS requests made.
+    """
+    stats = stats if stats is not None else CacheStats()
+    depot = _depot()
+    others = [list(p) for p in db.fetch_order_locations_for_date(delivery_date)]
+    head = [depot] if depot else []
+    locations, index = dedupe_locations(head + [list(p) for p in new_locations] + others)
+    if len(locations) < 2:
+        return 0
+    is_new = np.zeros(len(locations), dtype=bool)
+    is_new[index[len(head):len(head) + len(new_locations)]] = True
+
+    load_shared_travel_times(locations, stats)
+    keys = location_keys(locations)
+    matrix = get_cache().lookup(ORS_PROFILE, keys, stats)
+    missing = (matrix == MISSING) & (is_new[:, None] | is_new[None, :])
+    if not missing.any():
+        return 0
+
+    matrix[matrix == MISSING] = UNREACHABLE
+    requests_made = fill_missing(locations, matrix, missing, stats)
+    save_shared_travel_times(locations, matrix, {}, stats, only=missing)
+    return requests_made
+
+
+class MatrixPrefetcher:
+    """Background worker warming the travel-time cache as orders are created."""
+
+    def __init__(self, batch_seconds: float = MATRIX_PREFETCH_BATCH_SECONDS):
+        self.batch_seconds = batch_seconds
+        self._queue: "queue.Queue[tuple[str, List[float]]]" = queue.Queue(maxsize=MATRIX_PREFETCH_QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, lon: float, lat: float, delivery_date: str) -> bool:
+        try:
+            self._queue.put_nowait((str(delivery_date), [float(lon), float(lat)]))
+        except queue.Full:
+            logger.warning("Matrix prefetch queue full, skipping order at %s,%s", lon, lat)
+            return False
+        self._ensure_running()
+        return True
+
+    def _ensure_running(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="matrix-prefetch", daemon=True)
+                self._thread.start()
+
+    def _drain(self) -> Dict[str, List[List[float]]]:
+        batch: Dict[str, List[List[float]]] = defaultdict(list)
+        date, location = self._queue.get()
+        batch[date].append(location)
+        deadline = time.monotonic() + self.batch_seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                date, location = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch[date].append(location)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            for delivery_date, locations in self._drain().items():
+                started = time.monotonic()
+                stats = CacheStats()
+                try:
+                    requests_made = prefetch_for_date(delivery_date, locations, stats)
+                except Exception as e:
+                    logger.warning("Matrix prefetch for %s failed: %s", delivery_date, e)
+                    continue
+                logger.info(
+                    "Prefetched travel times for %s new orders on %s: ors_requests=%s stored=%s in %.1fs",
+                    len(locations),
+                    delivery_date,
+                    requests_made,
+                    stats.stored,
+                    time.monotonic() - started,
+                )
+
+
+_prefetcher: Optional[MatrixPrefetcher] = None
+_prefetcher_lock = threading.Lock()
+
+
+def schedule_prefetch(lon: float, lat: float, delivery_date: str) -> bool:
+    """Queue a new order location for background prefetch (never raises)."""
+    global _prefetcher
+    if not MATRIX_PREFETCH_ENABLED or local_router.is_available():
+        return False
+    try:
+        with _prefetcher_lock:
+            if _prefetcher is None:
+                _prefetcher = MatrixPrefetcher()
+        return _prefetcher.submit(lon, lat, delivery_date)
+    except Exception as e:
+        logger.warning("Could not schedule matrix prefetch: %s", e)
+        return False
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import logging
+import os
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from backend.ors import UNREACHABLE
+from backend.ors_fallback import estimate_duration_matrix
+
+logger = logging.getLogger(__name__)
+
+# `min_plus` routes unknown cells through known ones (estimator for the rest), `estimate` uses
+# the estimator only, `off` leaves the UNREACHABLE sentinel in place.
+MATRIX_REPAIR = os.environ.get("MATRIX_REPAIR", "min_plus")
+# Relaxation rounds; round r can route through cells repaired in round r - 1.
+MATRIX_REPAIR_ROUNDS = int(os.environ.get("MATRIX_REPAIR_ROUNDS", "3"))
+# Missing cells relaxed per vectorized batch (each costs a row of n sums).
+_BATCH_CELLS = 4096
+
+
+def isolated_locations(matrix: np.ndarray) -> List[int]:
+    """Locations nothing reaches, or that reach nothing (the depot, index 0, is never flagged)."""
+    n = len(matrix)
+    if n < 2:
+        return []
+    off = ~np.eye(n, dtype=bool)
+    blocked = (matrix >= UNREACHABLE) | ~off
+    cannot_leave = blocked.all(axis=1)
+    cannot_arrive = blocked.all(axis=0)
+    return [i for i in np.flatnonzero(cannot_leave | cannot_arrive).tolist() if i != 0]
+
+
+def _relax(matrix: np.ndarray, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+    """Best two-hop duration i -> k -> j for each (i, j) over the current matrix."""
+    wide = matrix.astype(np.int64)
+    out = np.empty(len(rows), dtype=np.int64)
+    for start in range(0, len(rows), _BATCH_CELLS):
+        r = rows[start:start + _BATCH_CELLS]
+        c = cols[start:start + _BATCH_CELLS]
+        out[start:start + _BATCH_CELLS] = (wide[r, :] + wide[:, c].T).min(axis=1)
+    return out
+
+
+def repair_matrix(
+    matrix: np.ndarray,
+    locations_lonlat: Sequence[Sequence[float]],
+    mode: str = MATRIX_REPAIR,
+) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """Replace UNREACHABLE off-diagonal cells with finite durations.
+
+    Returns a repaired copy and a report. Cells touching isolated locations
+    (see `isolated_locations`) are repaired too, but those locations should
+    be left out of the solve.
+    """
+    out = np.array(matrix, dtype=np.int32, copy=True)
+    n = len(out)
+    bad = out >= UNREACHABLE
+    np.fill_diagonal(bad, False)
+    report: Dict[str, Any] = {
+        "unreachable_cells": int(bad.sum()),
+        "repaired_min_plus": 0,
+        "repaired_estimate": 0,
+        "isolated": isolated_locations(out),
+    }
+    if mode == "off" or not bad.any():
+        return out, report
+
+    if mode == "min_plus":
+        for _ in range(max(0, MATRIX_REPAIR_ROUNDS)):
+            rows, cols = np.nonzero(bad)
+            if not len(rows):
+                break
+            best = _relax(out, rows, cols)
+            found = best < UNREACHABLE
+            if not found.any():
+                break
+            out[rows[found], cols[found]] = best[found].astype(np.int32)
+            bad[rows[found], cols[found]] = False
+            report["repaired_min_plus"] += int(found.sum())
+
+    if bad.any():
+        estimate = estimate_duration_matrix(locations_lonlat)
+        # Match the estimator to this matrix's scale using the cells both know.
+        known = ~bad & (out < UNREACHABLE) & (estimate > 0)
+        np.fill_diagonal(known, False)
+        ratio = float(np.median(out[known] / estimate[known])) if known.any() else 1.0
+        ratio = float(np.clip(ratio, 0.5, 3.0))
+        out[bad] = np.rint(estimate[bad] * ratio).astype(np.int32)
+        report["repaired_estimate"] = int(bad.sum())
+
+    logger.info(
+        "Repaired %s unreachable matrix cells (%s via known cells, %s estimated), isolated locations: %s",
+        report["unreachable_cells"],
+        report["repaired_min_plus"],
+        report["repaired_estimate"],
+        report["isolated"],
+    )
+    return out, report
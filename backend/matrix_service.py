@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import logging
+from typing import List, Optional
+
+from backend.duration_matrix import DurationMatrix
+from backend.hedged_matrix import MATRIX_HEDGE_DEADLINE_SECONDS, hedged_duration_matrix
+from backend.matrix_cache import CacheStats
+from backend.matrix_lineage import derive_matrix, find_previous_matrix, save_matrix_snapshot
+from backend.ors import get_duration_matrix
+from backend.stops import dedupe_locations
+from backend.traffic_buckets import active_bucket, bucket_matrix
+from backend.travel_time_store import load_shared_travel_times, save_shared_travel_times
+
+logger = logging.getLogger(__name__)
+
+
+def _free_flow_matrix(
+    locations_lonlat: List[List[float]],
+    pending_route_id: Optional[str],
+    parent_pending_route_id: Optional[str],
+    stats: CacheStats,
+) -> DurationMatrix:
+    previous = find_previous_matrix(
+        locations_lonlat,
+        parent_pending_route_id=parent_pending_route_id,
+        exclude_pending_route_id=pending_route_id,
+    )
+    if previous is not None:
+        duration_matrix, fetched = derive_matrix(previous, locations_lonlat, stats)
+        save_shared_travel_times(locations_lonlat, duration_matrix, {}, stats=stats, only=fetched)
+    else:
+        shared = load_shared_travel_times(locations_lonlat, stats=stats)
+        duration_matrix = get_duration_matrix(locations_lonlat, stats=stats)
+        save_shared_travel_times(locations_lonlat, duration_matrix, shared, stats=stats)
+
+    if pending_route_id:
+        save_matrix_snapshot(pending_route_id, locations_lonlat, duration_matrix)
+    return duration_matrix
+
+
+def build_duration_matrix(
+    locations_lonlat: List[List[float]],
+    pending_route_id: Optional[str] = None,
+    parent_pending_route_id: Optional[str] = None,
+    stats: Optional[CacheStats] = None,
+    reference_time_iso: Optional[str] = None,
+) -> DurationMatrix:
+    """ORS duration matrix for a pending route, reusing every earlier result we can.
+
+    A previous matrix of the same lineage (or the same depot and mostly the same
+    locations) is sliced and only new rows/columns are fetched; otherwise the
+    shared store and local cache are consulted before ORS. New cells go back to
+    the shared store and the result is kept as a snapshot for later edits.
+
+    Identical or near-identical coordinates are collapsed to one matrix
+    location first and expanded back in the returned matrix.
+
+    When `reference_time_iso` falls in a congested hour-of-week bucket the
+    bucket's matrix is returned instead, straight from cache when precomputed.
+    """
+    stats = stats if stats is not None else CacheStats()
+
+    unique, index = dedupe_locations(locations_lonlat)
+    if len(unique) < len(locations_lonlat):
+        logger.info("Deduplicated %s locations to %s matrix locations", len(locations_lonlat), len(unique))
+        return build_duration_matrix(
+            unique,
+            pending_route_id=pending_route_id,
+            parent_pending_route_id=parent_pending_route_id,
+            stats=stats,
+            reference_time_iso=reference_time_iso,
+        ).take(index)
+
+    def free_flow() -> DurationMatrix:
+        return _free_flow_matrix(locations_lonlat, pending_route_id, parent_pending_route_id, stats)
+
+    bucket = active_bucket(reference_time_iso)
+    if bucket is None:
+        return free_flow()
+    return bucket_matrix(locations_lonlat, bucket, free_flow, stats)
+
+
+def build_duration_matrix_within(
+    locations_lonlat: List[List[float]],
+    deadline_seconds: float = MATRIX_HEDGE_DEADLINE_SECONDS,
+    pending_route_id: Optional[str] = None,
+    parent_pending_route_id: Optional[str] = None,
+    stats: Optional[CacheStats] = None,
+    reference_time_iso: Optional[str] = None,
+) -> DurationMatrix:
+    """`build_duration_matrix`, hedged against the estimator when `deadline_seconds` > 0."""
+    def build(build_stats: CacheStats) -> DurationMatrix:
+        return build_duration_matrix(
+            locations_lonlat,
+            pending_route_id=pending_route_id,
+            parent_pending_route_id=parent_pending_route_id,
+            stats=build_stats,
+            reference_time_iso=reference_time_iso,
+        )
+
+    stats = stats if stats is not None else CacheStats()
+    if deadline_seconds <= 0:
+        return build(stats)
+    return hedged_duration_matrix(locations_lonlat, build, deadline_seconds, stats, reference_time_iso)
@@ -35,6 +35,8 @@ class PendingPayload(BaseModel):
     depot: Depot
     orders: List[Order]
     vehicles: Optional[List[Vehicle]] = None
+    # Set when this job re-dispatches an earlier pending route (e.g. orders added/removed).
+    parent_pending_route_id: Optional[str] = None
 
 
 class OptimizationResult(BaseModel):
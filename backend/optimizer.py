@@ -10,10 +10,15 @@ from dateutil import parser as dtparser
 from langgraph.graph import StateGraph, END
 
 from backend import db
+from backend.duration_matrix import DurationMatrix
 from backend.logging_utils import setup_logging
+from backend.matrix_cache import CacheStats
+from backend.hedged_matrix import drain_late_builds
+from backend.matrix_service import build_duration_matrix_within
 from backend.models import PendingPayload, Vehicle
-from backend.ors import get_duration_matrix
+from backend.route_geometry import ROUTE_GEOMETRY_ENABLED, attach_route_geometry
 from backend.solver import Node, VehicleSpec, solve_cvrptw
+from backend.warm_start import find_initial_routes, record_source
 
 logger = logging.getLogger(__name__)
 
@@ -25,7 +30,8 @@ class OptimizerState(TypedDict, total=False):
     orders: List[Dict[str, Any]]
     vehicles: List[Dict[str, Any]]
     locations_lonlat: List[List[float]]
-    duration_matrix: List[List[int]]
+    duration_matrix: DurationMatrix
+    matrix_cache_stats: Dict[str, int]
     reference_time_iso: str
     result: Dict[str, Any]
 
@@ -91,12 +97,20 @@ def get_matrix_node(state: OptimizerState) -> OptimizerState:
         locations_lonlat.append([float(o["lon"]), float(o["lat"])])
 
     logger.info("Requesting ORS matrix size=%sx%s", len(locations_lonlat), len(locations_lonlat))
-    duration_matrix = get_duration_matrix(locations_lonlat)
+    cache_stats = CacheStats()
+    duration_matrix = build_duration_matrix_within(
+        locations_lonlat,
+        pending_route_id=state["pending_route_id"],
+        parent_pending_route_id=(state.get("payload") or {}).get("parent_pending_route_id"),
+        stats=cache_stats,
+        reference_time_iso=state["reference_time_iso"],
+    )
 
     logger.info("ORS matrix received")
     return {
         "locations_lonlat": locations_lonlat,
         "duration_matrix": duration_matrix,
+        "matrix_cache_stats": cache_stats.as_dict(),
     }
 
 
@@ -164,6 +178,13 @@ def solve_optimization_node(state: OptimizerState) -> OptimizerState:
     service_time_seconds = int(os.environ.get("SERVICE_TIME_SECONDS", "0"))
     time_limit_seconds = int(os.environ.get("SOLVER_TIME_LIMIT_SECONDS", "30"))
 
+    initial_routes, warm_source = find_initial_routes(
+        pr_id,
+        (state.get("payload") or {}).get("parent_pending_route_id"),
+        depot_node,
+        order_nodes,
+    )
+
     logger.info("Solving CVRPTW pending_route_id=%s", pr_id)
     result = solve_cvrptw(
         pending_route_id=pr_id,
@@ -174,7 +195,14 @@ def solve_optimization_node(state: OptimizerState) -> OptimizerState:
         reference_time_iso=state["reference_time_iso"],
         service_time_seconds=service_time_seconds,
         time_limit_seconds=time_limit_seconds,
+        initial_routes=initial_routes,
     )
+    record_source(result, warm_source)
+
+    if state.get("matrix_cache_stats"):
+        result["matrix_cache"] = state["matrix_cache_stats"]
+    if ROUTE_GEOMETRY_ENABLED and result.get("status") == "ok":
+        attach_route_geometry(result)
 
     logger.info("Solver done status=%s unassigned=%s", result.get("status"), len(result.get("unassigned", [])))
     return {"result": result}
@@ -224,6 +252,8 @@ def main() -> None:
             logger.exception("Optimizer failed pending_route_id=%s", pending_route_id)
             db.mark_pending_failed(pending_route_id, str(e))
         raise
+    finally:
+        drain_late_builds()
 
 
 if __name__ == "__main__":
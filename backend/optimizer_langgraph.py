@@ -1,6 +1,7 @@
 import json
 import logging
 import os
+import time
 from datetime import datetime, timezone
 from typing import Dict, List, Any
 
@@ -8,12 +9,21 @@ from langgraph.graph import StateGraph, END
 from langgraph.checkpoint.memory import MemorySaver
 
 from backend import db
+from backend.duration_matrix import DurationMatrix
 from backend.logging_utils import setup_logging
+from backend.matrix_cache import CacheStats
 from backend.models import PendingPayload, Vehicle
-from backend.ors import get_duration_matrix
-from backend.ors_directions import get_duration_matrix_via_directions
-from backend.ors_fallback import get_duration_matrix_fallback
+from backend.hedged_matrix import drain_late_builds
+from backend.route_geometry import ROUTE_GEOMETRY_ENABLED, attach_route_geometry
 from backend.solver import Node, VehicleSpec, solve_cvrptw
+from backend.warm_start import find_initial_routes, record_source
+from backend.strategy_selector import (
+    MATRIX_TIME_BUDGET_SECONDS,
+    StrategyDecision,
+    StrategySelector,
+    compute_matrix,
+)
+from backend.traffic_buckets import active_bucket, congestion_factors
 
 logger = logging.getLogger(__name__)
 
@@ -24,13 +34,18 @@ class OptimizerState(Dict[str, Any]):
     parsed: PendingPayload
     vehicles: List[Vehicle]
     locations: List[List[float]]
-    duration_matrix: List[List[int]]
+    reference_time_iso: str
+    traffic_bucket: int
+    duration_matrix: bytes  # DurationMatrix.tobytes(): the checkpointer only serializes plain types
+    matrix_cache_stats: Dict[str, int]
+    matrix_deadline: float
+    matrix_strategy: Dict[str, Any]
     depot_node: Node
     order_nodes: List[Node]
     vehicle_specs: List[VehicleSpec]
     result: Dict[str, Any]
     error: str
-    strategy: str  # 'ors_matrix', 'ors_directions', 'fallback'
+    strategy: str  # 'local_router', 'ors_matrix', 'ors_directions', 'fallback'
     quality_score: float
 
 
@@ -75,20 +90,25 @@ def analyze_context(state: OptimizerState) -> OptimizerState:
     order_count = len(parsed.orders)
     vehicle_count = len(parsed.vehicles)
     
-    # Choose strategy based on problem size and conditions
-    if order_count <= 10:
-        state["strategy"] = "ors_matrix"  # Use matrix API for small problems
-    elif order_count <= 50:
-        state["strategy"] = "ors_directions"  # Use directions for medium
-    else:
-        state["strategy"] = "fallback"  # Use fallback for large problems
-    
-    # Check time of day for traffic considerations
-    current_hour = datetime.now().hour
-    if 7 <= current_hour <= 9 or 17 <= current_hour <= 19:
-        logger.info("Rush hour detected - may need to adjust expectations")
+    # Choose strategy from each backend's rolling health (latency, errors,
+    # 429s, circuit breaker) and the time budget left for the matrix step
+    state["matrix_deadline"] = time.monotonic() + MATRIX_TIME_BUDGET_SECONDS
+    decision = StrategySelector.load().choose(order_count + 1, MATRIX_TIME_BUDGET_SECONDS)
+    state["strategy"] = decision.strategy
+    state["matrix_strategy"] = decision.as_dict()
+    
+    # Check time of day for traffic considerations: congested hour-of-week
+    # buckets get their own (precomputable) matrix in get_distances
+    state["reference_time_iso"] = datetime.now(timezone.utc).isoformat()
+    state["traffic_bucket"] = active_bucket(state["reference_time_iso"])
+    if state["traffic_bucket"] is not None:
+        logger.info(
+            "Rush hour detected - using traffic bucket %s (x%.2f)",
+            state["traffic_bucket"],
+            congestion_factors()[state["traffic_bucket"]],
+        )
     
-    logger.info(f"Selected strategy: {state['strategy']}")
+    logger.info(f"Selected strategy: {state['strategy']} ({'; '.join(decision.reasons)})")
     return state
 
 
@@ -96,29 +116,36 @@ def get_distances(state: OptimizerState) -> OptimizerState:
     """Get distance matrix using selected strategy"""
     logger.info(f"Getting distance matrix using {state['strategy']} strategy")
     
+    parsed = state["parsed"]
+    if not state.get("locations"):
+        state["locations"] = [[float(parsed.depot.lon), float(parsed.depot.lat)]] + [
+            [float(o.lon), float(o.lat)] for o in parsed.orders
+        ]
+    
     try:
-        if state["strategy"] == "ors_matrix":
-            state["duration_matrix"] = get_duration_matrix(state["locations"])
-        elif state["strategy"] == "ors_directions":
-            state["duration_matrix"] = get_duration_matrix_via_directions(state["locations"])
-        else:
-            state["duration_matrix"] = get_duration_matrix_fallback(state["locations"])
+        # Failed strategies are recorded and the selector picks the next one
+        # that still fits the remaining budget, down to the fallback
+        cache_stats = CacheStats()
+        duration_matrix, decision = compute_matrix(
+            state["locations"],
+            pending_route_id=state["pending_route_id"],
+            parent_pending_route_id=state["payload"].get("parent_pending_route_id"),
+            reference_time_iso=state["reference_time_iso"],
+            stats=cache_stats,
+            budget_seconds=max(0.0, state["matrix_deadline"] - time.monotonic()),
+            first=StrategyDecision(**state["matrix_strategy"]),
+        )
+        state["duration_matrix"] = duration_matrix.tobytes()
+        state["strategy"] = decision.strategy
+        state["matrix_strategy"] = decision.as_dict()
+        state["matrix_cache_stats"] = cache_stats.as_dict()
         
-        logger.info(f"Got {len(state['duration_matrix'])}x{len(state['duration_matrix'][0])} matrix")
+        logger.info(f"Got {len(duration_matrix)}x{len(duration_matrix)} matrix")
         return state
         
     except Exception as e:
-        logger.warning(f"Strategy {state['strategy']} failed: {e}")
-        
-        # Try fallback
-        try:
-            state["duration_matrix"] = get_duration_matrix_fallback(state["locations"])
-            state["strategy"] = "fallback"
-            logger.info("Using fallback matrix")
-            return state
-        except Exception as e2:
-            state["error"] = f"All strategies failed: {e2}"
-            return state
+        state["error"] = f"All strategies failed: {e}"
+        return state
 
 
 def prepare_solver_data(state: OptimizerState) -> OptimizerState:
@@ -177,16 +204,26 @@ def solve_optimization(state: OptimizerState) -> OptimizerState:
     logger.info("Solving CVRPTW optimization")
     
     try:
+        initial_routes, warm_source = find_initial_routes(
+            state["pending_route_id"],
+            state["payload"].get("parent_pending_route_id"),
+            state["depot_node"],
+            state["order_nodes"],
+        )
         result = solve_cvrptw(
             pending_route_id=state["pending_route_id"],
             depot=state["depot_node"],
             orders=state["order_nodes"],
             vehicles=state["vehicle_specs"],
-            duration_matrix=state["duration_matrix"],
-            reference_time_iso=datetime.now(timezone.utc).isoformat(),
+            duration_matrix=DurationMatrix.frombytes(state["duration_matrix"]),
+            reference_time_iso=state["reference_time_iso"],
             service_time_seconds=0,
             time_limit_seconds=30,
+            initial_routes=initial_routes,
         )
+        record_source(result, warm_source)
+        if ROUTE_GEOMETRY_ENABLED and result.get("status") == "ok":
+            attach_route_geometry(result)
         
         state["result"] = result
         state["quality_score"] = calculate_quality_score(result)
@@ -259,19 +296,23 @@ def save_result(state: OptimizerState) -> OptimizerState:
     logger.info("Saving optimization result")
     
     try:
-        db.insert_optimized_route(
-            pending_route_id=state["pending_route_id"],
-            status=state["result"].get("status", "unknown"),
-            result=state["result"]
-        )
-        
-        # Also save metadata about the optimization
+        # Metadata about the optimization travels with the stored result
         metadata = {
             "strategy": state["strategy"],
+            "matrix_strategy": state.get("matrix_strategy"),
             "quality_score": state["quality_score"],
             "orders_count": len(state["order_nodes"]),
             "vehicles_count": len(state["vehicle_specs"]),
+            "matrix_cache": state.get("matrix_cache_stats"),
+            "traffic_bucket": state.get("traffic_bucket"),
         }
+        state["result"]["optimizer_metadata"] = metadata
+        
+        db.insert_optimized_route(
+            pending_route_id=state["pending_route_id"],
+            status=state["result"].get("status", "unknown"),
+            result=state["result"]
+        )
         
         logger.info(f"Result saved with metadata: {metadata}")
         return state
@@ -401,6 +442,8 @@ def main() -> None:
             
     except Exception as e:
         logger.exception("Workflow execution failed")
+    finally:
+        drain_late_builds()
 
 
 if __name__ == "__main__":
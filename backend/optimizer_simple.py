@@ -6,10 +6,12 @@ from datetime import datetime, timezone
 from backend import db
 from backend.logging_utils import setup_logging
 from backend.models import PendingPayload, Vehicle
-from backend.ors import get_duration_matrix
-from backend.ors_directions import get_duration_matrix_via_directions
-from backend.ors_fallback import get_duration_matrix_fallback
+from backend.matrix_cache import CacheStats
+from backend.hedged_matrix import drain_late_builds
+from backend.route_geometry import ROUTE_GEOMETRY_ENABLED, attach_route_geometry
 from backend.solver import Node, VehicleSpec, solve_cvrptw
+from backend.warm_start import find_initial_routes, record_source
+from backend.strategy_selector import compute_matrix
 
 logger = logging.getLogger(__name__)
 
@@ -47,17 +49,19 @@ def main() -> None:
         for o in parsed.orders:
             locations_lonlat.append([float(o.lon), float(o.lat)])
 
-        logger.info("Requesting ORS matrix size=%sx%s", len(locations_lonlat), len(locations_lonlat))
-        try:
-            duration_matrix = get_duration_matrix(locations_lonlat)
-        except Exception as e:
-            logger.warning("ORS matrix API failed: %s", e)
-            try:
-                # Try using directions API instead
-                duration_matrix = get_duration_matrix_via_directions(locations_lonlat)
-            except Exception as e2:
-                logger.warning("ORS directions API failed: %s", e2)
-                duration_matrix = get_duration_matrix_fallback(locations_lonlat)
+        reference_time_iso = datetime.now(timezone.utc).isoformat()
+
+        # Strategy (local router, ORS matrix, directions, fallback) is chosen from
+        # rolling per-backend health and falls through to the next one on failure
+        logger.info("Requesting duration matrix size=%sx%s", len(locations_lonlat), len(locations_lonlat))
+        cache_stats = CacheStats()
+        duration_matrix, decision = compute_matrix(
+            locations_lonlat,
+            pending_route_id=pr_id,
+            parent_pending_route_id=parsed.parent_pending_route_id,
+            reference_time_iso=reference_time_iso,
+            stats=cache_stats,
+        )
 
         # Prepare solver data
         depot_node = Node(
@@ -99,7 +103,8 @@ def main() -> None:
                 )
             )
 
-        # Solve
+        # Solve, warm-started from an earlier plan for this (or a similar) route
+        initial_routes, warm_source = find_initial_routes(pr_id, parsed.parent_pending_route_id, depot_node, order_nodes)
         logger.info("Solving CVRPTW")
         result = solve_cvrptw(
             pending_route_id=pr_id,
@@ -107,17 +112,28 @@ def main() -> None:
             orders=order_nodes,
             vehicles=vehicle_specs,
             duration_matrix=duration_matrix,
-            reference_time_iso=datetime.now(timezone.utc).isoformat(),
+            reference_time_iso=reference_time_iso,
             service_time_seconds=0,
             time_limit_seconds=30,
+            initial_routes=initial_routes,
         )
+        record_source(result, warm_source)
 
         logger.info("Solver done status=%s", result.get("status"))
+        if ROUTE_GEOMETRY_ENABLED and result.get("status") == "ok":
+            attach_route_geometry(result)
+        result["optimizer_metadata"] = {
+            "matrix_strategy": decision.as_dict(),
+            "matrix_cache": cache_stats.as_dict(),
+        }
         db.insert_optimized_route(pending_route_id=pr_id, status=result.get("status", "unknown"), result=result)
 
     except Exception as e:
         logger.exception("Optimizer failed pending_route_id=%s", pr_id)
         db.mark_pending_failed(pr_id, str(e))
+    finally:
+        # Late ORS tiles from a hedged matrix still land in the caches for the next run.
+        drain_late_builds()
 
 
 if __name__ == "__main__":
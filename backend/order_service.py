@@ -11,6 +11,8 @@ from pydantic import BaseModel, EmailStr
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
+from backend.matrix_prefetch import schedule_prefetch
+
 logger = logging.getLogger(__name__)
 
 # Modelos Pydantic
@@ -107,6 +109,9 @@ class OrderService:
                     
                     conn.commit()
             
+            # Precalcular tiempos de viaje en segundo plano (depot y pedidos del mismo día)
+            schedule_prefetch(order_data.lon, order_data.lat, order_data.deliveryDate)
+            
             # Crear respuesta
             tracking_url = f"{self.base_url}/track/{order_id}"
             
@@ -178,6 +183,9 @@ class OrderService:
                     
                     conn.commit()
             
+            # La dirección puede haber cambiado: precalcular sus tiempos de viaje
+            schedule_prefetch(order_data.lon, order_data.lat, order_data.deliveryDate)
+            
             tracking_url = f"{self.base_url}/track/{order_id}"
             
             return OrderResponse(
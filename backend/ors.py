@@ -1,15 +1,43 @@
 from __future__ import annotations
 
 import logging
+import math
 import os
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence, Tuple
 
+import numpy as np
+import orjson
 import requests
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+from tenacity import retry, stop_after_attempt, stop_after_delay, wait_exponential, retry_if_exception_type
+
+from backend.duration_matrix import DurationMatrix
+from backend.matrix_cache import MISSING, CacheStats, cover_missing, get_cache, location_keys
+from backend.matrix_coalescer import MatrixCoalescer
+from backend.ors_quota import KeyLease, get_key_pool
 
 logger = logging.getLogger(__name__)
 
-ORS_MATRIX_URL = "https://api.openrouteservice.org/v2/matrix/driving-car"
+DEFAULT_ORS_MATRIX_URL = "https://api.openrouteservice.org/v2/matrix/driving-car"
+# Point at `python -m backend.local_router serve` (or a self-hosted ORS) to avoid the public quota.
+ORS_MATRIX_URL = os.environ.get("ORS_MATRIX_URL", DEFAULT_ORS_MATRIX_URL)
+ORS_PROFILE = ORS_MATRIX_URL.rstrip("/").rsplit("/", 1)[-1]
+
+# Public ORS plans reject matrix requests above 3500 sources x destinations.
+ORS_MATRIX_MAX_ELEMENTS = int(os.environ.get("ORS_MATRIX_MAX_ELEMENTS", "3500"))
+# Concurrent tile requests per API key in the pool.
+ORS_MATRIX_WORKERS = int(os.environ.get("ORS_MATRIX_WORKERS", "4"))
+# Give up on a tile after this long so a dead endpoint fails fast to the next strategy.
+ORS_MATRIX_RETRY_SECONDS = float(os.environ.get("ORS_MATRIX_RETRY_SECONDS", "20"))
+# Process-wide coalescing window. Off by default: runners build one matrix at a time, so a
+# window would only delay it. Code that builds concurrently opts in with `coalescing`.
+ORS_COALESCE_WINDOW_MS = float(os.environ.get("ORS_COALESCE_WINDOW_MS", "0"))
+# Window used where matrix builds do run concurrently (e.g. the zones of parallel_optimize).
+ORS_COALESCE_PARALLEL_WINDOW_MS = float(os.environ.get("ORS_COALESCE_PARALLEL_WINDOW_MS", "150"))
+# Union size at which a coalesced batch is closed and a new one started.
+ORS_COALESCE_MAX_LOCATIONS = int(os.environ.get("ORS_COALESCE_MAX_LOCATIONS", "3000"))
+
+UNREACHABLE = 10**9
 
 
 class ORSError(RuntimeError):
@@ -18,49 +46,162 @@ class ORSError(RuntimeError):
 
 @retry(
     reraise=True,
-    stop=stop_after_attempt(5),
+    stop=stop_after_attempt(5) | stop_after_delay(ORS_MATRIX_RETRY_SECONDS),
     wait=wait_exponential(multiplier=1, min=1, max=20),
     retry=retry_if_exception_type(ORSError),
 )
-def get_duration_matrix(locations_lonlat: List[List[float]]) -> List[List[int]]:
-    api_key = os.environ.get("ORS_API_KEY")
-    if not api_key:
-        raise RuntimeError("ORS_API_KEY is required")
-
-    headers = {
-        "Authorization": api_key,
-        "Content-Type": "application/json",
-    }
-
+def _fetch_block(
+    locations_lonlat: Sequence[Sequence[float]],
+    sources: Sequence[int],
+    destinations: Sequence[int],
+    stats: Optional[CacheStats] = None,
+) -> np.ndarray:
+    headers = {"Content-Type": "application/json"}
+    lease: Optional[KeyLease] = None
+    if ORS_MATRIX_URL == DEFAULT_ORS_MATRIX_URL:
+        # Public API: spread requests over the key pool within each key's quota.
+        lease = get_key_pool().acquire("matrix")
+        headers["Authorization"] = lease.key
+    elif os.environ.get("ORS_API_KEY"):
+        headers["Authorization"] = os.environ["ORS_API_KEY"]
+
+    # Only send the locations this block touches; indices are remapped below.
+    used = sorted(set(sources) | set(destinations))
+    local = {idx: pos for pos, idx in enumerate(used)}
     body = {
-        "locations": locations_lonlat,
+        "locations": [[float(locations_lonlat[idx][0]), float(locations_lonlat[idx][1])] for idx in used],
+        "sources": [local[i] for i in sources],
+        "destinations": [local[j] for j in destinations],
         "metrics": ["duration"],
     }
 
     try:
-        resp = requests.post(ORS_MATRIX_URL, json=body, headers=headers, timeout=30)
+        resp = requests.post(ORS_MATRIX_URL, data=orjson.dumps(body), headers=headers, timeout=30)
     except requests.RequestException as e:
         logger.warning("ORS request failed: %s", str(e))
         raise ORSError(str(e))
 
+    if lease is not None:
+        get_key_pool().report(lease, resp.status_code, resp.headers)
+
     if resp.status_code >= 500:
         logger.warning("ORS server error %s: %s", resp.status_code, resp.text[:500])
         raise ORSError(f"ORS server error {resp.status_code}")
 
     if resp.status_code == 429:
         logger.warning("ORS rate limited 429")
+        if stats is not None:
+            stats.rate_limited += 1
         raise ORSError("ORS rate limited")
 
     if resp.status_code >= 400:
         raise RuntimeError(f"ORS client error {resp.status_code}: {resp.text[:500]}")
 
-    data = resp.json()
-    durations = data.get("durations")
+    durations = orjson.loads(resp.content).get("durations")
     if not durations:
         raise RuntimeError("ORS response missing 'durations'")
 
-    matrix: List[List[int]] = []
-    for row in durations:
-        matrix.append([int(x) if x is not None else 10**9 for x in row])
-
-    return matrix
+    # None (no route) decodes to NaN and becomes the UNREACHABLE sentinel.
+    block = np.array(durations, dtype=np.float64)
+    if block.shape != (len(sources), len(destinations)):
+        raise RuntimeError(f"ORS returned {block.shape} durations for a {len(sources)}x{len(destinations)} request")
+    out = np.full(block.shape, UNREACHABLE, dtype=np.int32)
+    finite = np.isfinite(block)
+    out[finite] = block[finite].astype(np.int32)
+    return out
+
+
+def _tile(sources: List[int], destinations: List[int]) -> List[Tuple[List[int], List[int]]]:
+    """Split a sources x destinations block into tiles within the ORS element limit."""
+    limit = max(1, ORS_MATRIX_MAX_ELEMENTS)
+    rows = min(len(sources), max(1, math.isqrt(limit)))
+    cols = min(len(destinations), max(1, limit // rows))
+    if cols == len(destinations):
+        rows = min(len(sources), max(1, limit // cols))
+
+    tiles = []
+    for r in range(0, len(sources), rows):
+        for c in range(0, len(destinations), cols):
+            tiles.append((sources[r:r + rows], destinations[c:c + cols]))
+    return tiles
+
+
+def fill_missing(
+    locations_lonlat: Sequence[Sequence[float]],
+    matrix: np.ndarray,
+    missing: np.ndarray,
+    stats: Optional[CacheStats] = None,
+    blocks: Optional[List[Tuple[List[int], List[int]]]] = None,
+) -> int:
+    """Fetch the `missing` cells of `matrix` from ORS in place and cache them.
+
+    Missing cells are grouped into sources x destinations blocks, so new
+    locations cost one row and one column each; callers with their own
+    grouping pass `blocks`. Returns the request count.
+    """
+    stats = stats if stats is not None else CacheStats()
+    if blocks is None:
+        blocks = cover_missing(missing)
+    tiles = [t for src, dst in blocks for t in _tile(src, dst)]
+    if not tiles:
+        return 0
+
+    workers = max(1, ORS_MATRIX_WORKERS * max(1, len(get_key_pool().keys)))
+    stats.requested += sum(len(src) * len(dst) for src, dst in tiles)
+    logger.info(
+        "Requesting %s ORS matrix tiles (max %s elements, %s workers)",
+        len(tiles),
+        ORS_MATRIX_MAX_ELEMENTS,
+        workers,
+    )
+
+    keys = location_keys(locations_lonlat)
+
+    def fetch(tile: Tuple[List[int], List[int]]) -> None:
+        src, dst = tile
+        block = _fetch_block(locations_lonlat, src, dst, stats)
+        rows, cols = np.ix_(src, dst)
+        fill = missing[rows, cols]
+        matrix[rows, cols] = np.where(fill, block, matrix[rows, cols])
+        # Cache each tile as it lands, so a caller that stops waiting (or a later
+        # failing tile) doesn't lose what already arrived.
+        new_i, new_j = np.nonzero(fill & (block < UNREACHABLE))
+        get_cache().store(
+            ORS_PROFILE,
+            ((keys[src[i]], keys[dst[j]], int(block[i, j])) for i, j in zip(new_i.tolist(), new_j.tolist())),
+            stats,
+        )
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(fetch, tiles))
+    return len(tiles)
+
+
+_coalescer = MatrixCoalescer(fill_missing, ORS_COALESCE_WINDOW_MS / 1000.0, ORS_COALESCE_MAX_LOCATIONS)
+
+
+def get_duration_matrix(
+    locations_lonlat: List[List[float]],
+    stats: Optional[CacheStats] = None,
+) -> DurationMatrix:
+    stats = stats if stats is not None else CacheStats()
+    keys = location_keys(locations_lonlat)
+
+    matrix = get_cache().lookup(ORS_PROFILE, keys, stats)
+    missing = matrix == MISSING
+    matrix[missing] = UNREACHABLE
+    # Overlapping builds for the same depot (several pending routes at once) share one fetch.
+    requests_made = _coalescer.fill_missing(locations_lonlat, matrix, missing, stats)
+
+    logger.info(
+        "Travel-time cache hits=%s (memory=%s disk=%s) misses=%s stored=%s coalesced=%s ors_requests=%s",
+        stats.hits,
+        stats.memory_hits,
+        stats.disk_hits,
+        stats.misses,
+        stats.stored,
+        stats.coalesced,
+        requests_made,
+    )
+
+    return DurationMatrix(matrix)
@@ -1,62 +1,241 @@
 import logging
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
 import requests
-from typing import List, Tuple
-import itertools
-import time
+from requests.adapters import HTTPAdapter
+
+from backend.duration_matrix import DurationMatrix
+from backend.matrix_cache import CacheStats
+from backend.ors_fallback import estimate_duration_matrix
+from backend.ors_quota import ORS_QUOTAS, QuotaExhausted, get_key_pool
+from backend.stops import dedupe_locations
 
 logger = logging.getLogger(__name__)
 
-def get_duration_matrix_via_directions(locations_lonlat: List[List[float]]) -> List[List[int]]:
+ORS_DIRECTIONS_URL = "https://api.openrouteservice.org/v2/directions/driving-car"
+
+# Per key; free ORS keys allow 40 directions requests per minute.
+ORS_DIRECTIONS_RATE_PER_MINUTE = ORS_QUOTAS["directions"][0]
+# Concurrent requests per API key in the pool.
+ORS_DIRECTIONS_WORKERS = int(os.environ.get("ORS_DIRECTIONS_WORKERS", "8"))
+# Fetch only i<j and mirror it, roughly halving requests; j->i is sampled to measure the error.
+ORS_DIRECTIONS_SYMMETRIC = os.environ.get("ORS_DIRECTIONS_SYMMETRIC", "false").lower() == "true"
+# Share of mirrored pairs also fetched in reverse (at least the minimum count).
+ORS_DIRECTIONS_ASYMMETRY_SAMPLE = float(os.environ.get("ORS_DIRECTIONS_ASYMMETRY_SAMPLE", "0.05"))
+ORS_DIRECTIONS_ASYMMETRY_MIN_SAMPLES = int(os.environ.get("ORS_DIRECTIONS_ASYMMETRY_MIN_SAMPLES", "20"))
+# Learn per-location entry/exit offsets from the samples and apply them to mirrored cells.
+ORS_DIRECTIONS_ASYMMETRY_CORRECTION = os.environ.get("ORS_DIRECTIONS_ASYMMETRY_CORRECTION", "true").lower() == "true"
+
+_local = threading.local()
+
+
+def _session() -> requests.Session:
+    """Keep-alive session per worker thread."""
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        _local.session = session
+    return session
+
+
+def _fetch_pair(start: List[float], end: List[float]) -> Tuple[Optional[int], Optional[str]]:
+    lease = get_key_pool().acquire("directions")
+    params = {
+        "start": f"{start[0]},{start[1]}",
+        "end": f"{end[0]},{end[1]}",
+    }
+    try:
+        resp = _session().get(
+            ORS_DIRECTIONS_URL,
+            params=params,
+            headers={"Authorization": lease.key},
+            timeout=5,
+        )
+    except requests.RequestException as e:
+        return None, type(e).__name__
+
+    get_key_pool().report(lease, resp.status_code, resp.headers)
+    if resp.status_code != 200:
+        return None, f"http_{resp.status_code}"
+
+    try:
+        # Get duration from the first route's first segment
+        duration = resp.json()["features"][0]["properties"]["segments"][0]["duration"]
+    except (ValueError, KeyError, IndexError) as e:
+        return None, f"bad_response_{type(e).__name__}"
+    return int(duration), None
+
+
+def symmetric_pairs(n: int, sample: float = ORS_DIRECTIONS_ASYMMETRY_SAMPLE) -> Tuple[List[Tuple[int, int]], List[Tuple[int, int]]]:
+    """Upper-triangle pairs to fetch, plus a deterministic sample of their reverses."""
+    upper = [(i, j) for i in range(n) for j in range(i + 1, n)]
+    if not upper or sample <= 0:
+        return upper, []
+    count = min(len(upper), max(ORS_DIRECTIONS_ASYMMETRY_MIN_SAMPLES, int(round(len(upper) * sample))))
+    picked = np.random.default_rng(n).choice(len(upper), size=count, replace=False)
+    return upper, [(upper[k][1], upper[k][0]) for k in sorted(picked.tolist())]
+
+
+def _fit_offsets(n: int, forward: np.ndarray, backward: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Ridge fit of d[b,a] - d[a,b] ~ w[b] - w[a] (w = exit minus entry cost per location)."""
+    design = np.zeros((len(a) + n, n))
+    rows = np.arange(len(a))
+    design[rows, b] = 1.0
+    design[rows, a] = -1.0
+    design[len(a) + np.arange(n), np.arange(n)] = 1.0  # shrinks unseen locations to 0
+    target = np.concatenate([backward - forward, np.zeros(n)])
+    return np.linalg.lstsq(design, target, rcond=None)[0]
+
+
+def mirror_upper(
+    matrix: np.ndarray,
+    measured: np.ndarray,
+    correction: bool = ORS_DIRECTIONS_ASYMMETRY_CORRECTION,
+) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """Fill unmeasured lower-triangle cells from their mirror and report the asymmetry error.
+
+    Reverse pairs present in `measured` are the sample: the raw error is how
+    far plain mirroring is from them, and the corrected error is the
+    two-fold held-out error of the per-location offset model, used only when
+    it beats plain mirroring.
+    """
+    n = len(matrix)
+    lo_i, lo_j = np.tril_indices(n, k=-1)
+    sampled = measured[lo_i, lo_j] & measured[lo_j, lo_i]
+    # Sampled pair (a, b): a < b fetched as usual, b -> a fetched as the check.
+    a, b = lo_j[sampled], lo_i[sampled]
+    forward = matrix[a, b].astype(np.float64)
+    backward = matrix[b, a].astype(np.float64)
+    scale = np.maximum(backward, 1.0)
+    raw_error = float(np.mean(np.abs(forward - backward) / scale)) if len(a) else None
+
+    offsets = np.zeros(n)
+    corrected_error = None
+    if correction and len(a) >= 4:
+        folds = np.arange(len(a)) % 2
+        errors = []
+        for k in (0, 1):
+            fit, test = folds != k, folds == k
+            w = _fit_offsets(n, forward[fit], backward[fit], a[fit], b[fit])
+            predicted = forward[test] + w[b[test]] - w[a[test]]
+            errors.append(np.abs(predicted - backward[test]) / scale[test])
+        corrected_error = float(np.mean(np.concatenate(errors)))
+        if corrected_error < raw_error:
+            offsets = _fit_offsets(n, forward, backward, a, b)
+
+    fill = ~measured[lo_i, lo_j]
+    src_i, src_j = lo_j[fill], lo_i[fill]
+    mirrored = matrix[src_i, src_j] + offsets[lo_i[fill]] - offsets[lo_j[fill]]
+    matrix[lo_i[fill], lo_j[fill]] = np.maximum(np.rint(mirrored), 0).astype(np.int32)
+
+    used_correction = bool(offsets.any())
+    report = {
+        "mirrored": int(fill.sum()),
+        "sampled": int(len(a)),
+        "raw_error_pct": None if raw_error is None else round(100.0 * raw_error, 2),
+        "corrected_error_pct": None if corrected_error is None else round(100.0 * corrected_error, 2),
+        "correction_applied": used_correction,
+    }
+    return matrix, report
+
+
+def get_duration_matrix_via_directions(
+    locations_lonlat: List[List[float]],
+    stats: Optional[CacheStats] = None,
+    symmetric: Optional[bool] = None,
+) -> DurationMatrix:
     """
     Build duration matrix using ORS Directions API
-    Since matrix API doesn't work with this key, we'll use pairwise directions
+    Since matrix API doesn't work with some keys, we use pairwise directions
+    fetched concurrently over keep-alive sessions and throttled to the key's quota.
+    In symmetric mode only i<j (plus a sample of j->i) is fetched and mirrored.
     """
-    logger.info("Building duration matrix via ORS Directions API (pairwise calls)")
-    
-    api_key = "eyJvcmciOiI1YjNjZTM1OTc4NTExMTAwMDFjZjYyNDgiLCJpZCI6IjFmZTAxMmU1MDk1NzRmMTY5NTJjM2U5Nzc4NDlhM2M2IiwiaCI6Im11cm11cjY0In0="
+    symmetric = ORS_DIRECTIONS_SYMMETRIC if symmetric is None else symmetric
+    keys = get_key_pool().keys
+    if not keys:
+        raise RuntimeError("ORS_API_KEY is required")
+
+    # Co-located orders share one row/column: n unique stops cost n*(n-1) requests.
+    unique, index = dedupe_locations(locations_lonlat)
+    if len(unique) < len(locations_lonlat):
+        return get_duration_matrix_via_directions(unique, stats, symmetric).take(index)
+
     n = len(locations_lonlat)
-    matrix = [[0] * n for _ in range(n)]
-    
-    base_url = "https://api.openrouteservice.org/v2/directions/driving-car"
-    
-    # Get durations for all pairs
-    for i in range(n):
-        for j in range(n):
-            if i == j:
-                matrix[i][j] = 0
+    matrix = np.zeros((n, n), dtype=np.int32)
+    if symmetric:
+        upper, reverse = symmetric_pairs(n)
+        pairs = upper + reverse
+    else:
+        pairs = [(i, j) for i in range(n) for j in range(n) if i != j]
+    measured = np.eye(n, dtype=bool)
+
+    workers = max(1, ORS_DIRECTIONS_WORKERS * len(keys))
+    logger.info(
+        "Building duration matrix via ORS Directions API (%s pairs, %s workers, %s keys x %s req/min)",
+        len(pairs),
+        workers,
+        len(keys),
+        ORS_DIRECTIONS_RATE_PER_MINUTE,
+    )
+
+    exhausted = threading.Event()
+
+    def fetch(pair: Tuple[int, int]) -> Tuple[int, int, Optional[int], Optional[str]]:
+        i, j = pair
+        if exhausted.is_set():
+            return i, j, None, "quota_exhausted"
+        try:
+            duration, error = _fetch_pair(locations_lonlat[i], locations_lonlat[j])
+        except QuotaExhausted:
+            exhausted.set()
+            return i, j, None, "quota_exhausted"
+        return i, j, duration, error
+
+    failures: Counter = Counter()
+    failed_pairs: List[Tuple[int, int]] = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for i, j, duration, error in pool.map(fetch, pairs):
+            if duration is None:
+                failures[error] += 1
+                failed_pairs.append((i, j))
             else:
-                # Format: lon,lat
-                start = f"{locations_lonlat[i][0]},{locations_lonlat[i][1]}"
-                end = f"{locations_lonlat[j][0]},{locations_lonlat[j][1]}"
-                
-                url = f"{base_url}?api_key={api_key}&start={start}&end={end}"
-                
-                try:
-                    resp = requests.get(url, timeout=5)
-                    if resp.status_code == 200:
-                        data = resp.json()
-                        # Get duration from the first route's first segment
-                        duration = data['features'][0]['properties']['segments'][0]['duration']
-                        matrix[i][j] = int(duration)
-                        logger.debug(f"Duration {i}->{j}: {duration}s")
-                    else:
-                        logger.warning(f"ORS directions failed {i}->{j}: {resp.status_code}")
-                        # Fallback to haversine
-                        from backend.ors_fallback import haversine
-                        km = haversine(locations_lonlat[i][0], locations_lonlat[i][1],
-                                      locations_lonlat[j][0], locations_lonlat[j][1])
-                        matrix[i][j] = int((km / 50) * 3600)  # 50 km/h avg
-                    
-                    # Small delay to avoid rate limiting
-                    time.sleep(0.1)
-                    
-                except Exception as e:
-                    logger.error(f"Error getting direction {i}->{j}: {e}")
-                    # Fallback
-                    from backend.ors_fallback import haversine
-                    km = haversine(locations_lonlat[i][0], locations_lonlat[i][1],
-                                  locations_lonlat[j][0], locations_lonlat[j][1])
-                    matrix[i][j] = int((km / 50) * 3600)
-    
-    logger.info(f"✅ Built {n}x{n} duration matrix via ORS Directions")
-    return matrix
+                matrix[i, j] = duration
+                measured[i, j] = True
+
+    if stats is not None:
+        stats.rate_limited += failures["http_429"]
+
+    if symmetric:
+        matrix, report = mirror_upper(matrix, measured)
+        if stats is not None:
+            stats.asymmetry = report
+        logger.info(
+            "Symmetric directions matrix near (%.4f, %.4f): %s",
+            locations_lonlat[0][0],
+            locations_lonlat[0][1],
+            report,
+        )
+        # A failed reverse sample is covered by its mirror; a failed forward pair is estimated both ways.
+        failed_pairs = [(i, j) for i, j in failed_pairs if i < j]
+        failed_pairs += [(j, i) for i, j in failed_pairs if not measured[j, i]]
+
+    if failed_pairs:
+        fallback = estimate_duration_matrix(locations_lonlat)
+        rows, cols = zip(*failed_pairs)
+        matrix[rows, cols] = fallback[rows, cols]
+    if failures:
+        logger.warning(
+            "ORS directions failed for %s/%s pairs, used estimates instead: %s",
+            sum(failures.values()),
+            len(pairs),
+            dict(failures),
+        )
+
+    logger.info("✅ Built %sx%s duration matrix via ORS Directions", n, n)
+    return DurationMatrix(matrix)
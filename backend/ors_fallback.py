@@ -1,35 +1,63 @@
 import logging
-import math
 import os
-from typing import List
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from backend.duration_matrix import DurationMatrix
 
 logger = logging.getLogger(__name__)
 
+EARTH_RADIUS_KM = 6371.0
+
+# Average road speed assumed when no routing engine answers.
+FALLBACK_SPEED_KMH = float(os.environ.get("FALLBACK_SPEED_KMH", "50"))
+
+
+def haversine_km_matrix(
+    sources_lonlat: Sequence[Sequence[float]],
+    destinations_lonlat: Optional[Sequence[Sequence[float]]] = None,
+) -> np.ndarray:
+    """Great circle distances (km) between every source and destination, broadcasted."""
+    src = np.radians(np.asarray(sources_lonlat, dtype=np.float64).reshape(-1, 2))
+    dst = src if destinations_lonlat is None else np.radians(
+        np.asarray(destinations_lonlat, dtype=np.float64).reshape(-1, 2)
+    )
+    lon1, lat1 = src[:, 0:1], src[:, 1:2]
+    lon2, lat2 = dst[:, 0][None, :], dst[:, 1][None, :]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def haversine_duration_matrix(
+    sources_lonlat: Sequence[Sequence[float]],
+    destinations_lonlat: Optional[Sequence[Sequence[float]]] = None,
+    speed_kmh: Optional[float] = None,
+) -> np.ndarray:
+    """Straight-line travel times in seconds as an int32 matrix."""
+    speed = float(speed_kmh or FALLBACK_SPEED_KMH)
+    km = haversine_km_matrix(sources_lonlat, destinations_lonlat)
+    return (km * (3600.0 / speed)).astype(np.int32)
+
+
+def estimate_duration_matrix(
+    sources_lonlat: Sequence[Sequence[float]],
+    destinations_lonlat: Optional[Sequence[Sequence[float]]] = None,
+    speed_kmh: Optional[float] = None,
+) -> np.ndarray:
+    """Best offline estimate: the calibrated model if one was trained, else plain haversine."""
+    from backend.travel_time_estimator import get_estimator
+
+    model = get_estimator()
+    if model is not None:
+        return model.predict_seconds(sources_lonlat, destinations_lonlat)
+    return haversine_duration_matrix(sources_lonlat, destinations_lonlat, speed_kmh=speed_kmh)
+
 
-def haversine(lon1, lat1, lon2, lat2):
-    """Calculate the great circle distance between two points on earth."""
-    lon1, lat1, lon2, lat2 = map(math.radians, [lon1, lat1, lon2, lat2])
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
-    c = 2 * math.asin(math.sqrt(a))
-    km = 6371 * c
-    return km
-
-
-def get_duration_matrix_fallback(locations_lonlat: List[List[float]]) -> List[List[int]]:
-    """Fallback duration matrix using haversine distance (assuming 50 km/h avg speed)."""
-    logger.warning("Using fallback duration matrix (haversine distance)")
-    n = len(locations_lonlat)
-    matrix = [[0] * n for _ in range(n)]
-    
-    for i in range(n):
-        for j in range(n):
-            if i != j:
-                km = haversine(locations_lonlat[i][0], locations_lonlat[i][1],
-                              locations_lonlat[j][0], locations_lonlat[j][1])
-                # Assume 50 km/h average speed
-                seconds = int((km / 50) * 3600)
-                matrix[i][j] = seconds
-    
-    return matrix
+def get_duration_matrix_fallback(
+    locations_lonlat: List[List[float]],
+    speed_kmh: Optional[float] = None,
+) -> DurationMatrix:
+    """Fallback duration matrix: calibrated estimator when trained, haversine at FALLBACK_SPEED_KMH otherwise."""
+    logger.warning("Using fallback duration matrix (estimated travel times)")
+    return DurationMatrix(estimate_duration_matrix(locations_lonlat, speed_kmh=speed_kmh))
@@ -0,0 +1,229 @@
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Mapping, Optional
+
+logger = logging.getLogger(__name__)
+
+# Public ORS plan limits per key; override for paid or self-hosted plans.
+ORS_QUOTAS = {
+    "matrix": (
+        float(os.environ.get("ORS_MATRIX_RATE_PER_MINUTE", "40")),
+        int(os.environ.get("ORS_MATRIX_DAILY_QUOTA", "500")),
+    ),
+    "directions": (
+        float(os.environ.get("ORS_DIRECTIONS_RATE_PER_MINUTE", "40")),
+        int(os.environ.get("ORS_DIRECTIONS_DAILY_QUOTA", "2000")),
+    ),
+}
+
+# `file` coordinates processes on one host, `postgres` every runner sharing DATABASE_URL.
+ORS_QUOTA_BACKEND = os.environ.get("ORS_QUOTA_BACKEND", "file")
+ORS_QUOTA_STATE_PATH = os.environ.get(
+    "ORS_QUOTA_STATE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "route_optimizer", "ors_quota.json"),
+)
+# Longest a caller waits for a free key before giving up (e.g. all daily quotas spent).
+ORS_QUOTA_MAX_WAIT_SECONDS = float(os.environ.get("ORS_QUOTA_MAX_WAIT_SECONDS", "30"))
+# Cool-down for a key after a 429 without a usable reset header.
+RATE_LIMITED_COOLDOWN_SECONDS = 60.0
+
+
+class QuotaExhausted(RuntimeError):
+    pass
+
+
+@dataclass(frozen=True)
+class KeyLease:
+    key: str
+    key_id: str
+    endpoint: str
+
+
+def _key_id(key: str) -> str:
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:12]
+
+
+def _today() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+def _next_utc_midnight(now: float) -> float:
+    return (now // 86400 + 1) * 86400
+
+
+class _FileStore:
+    def __init__(self, path: str):
+        self.path = path
+
+    @contextmanager
+    def transaction(self) -> Iterator[Dict[str, Any]]:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "a+", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                raw = f.read()
+                try:
+                    state = json.loads(raw) if raw else {}
+                except ValueError:
+                    logger.warning("Resetting unreadable ORS quota state %s", self.path)
+                    state = {}
+                yield state
+                f.seek(0)
+                f.truncate()
+                json.dump(state, f)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class _PostgresStore:
+    @contextmanager
+    def transaction(self) -> Iterator[Dict[str, Any]]:
+        from backend import db
+
+        with db.ors_quota_transaction() as state:
+            yield state
+
+
+class KeyPool:
+    """ORS API keys with per-key minute and daily quotas shared across processes.
+
+    Each acquire picks the key with the most headroom, so throughput scales
+    with the number of keys. Quota headers from ORS responses (and 429s)
+    correct the local bookkeeping.
+    """
+
+    def __init__(self, keys: List[str], store: Any):
+        self.keys = list(dict.fromkeys(k for k in keys if k))
+        self._store = store
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _state(self) -> Iterator[Dict[str, Any]]:
+        with self._lock, self._store.transaction() as state:
+            yield state
+
+    @staticmethod
+    def _slot(state: Dict[str, Any], key_id: str, endpoint: str, now: float) -> Dict[str, Any]:
+        rate, _ = ORS_QUOTAS[endpoint]
+        slot = state.setdefault(
+            f"{key_id}:{endpoint}",
+            {"tokens": 1.0, "updated": now, "day": _today(), "used": 0, "remaining": None, "reset": None, "blocked_until": 0.0},
+        )
+        per_second = rate / 60.0
+        burst = max(1.0, per_second)
+        slot["tokens"] = min(burst, slot["tokens"] + max(0.0, now - slot["updated"]) * per_second)
+        slot["updated"] = now
+        if slot["day"] != _today():
+            slot.update(day=_today(), used=0)
+        if slot["reset"] is not None and slot["reset"] <= now:
+            slot.update(remaining=None, reset=None)
+        return slot
+
+    @staticmethod
+    def _daily_left(slot: Dict[str, Any], endpoint: str) -> int:
+        _, daily = ORS_QUOTAS[endpoint]
+        if slot["remaining"] is not None:
+            return int(slot["remaining"])
+        return max(0, daily - int(slot["used"]))
+
+    def acquire(self, endpoint: str, max_wait: float = ORS_QUOTA_MAX_WAIT_SECONDS) -> KeyLease:
+        """Reserve one request on the key with most headroom, waiting for a token if needed."""
+        if not self.keys:
+            raise QuotaExhausted("No ORS API keys configured (ORS_API_KEYS / ORS_API_KEY)")
+        rate, _ = ORS_QUOTAS[endpoint]
+        waited = 0.0
+        while True:
+            with self._state() as state:
+                now = time.time()
+                best: Optional[str] = None
+                best_score = None
+                wait = float("inf")
+                for key in self.keys:
+                    slot = self._slot(state, _key_id(key), endpoint, now)
+                    left = self._daily_left(slot, endpoint)
+                    if slot["blocked_until"] > now:
+                        wait = min(wait, slot["blocked_until"] - now)
+                    elif left <= 0:
+                        wait = min(wait, (slot["reset"] or _next_utc_midnight(now)) - now)
+                    elif slot["tokens"] >= 1.0:
+                        score = (slot["tokens"], left)
+                        if best_score is None or score > best_score:
+                            best, best_score = key, score
+                    else:
+                        wait = min(wait, (1.0 - slot["tokens"]) * 60.0 / rate)
+                if best is not None:
+                    slot = state[f"{_key_id(best)}:{endpoint}"]
+                    slot["tokens"] -= 1.0
+                    slot["used"] += 1
+                    if slot["remaining"] is not None:
+                        slot["remaining"] -= 1
+                    return KeyLease(best, _key_id(best), endpoint)
+
+            if waited + wait > max_wait:
+                raise QuotaExhausted(f"No ORS {endpoint} quota available for {wait:.0f}s on {len(self.keys)} key(s)")
+            pause = min(wait, 1.0)
+            time.sleep(pause)
+            waited += pause
+
+    def report(self, lease: KeyLease, status_code: int, headers: Optional[Mapping[str, str]] = None) -> None:
+        """Feed the response back: quota headers refresh headroom, 429s bench the key."""
+        headers = headers or {}
+        with self._state() as state:
+            now = time.time()
+            slot = self._slot(state, lease.key_id, lease.endpoint, now)
+            try:
+                if headers.get("x-ratelimit-remaining") is not None:
+                    slot["remaining"] = int(headers["x-ratelimit-remaining"])
+                if headers.get("x-ratelimit-reset") is not None:
+                    slot["reset"] = float(headers["x-ratelimit-reset"])
+            except (TypeError, ValueError):
+                pass
+            if status_code == 429:
+                slot["tokens"] = 0.0
+                exhausted = slot["remaining"] == 0 and slot["reset"]
+                slot["blocked_until"] = slot["reset"] if exhausted else now + RATE_LIMITED_COOLDOWN_SECONDS
+
+    def headroom(self, endpoint: str) -> Dict[str, Dict[str, float]]:
+        """Requests available right now (`minute`) and until the daily reset (`daily`) per key id."""
+        out: Dict[str, Dict[str, float]] = {}
+        with self._state() as state:
+            now = time.time()
+            for key in self.keys:
+                slot = self._slot(state, _key_id(key), endpoint, now)
+                blocked = slot["blocked_until"] > now
+                out[_key_id(key)] = {
+                    "minute": 0.0 if blocked else round(slot["tokens"], 2),
+                    "daily": float(self._daily_left(slot, endpoint)),
+                }
+        return out
+
+    def total_daily_headroom(self, endpoint: str) -> int:
+        return int(sum(h["daily"] for h in self.headroom(endpoint).values()))
+
+
+_pool: Optional[KeyPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_key_pool() -> KeyPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            raw = os.environ.get("ORS_API_KEYS") or os.environ.get("ORS_API_KEY") or ""
+            keys = [k.strip() for k in raw.split(",") if k.strip()]
+            store = _PostgresStore() if ORS_QUOTA_BACKEND == "postgres" else _FileStore(ORS_QUOTA_STATE_PATH)
+            _pool = KeyPool(keys, store)
+            logger.info("ORS key pool: %s key(s), %s quota backend", len(_pool.keys), ORS_QUOTA_BACKEND)
+        return _pool
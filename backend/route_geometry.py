@@ -0,0 +1,248 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import orjson
+import requests
+
+from backend.matrix_cache import quantize
+from backend.ors_directions import ORS_DIRECTIONS_URL
+from backend.ors_quota import KeyLease, QuotaExhausted, get_key_pool
+
+logger = logging.getLogger(__name__)
+
+# Attach a road polyline and per-leg durations to every vehicle route after solving.
+# Off by default: it costs one directions request per route against the ORS quota, so
+# deployments that draw routes turn it on here or per node with the `route_geometry` config.
+ROUTE_GEOMETRY_ENABLED = os.environ.get("ROUTE_GEOMETRY_ENABLED", "false").lower() == "true"
+ROUTE_GEOMETRY_URL = os.environ.get("ROUTE_GEOMETRY_URL", ORS_DIRECTIONS_URL)
+ROUTE_GEOMETRY_PROFILE = ROUTE_GEOMETRY_URL.rstrip("/").rsplit("/", 1)[-1]
+# Public ORS plans accept at most 50 waypoints per directions request; longer routes are chunked.
+ROUTE_GEOMETRY_MAX_WAYPOINTS = int(os.environ.get("ROUTE_GEOMETRY_MAX_WAYPOINTS", "50"))
+# Concurrent directions requests per API key in the pool.
+ROUTE_GEOMETRY_WORKERS = int(os.environ.get("ROUTE_GEOMETRY_WORKERS", "4"))
+
+
+def encode_polyline(points_latlon: Sequence[Sequence[float]], precision: int = 5) -> str:
+    """Google encoded polyline (the format ORS returns by default)."""
+    scale = 10**precision
+    out: List[str] = []
+    prev_lat = prev_lon = 0
+    for lat, lon in points_latlon:
+        ilat, ilon = int(round(lat * scale)), int(round(lon * scale))
+        for delta in (ilat - prev_lat, ilon - prev_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                out.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            out.append(chr(value + 63))
+        prev_lat, prev_lon = ilat, ilon
+    return "".join(out)
+
+
+def decode_polyline(encoded: str, precision: int = 5) -> List[Tuple[float, float]]:
+    scale = 10**precision
+    points: List[Tuple[float, float]] = []
+    index = lat = lon = 0
+    while index < len(encoded):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                b = ord(encoded[index]) - 63
+                index += 1
+                result |= (b & 0x1F) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        points.append((lat / scale, lon / scale))
+    return points
+
+
+class _GeometryCache:
+    """Route geometries keyed by the quantized stop sequence, memory + the travel-time SQLite file."""
+
+    def __init__(self, path: Optional[str]):
+        self._memory: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+                self._db.execute("pragma journal_mode=wal")
+                self._db.execute(
+                    """
+                    create table if not exists route_geometries (
+                      key text primary key,
+                      payload text not null,
+                      updated_at real not null
+                    )
+                    """
+                )
+            except sqlite3.Error as e:
+                logger.warning("Route geometry disk cache disabled (%s): %s", path, e)
+                self._db = None
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if key in self._memory:
+                return self._memory[key]
+            if self._db is None:
+                return None
+            try:
+                row = self._db.execute("select payload from route_geometries where key = ?", (key,)).fetchone()
+            except sqlite3.Error as e:
+                logger.warning("Route geometry cache read failed: %s", e)
+                return None
+            if row is None:
+                return None
+            payload = json.loads(row[0])
+            self._memory[key] = payload
+            return payload
+
+    def put(self, key: str, payload: Dict[str, Any]) -> None:
+        with self._lock:
+            self._memory[key] = payload
+            if self._db is None:
+                return
+            try:
+                self._db.execute(
+                    "insert or replace into route_geometries values (?, ?, ?)",
+                    (key, json.dumps(payload), time.time()),
+                )
+            except sqlite3.Error as e:
+                logger.warning("Route geometry cache write failed: %s", e)
+
+
+_cache: Optional[_GeometryCache] = None
+_cache_lock = threading.Lock()
+
+
+def _get_cache() -> _GeometryCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            default_path = os.path.join(os.path.expanduser("~"), ".cache", "route_optimizer", "travel_times.sqlite3")
+            _cache = _GeometryCache(os.environ.get("TRAVEL_TIME_CACHE_PATH", default_path))
+        return _cache
+
+
+def _sequence_key(waypoints: Sequence[Tuple[float, float]]) -> str:
+    raw = ROUTE_GEOMETRY_PROFILE + ";" + ";".join("%d,%d" % quantize(lon, lat) for lon, lat in waypoints)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _fetch_chunk(waypoints: Sequence[Tuple[float, float]]) -> Tuple[List[Tuple[float, float]], List[int]]:
+    headers = {"Content-Type": "application/json"}
+    lease: Optional[KeyLease] = None
+    if ROUTE_GEOMETRY_URL == ORS_DIRECTIONS_URL:
+        lease = get_key_pool().acquire("directions")
+        headers["Authorization"] = lease.key
+    elif os.environ.get("ORS_API_KEY"):
+        headers["Authorization"] = os.environ["ORS_API_KEY"]
+
+    body = {"coordinates": [[float(lon), float(lat)] for lon, lat in waypoints], "instructions": False}
+    resp = requests.post(ROUTE_GEOMETRY_URL, data=orjson.dumps(body), headers=headers, timeout=30)
+    if lease is not None:
+        get_key_pool().report(lease, resp.status_code, resp.headers)
+    if resp.status_code != 200:
+        raise RuntimeError(f"ORS directions error {resp.status_code}: {resp.text[:300]}")
+
+    route = orjson.loads(resp.content)["routes"][0]
+    legs = [int(round(seg.get("duration", 0))) for seg in route.get("segments", [])]
+    if len(legs) != len(waypoints) - 1:
+        raise RuntimeError(f"ORS returned {len(legs)} segments for {len(waypoints)} waypoints")
+    return decode_polyline(route["geometry"]), legs
+
+
+def route_geometry(waypoints: Sequence[Tuple[float, float]]) -> Tuple[Dict[str, Any], int, bool]:
+    """Polyline and leg durations through `waypoints` (lon, lat): (payload, requests made, cache hit).
+
+    Consecutive duplicate stops are collapsed before the request and get
+    zero-length legs back, so co-located deliveries don't upset ORS.
+    """
+    key = _sequence_key(waypoints)
+    cached = _get_cache().get(key)
+    if cached is not None:
+        return cached, 0, True
+
+    keys = [quantize(lon, lat) for lon, lat in waypoints]
+    distinct = [0] + [i for i in range(1, len(waypoints)) if keys[i] != keys[i - 1]]
+    points = [waypoints[i] for i in distinct]
+
+    path: List[Tuple[float, float]] = []
+    distinct_legs: List[int] = []
+    requests_made = 0
+    if len(points) > 1:
+        step = max(1, ROUTE_GEOMETRY_MAX_WAYPOINTS - 1)
+        for start in range(0, len(points) - 1, step):
+            chunk_path, chunk_legs = _fetch_chunk(points[start:start + step + 1])
+            requests_made += 1
+            # Chunks share their boundary waypoint.
+            path.extend(chunk_path[1:] if path else chunk_path)
+            distinct_legs.extend(chunk_legs)
+
+    legs = [0] * (len(waypoints) - 1)
+    for pos, leg in enumerate(distinct_legs):
+        # The move into distinct stop pos + 1 happens on the leg just before it.
+        legs[distinct[pos + 1] - 1] = leg
+
+    payload = {"geometry": encode_polyline(path), "leg_durations": legs}
+    _get_cache().put(key, payload)
+    return payload, requests_made, False
+
+
+def attach_route_geometry(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Add `geometry` (encoded polyline) and `leg_durations` to each route of a solver result.
+
+    One directions request per route (more only past the waypoint limit), run
+    concurrently; failures leave that route without geometry.
+    """
+    routes = [r for r in result.get("vehicles", []) if len(r.get("stops", [])) > 1]
+    summary = {"routes": len(routes), "requests": 0, "cached": 0, "failed": 0}
+    if not routes:
+        result["route_geometry"] = summary
+        return result
+
+    def fetch(route: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], int, bool]:
+        waypoints = [(float(s["lon"]), float(s["lat"])) for s in route["stops"]]
+        try:
+            return route_geometry(waypoints)
+        except QuotaExhausted as e:
+            logger.warning("No ORS directions quota for route geometry of %s: %s", route.get("id_vehicle"), e)
+        except Exception as e:
+            logger.warning("Route geometry failed for %s: %s", route.get("id_vehicle"), e)
+        return None, 0, False
+
+    workers = max(1, min(len(routes), ROUTE_GEOMETRY_WORKERS * max(1, len(get_key_pool().keys))))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for route, (payload, made, hit) in zip(routes, pool.map(fetch, routes)):
+            summary["requests"] += made
+            if payload is None:
+                summary["failed"] += 1
+                continue
+            summary["cached"] += int(hit)
+            route["geometry"] = payload["geometry"]
+            route["leg_durations"] = payload["leg_durations"]
+
+    result["route_geometry"] = summary
+    logger.info(
+        "Route geometry: routes=%s requests=%s cached=%s failed=%s",
+        summary["routes"],
+        summary["requests"],
+        summary["cached"],
+        summary["failed"],
+    )
+    return result
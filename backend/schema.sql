@@ -28,3 +28,53 @@ create table if not exists optimized_routes (
 
 create index if not exists optimized_routes_pending_route_id_created_at_idx
   on optimized_routes (pending_route_id, created_at desc);
+
+create table if not exists travel_times (
+  profile text not null,
+  src_lon_q integer not null,
+  src_lat_q integer not null,
+  dst_lon_q integer not null,
+  dst_lat_q integer not null,
+  duration_s integer not null,
+  updated_at timestamptz not null default now(),
+  primary key (profile, src_lon_q, src_lat_q, dst_lon_q, dst_lat_q)
+);
+
+create table if not exists route_matrices (
+  pending_route_id uuid primary key references pending_routes(id) on delete cascade,
+  created_at timestamptz not null default now(),
+  profile text not null,
+  depot_key text not null,
+  location_keys jsonb not null,
+  durations bytea not null
+);
+
+create index if not exists route_matrices_depot_created_at_idx
+  on route_matrices (profile, depot_key, created_at desc);
+
+create table if not exists matrix_strategy_stats (
+  strategy text primary key,
+  stats jsonb not null,
+  updated_at timestamptz not null default now()
+);
+
+create table if not exists ors_quota_state (
+  id integer primary key default 1 check (id = 1),
+  state jsonb not null default '{}'::jsonb,
+  updated_at timestamptz not null default now()
+);
+
+create table if not exists solver_runs (
+  id bigserial primary key,
+  created_at timestamptz not null default now(),
+  n_orders integer not null,
+  n_vehicles integer not null,
+  tw_tightness real not null,
+  time_limit_s real not null,
+  time_to_best_s real not null,
+  elapsed_s real not null,
+  stopped_by text not null
+);
+
+create index if not exists solver_runs_created_at_idx
+  on solver_runs (created_at desc);
@@ -1,14 +1,46 @@
 from __future__ import annotations
 
 import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from dataclasses import dataclass
 from datetime import datetime
+from multiprocessing import shared_memory
 from typing import Any, Dict, List, Optional, Tuple
 
+import numpy as np
 from ortools.constraint_solver import pywrapcp, routing_enums_pb2
 
+from backend.duration_matrix import DurationMatrix, MatrixLike
+from backend.matrix_cache import quantize
+from backend.matrix_repair import MATRIX_REPAIR, repair_matrix
+from backend.ors import UNREACHABLE
+from backend.solver_time_limit import (
+    SOLVER_ADAPTIVE_TIME_LIMIT,
+    SOLVER_PLATEAU_MIN_IMPROVEMENT,
+    SOLVER_PLATEAU_SECONDS,
+    SOLVER_PLATEAU_SLICE_SECONDS,
+    choose_time_limit,
+    instance_features,
+    record_solver_run,
+)
+from backend.stops import expand_merged_result, merge_colocated_orders
+
 logger = logging.getLogger(__name__)
 
+MERGE_COLOCATED_ORDERS = os.environ.get("MERGE_COLOCATED_ORDERS", "false").lower() == "true"
+# Race several search configurations in worker processes and keep the best objective.
+SOLVER_PORTFOLIO = os.environ.get("SOLVER_PORTFOLIO", "false").lower() == "true"
+SOLVER_PORTFOLIO_WORKERS = int(os.environ.get("SOLVER_PORTFOLIO_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Comma-separated FIRST_SOLUTION_STRATEGY+METAHEURISTIC pairs, tried in this order.
+SOLVER_PORTFOLIO_CONFIGS = os.environ.get(
+    "SOLVER_PORTFOLIO_CONFIGS",
+    "PATH_CHEAPEST_ARC+GUIDED_LOCAL_SEARCH,SAVINGS+GUIDED_LOCAL_SEARCH,"
+    "PARALLEL_CHEAPEST_INSERTION+SIMULATED_ANNEALING,CHRISTOFIDES+TABU_SEARCH",
+)
+
 
 @dataclass
 class Node:
@@ -31,6 +63,112 @@ class VehicleSpec:
     skills: List[str]
 
 
+@dataclass(frozen=True)
+class SearchConfig:
+    first_solution: str  # routing_enums_pb2.FirstSolutionStrategy name
+    metaheuristic: str  # routing_enums_pb2.LocalSearchMetaheuristic name
+
+    @property
+    def name(self) -> str:
+        return f"{self.first_solution}+{self.metaheuristic}"
+
+
+DEFAULT_SEARCH = SearchConfig("PATH_CHEAPEST_ARC", "GUIDED_LOCAL_SEARCH")
+
+
+class _PlateauMonitor:
+    """Ends the search once the objective has not improved for `window_seconds`.
+
+    As a solution callback it stops a search that keeps finding non-improving
+    solutions; `solve` also runs the search in `slice_seconds`-long slices, each
+    resuming from the best solution, so a search that stops finding solutions
+    is caught at the next slice boundary. A Python limit checked by the solver
+    itself would be polled on every move and slow local search down.
+    """
+
+    def __init__(
+        self,
+        routing: pywrapcp.RoutingModel,
+        window_seconds: float,
+        min_improvement: float,
+        slice_seconds: float = 0.0,
+    ):
+        self.routing = routing
+        self.window_seconds = window_seconds
+        self.min_improvement = min_improvement
+        self.slice_seconds = slice_seconds
+        self.started = time.monotonic()
+        self.best: Optional[int] = None
+        self.best_at = 0.0
+        self.solutions = 0
+        self.stopped = False
+
+    def start(self) -> None:
+        self.started = time.monotonic()
+
+    def __call__(self) -> None:
+        self.solutions += 1
+        now = time.monotonic() - self.started
+        value = int(self.routing.CostVar().Max())
+        if self.best is None or value < self.best - max(1.0, abs(self.best) * self.min_improvement):
+            self.best = value
+            self.best_at = now
+        elif self.window_seconds > 0 and self._plateaued():
+            self.stopped = True
+            self.routing.solver().FinishCurrentSearch()
+
+    def _plateaued(self) -> bool:
+        return time.monotonic() - self.started - self.best_at >= self.window_seconds
+
+    def solve(
+        self,
+        parameters: Any,
+        time_limit_seconds: float,
+        initial: Optional[Any] = None,
+    ) -> Optional[Any]:
+        routing = self.routing
+
+        def run(start: Optional[Any], seconds: float) -> Optional[Any]:
+            parameters.time_limit.FromMilliseconds(max(1, int(seconds * 1000)))
+            if start is not None:
+                return routing.SolveFromAssignmentWithParameters(start, parameters)
+            return routing.SolveWithParameters(parameters)
+
+        self.start()
+        if self.window_seconds <= 0 or self.slice_seconds <= 0 or self.slice_seconds >= time_limit_seconds:
+            return run(initial, time_limit_seconds)
+
+        deadline = self.started + time_limit_seconds
+        solution = run(initial, self.slice_seconds)
+        if solution is None:
+            # No first solution within one slice: give the construction the rest.
+            return run(initial, deadline - time.monotonic()) if deadline - time.monotonic() > 0.05 else None
+        while not self.stopped:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0.05:
+                break
+            if self._plateaued():
+                self.stopped = True
+                break
+            solution = run(solution, min(self.slice_seconds, remaining)) or solution
+        return solution
+
+    def report(self, time_limit_seconds: float) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self.started
+        if self.stopped:
+            stopped_by = "plateau"
+        elif elapsed >= 0.95 * time_limit_seconds:
+            stopped_by = "time_limit"
+        else:
+            stopped_by = "search_exhausted"
+        return {
+            "seconds": round(elapsed, 3),
+            "time_to_best": round(self.best_at, 3),
+            "solutions": self.solutions,
+            "stopped_by": stopped_by,
+        }
+
+
 def _to_int_capacity(x: float) -> int:
     return int(round(x * 1000))
 
@@ -42,16 +180,139 @@ def _vehicle_can_do(order_skills: List[str], vehicle_skills: List[str]) -> bool:
     return all(s in vs for s in order_skills)
 
 
+def _resolve_initial_routes(
+    all_nodes: List[Node],
+    vehicles: List[VehicleSpec],
+    initial_routes: List[Dict[str, Any]],
+) -> List[List[int]]:
+    """Node indices per vehicle from earlier routes: stops match by order id, then by location."""
+    by_id = {node.id: i for i, node in enumerate(all_nodes) if i}
+    by_location: Dict[Tuple[int, int], List[int]] = {}
+    for i, node in enumerate(all_nodes[1:], start=1):
+        by_location.setdefault(quantize(node.lon, node.lat), []).append(i)
+    vehicle_index = {v.id_vehicle: k for k, v in enumerate(vehicles)}
+
+    used = set()
+    routes: List[List[int]] = [[] for _ in vehicles]
+    unmatched: List[List[int]] = []
+    for route in initial_routes:
+        sequence: List[int] = []
+        for stop in route.get("stops", []):
+            if stop.get("kind") == "depot":
+                continue
+            i = by_id.get(str(stop.get("id")))
+            if i is None or i in used:
+                candidates = by_location.get(quantize(stop["lon"], stop["lat"]), [])
+                i = next((c for c in candidates if c not in used), None)
+            if i is None:
+                continue
+            used.add(i)
+            sequence.append(i)
+        k = vehicle_index.get(str(route.get("id_vehicle")))
+        if k is None or routes[k]:
+            unmatched.append(sequence)
+        else:
+            routes[k] = sequence
+
+    # Routes of vehicles no longer in the fleet go to idle vehicles; the rest are re-inserted.
+    idle = [k for k, r in enumerate(routes) if not r]
+    for k, sequence in zip(idle, unmatched):
+        routes[k] = sequence
+    return routes
+
+
+def _insert_uncovered(
+    routes: List[List[int]],
+    transit: np.ndarray,
+    all_nodes: List[Node],
+    vehicles: List[VehicleSpec],
+) -> int:
+    """Cheapest-insertion of orders no route covers, respecting capacity and skills."""
+    covered = {i for r in routes for i in r}
+    load_w = [sum(_to_int_capacity(all_nodes[i].weight) for i in r) for r in routes]
+    load_v = [sum(_to_int_capacity(all_nodes[i].volume) for i in r) for r in routes]
+    inserted = 0
+    for o in range(1, len(all_nodes)):
+        if o in covered:
+            continue
+        node = all_nodes[o]
+        w, v = _to_int_capacity(node.weight), _to_int_capacity(node.volume)
+        best = None
+        for k, route in enumerate(routes):
+            spec = vehicles[k]
+            if load_w[k] + w > spec.capacity_weight or load_v[k] + v > spec.capacity_volume:
+                continue
+            if not _vehicle_can_do(node.skills_required or [], spec.skills):
+                continue
+            prev = np.asarray([0] + route)
+            nxt = np.asarray(route + [0])
+            delta = transit[prev, o] + transit[o, nxt] - transit[prev, nxt]
+            pos = int(delta.argmin())
+            if best is None or delta[pos] < best[0]:
+                best = (delta[pos], k, pos)
+        if best is None:
+            continue
+        _, k, pos = best
+        routes[k].insert(pos, o)
+        load_w[k] += w
+        load_v[k] += v
+        inserted += 1
+    return inserted
+
+
+def _initial_assignment(
+    routing: pywrapcp.RoutingModel,
+    manager: pywrapcp.RoutingIndexManager,
+    transit: np.ndarray,
+    all_nodes: List[Node],
+    vehicles: List[VehicleSpec],
+    initial_routes: List[Dict[str, Any]],
+) -> Tuple[Optional[Any], Dict[str, Any]]:
+    seeded = _resolve_initial_routes(all_nodes, vehicles, initial_routes)
+    repaired = [list(r) for r in seeded]
+    inserted = _insert_uncovered(repaired, transit, all_nodes, vehicles)
+    report = {
+        "seeded_orders": sum(len(r) for r in seeded),
+        "inserted_orders": inserted,
+        "accepted": False,
+    }
+    # Insertion ignores time windows; if that breaks feasibility, start from the seed alone.
+    for candidate, count in ((repaired, inserted), (seeded, 0)):
+        as_indices = [[manager.NodeToIndex(i) for i in r] for r in candidate]
+        initial = routing.ReadAssignmentFromRoutes(as_indices, True)
+        if initial is not None:
+            report.update(accepted=True, inserted_orders=count)
+            return initial, report
+    logger.warning("Warm-start routes are infeasible for this instance, solving from scratch")
+    return None, report
+
+
 def solve_cvrptw(
     pending_route_id: str,
     depot: Node,
     orders: List[Node],
     vehicles: List[VehicleSpec],
-    duration_matrix: List[List[int]],
+    duration_matrix: MatrixLike,
     reference_time_iso: str,
     service_time_seconds: int = 0,
     time_limit_seconds: int = 30,
+    merge_colocated: Optional[bool] = None,
+    portfolio: Optional[bool] = None,
+    initial_routes: Optional[List[Dict[str, Any]]] = None,
+    adaptive_time_limit: Optional[bool] = None,
+    log_run: bool = True,
 ) -> Dict[str, Any]:
+    """Solve the CVRPTW for one pending route.
+
+    `initial_routes` (the `vehicles` of an earlier result) warm-start the
+    search: stops are matched to current orders by id, then by location, and
+    orders they don't cover are inserted before OR-Tools takes over.
+
+    With `adaptive_time_limit`, `time_limit_seconds` is only the cap: the
+    limit is predicted from logged runs of similar size and window tightness.
+    Every search stops early once its objective plateaus. `log_run=False`
+    leaves the run out of `solver_runs` (callers that log it themselves).
+    """
     if not orders:
         return {
             "pending_route_id": pending_route_id,
@@ -64,36 +325,146 @@ def solve_cvrptw(
     num_locations = len(all_nodes)
     num_vehicles = len(vehicles)
 
+    duration_matrix = DurationMatrix.coerce(duration_matrix)
     if len(duration_matrix) != num_locations:
         raise RuntimeError("duration_matrix size mismatch")
 
+    # Null ORS cells arrive as the UNREACHABLE sentinel, which blows up the arc-cost
+    # scale and is silently rejected by the 24h Time dimension.
+    repair_report = None
+    if MATRIX_REPAIR != "off" and (duration_matrix.array >= UNREACHABLE).any():
+        repaired, repair_report = repair_matrix(duration_matrix.array, [(n.lon, n.lat) for n in all_nodes])
+        duration_matrix = DurationMatrix(repaired)
+        isolated = repair_report["isolated"]
+        if isolated:
+            logger.warning("Excluding orders unreachable by road: %s", [all_nodes[i].id for i in isolated])
+            keep = [i for i in range(1, num_locations) if i not in set(isolated)]
+            result = solve_cvrptw(
+                pending_route_id=pending_route_id,
+                depot=depot,
+                orders=[all_nodes[i] for i in keep],
+                vehicles=vehicles,
+                duration_matrix=duration_matrix.take([0] + keep),
+                reference_time_iso=reference_time_iso,
+                service_time_seconds=service_time_seconds,
+                time_limit_seconds=time_limit_seconds,
+                merge_colocated=merge_colocated,
+                portfolio=portfolio,
+                initial_routes=initial_routes,
+                adaptive_time_limit=adaptive_time_limit,
+                log_run=log_run,
+            )
+            unreachable = [all_nodes[i].id for i in isolated]
+            result["unassigned"] = list(result.get("unassigned", [])) + unreachable
+            result["unreachable"] = unreachable
+            result["matrix_repair"] = repair_report
+            return result
+
+    if MERGE_COLOCATED_ORDERS if merge_colocated is None else merge_colocated:
+        merged, groups = merge_colocated_orders(
+            orders,
+            max((v.capacity_weight for v in vehicles), default=0),
+            max((v.capacity_volume for v in vehicles), default=0),
+        )
+        if len(merged) < len(orders):
+            logger.info("Merged %s co-located orders into %s solver nodes", len(orders), len(merged))
+            result = solve_cvrptw(
+                pending_route_id=pending_route_id,
+                depot=depot,
+                orders=merged,
+                vehicles=vehicles,
+                duration_matrix=duration_matrix.take([0] + [g[0] + 1 for g in groups]),
+                reference_time_iso=reference_time_iso,
+                service_time_seconds=service_time_seconds,
+                time_limit_seconds=time_limit_seconds,
+                merge_colocated=False,
+                portfolio=portfolio,
+                initial_routes=initial_routes,
+                adaptive_time_limit=adaptive_time_limit,
+                log_run=log_run,
+            )
+            return expand_merged_result(result, orders, merged, groups)
+
+    features = instance_features(orders, num_vehicles)
+    time_limit_report = None
+    if SOLVER_ADAPTIVE_TIME_LIMIT if adaptive_time_limit is None else adaptive_time_limit:
+        time_limit_seconds, time_limit_report = choose_time_limit(features, time_limit_seconds)
+        logger.info(
+            "Solver time limit %.2fs (%s, %s orders, %s vehicles, tightness %.2f)",
+            time_limit_seconds,
+            time_limit_report["source"],
+            features.n_orders,
+            features.n_vehicles,
+            features.tw_tightness,
+        )
+
+    if SOLVER_PORTFOLIO if portfolio is None else portfolio:
+        result = solve_portfolio(
+            pending_route_id,
+            depot,
+            orders,
+            vehicles,
+            duration_matrix.array,
+            reference_time_iso,
+            service_time_seconds,
+            time_limit_seconds,
+            initial_routes=initial_routes,
+        )
+    else:
+        result = _solve_once(
+            pending_route_id,
+            depot,
+            orders,
+            vehicles,
+            duration_matrix.array,
+            reference_time_iso,
+            service_time_seconds,
+            time_limit_seconds,
+            initial_routes=initial_routes,
+        )
+    search = result.get("solver_metadata", {}).get("search")
+    if log_run and search is not None and result.get("status") == "ok":
+        record_solver_run(features, time_limit_seconds, search)
+    if time_limit_report is not None:
+        result.setdefault("solver_metadata", {})["time_limit_prediction"] = time_limit_report
+    if repair_report is not None:
+        result["matrix_repair"] = repair_report
+    return result
+
+
+def _solve_once(
+    pending_route_id: str,
+    depot: Node,
+    orders: List[Node],
+    vehicles: List[VehicleSpec],
+    durations: np.ndarray,
+    reference_time_iso: str,
+    service_time_seconds: int,
+    time_limit_seconds: float,
+    search: SearchConfig = DEFAULT_SEARCH,
+    initial_routes: Optional[List[Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """One OR-Tools search over a prepared (repaired, merged) instance."""
+    all_nodes = [depot] + orders
+    num_locations = len(all_nodes)
+    num_vehicles = len(vehicles)
+
     manager = pywrapcp.RoutingIndexManager(num_locations, num_vehicles, 0)
     routing = pywrapcp.RoutingModel(manager)
 
-    def time_callback(from_index: int, to_index: int) -> int:
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        base = duration_matrix[from_node][to_node]
-        if from_node != 0:
-            base += service_time_seconds
-        return int(base)
-
-    transit_callback_index = routing.RegisterTransitCallback(time_callback)
+    # Transit and demands are handed to OR-Tools as native matrix/vector evaluators so
+    # local search never calls back into Python. Service time is folded into every
+    # arc leaving a non-depot node.
+    transit = durations.astype(np.int64)
+    transit[1:, :] += int(service_time_seconds)
+    transit_callback_index = routing.RegisterTransitMatrix(transit.tolist())
     routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
 
     demand_w = [_to_int_capacity(n.weight) for n in all_nodes]
     demand_v = [_to_int_capacity(n.volume) for n in all_nodes]
 
-    def demand_w_cb(from_index: int) -> int:
-        node = manager.IndexToNode(from_index)
-        return int(demand_w[node])
-
-    def demand_v_cb(from_index: int) -> int:
-        node = manager.IndexToNode(from_index)
-        return int(demand_v[node])
-
-    demand_w_index = routing.RegisterUnaryTransitCallback(demand_w_cb)
-    demand_v_index = routing.RegisterUnaryTransitCallback(demand_v_cb)
+    demand_w_index = routing.RegisterUnaryTransitVector(demand_w)
+    demand_v_index = routing.RegisterUnaryTransitVector(demand_v)
 
     routing.AddDimensionWithVehicleCapacity(
         demand_w_index,
@@ -141,11 +512,25 @@ def solve_cvrptw(
         routing.AddDisjunction([manager.NodeToIndex(i)], penalty)
 
     search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-    search_parameters.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
-    search_parameters.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
-    search_parameters.time_limit.seconds = int(time_limit_seconds)
-
-    solution = routing.SolveWithParameters(search_parameters)
+    search_parameters.first_solution_strategy = getattr(
+        routing_enums_pb2.FirstSolutionStrategy, search.first_solution
+    )
+    search_parameters.local_search_metaheuristic = getattr(
+        routing_enums_pb2.LocalSearchMetaheuristic, search.metaheuristic
+    )
+    monitor = _PlateauMonitor(
+        routing, SOLVER_PLATEAU_SECONDS, SOLVER_PLATEAU_MIN_IMPROVEMENT, SOLVER_PLATEAU_SLICE_SECONDS
+    )
+    routing.AddAtSolutionCallback(monitor)
+
+    warm_start = None
+    initial = None
+    if initial_routes:
+        # Closing the model validates the parameters: without a limit GLS warns it may run forever.
+        search_parameters.time_limit.FromMilliseconds(max(1, int(time_limit_seconds * 1000)))
+        routing.CloseModelWithParameters(search_parameters)
+        initial, warm_start = _initial_assignment(routing, manager, transit, all_nodes, vehicles, initial_routes)
+    solution = monitor.solve(search_parameters, time_limit_seconds, initial)
     if solution is None:
         return {
             "pending_route_id": pending_route_id,
@@ -213,10 +598,169 @@ def solve_cvrptw(
             }
         )
 
-    return {
+    result = {
         "pending_route_id": pending_route_id,
         "reference_time": reference_time_iso,
         "status": "ok",
+        "objective": int(solution.ObjectiveValue()),
         "vehicles": routes,
         "unassigned": unassigned,
+        "solver_metadata": {"search": {"config": search.name, **monitor.report(time_limit_seconds)}},
     }
+    if warm_start is not None:
+        result["warm_start"] = warm_start
+    return result
+
+
+def _portfolio_configs() -> List[SearchConfig]:
+    configs = []
+    for raw in SOLVER_PORTFOLIO_CONFIGS.split(","):
+        first, _, meta = raw.strip().partition("+")
+        if not hasattr(routing_enums_pb2.FirstSolutionStrategy, first) or not hasattr(
+            routing_enums_pb2.LocalSearchMetaheuristic, meta
+        ):
+            logger.warning("Ignoring unknown solver portfolio config %r", raw)
+            continue
+        configs.append(SearchConfig(first, meta))
+    return configs[: max(1, SOLVER_PORTFOLIO_WORKERS)]
+
+
+def _portfolio_worker(
+    shm_name: str,
+    shape: Tuple[int, int],
+    pending_route_id: str,
+    depot: Node,
+    orders: List[Node],
+    vehicles: List[VehicleSpec],
+    reference_time_iso: str,
+    service_time_seconds: int,
+    search: SearchConfig,
+    deadline: float,
+    initial_routes: Optional[List[Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    # Spawned workers share the parent's resource tracker; the parent unlinks the segment.
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        durations = np.ndarray(shape, dtype=np.int32, buffer=shm.buf)
+        result = _solve_once(
+            pending_route_id,
+            depot,
+            orders,
+            vehicles,
+            durations,
+            reference_time_iso,
+            service_time_seconds,
+            max(1.0, deadline - time.time()),
+            search,
+            initial_routes,
+        )
+        del durations
+        return result
+    finally:
+        shm.close()
+
+
+def solve_portfolio(
+    pending_route_id: str,
+    depot: Node,
+    orders: List[Node],
+    vehicles: List[VehicleSpec],
+    durations: np.ndarray,
+    reference_time_iso: str,
+    service_time_seconds: int,
+    time_limit_seconds: float,
+    initial_routes: Optional[List[Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """Run one search per portfolio config in its own process under one wall-clock budget.
+
+    The matrix is shared with the workers through shared memory. The lowest
+    objective wins and every run is recorded in `solver_metadata`.
+    """
+    configs = _portfolio_configs()
+    if len(configs) < 2:
+        search = configs[0] if configs else DEFAULT_SEARCH
+        return _solve_once(
+            pending_route_id,
+            depot,
+            orders,
+            vehicles,
+            durations,
+            reference_time_iso,
+            service_time_seconds,
+            time_limit_seconds,
+            search,
+            initial_routes,
+        )
+
+    deadline = time.time() + time_limit_seconds
+    matrix = np.ascontiguousarray(durations, dtype=np.int32)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, matrix.nbytes))
+    runs: List[Dict[str, Any]] = []
+    best: Optional[Tuple[SearchConfig, Dict[str, Any]]] = None
+    fallback: Optional[Dict[str, Any]] = None
+    try:
+        np.ndarray(matrix.shape, dtype=np.int32, buffer=shm.buf)[:] = matrix
+        # spawn: the parent may hold threads (matrix hedging, HTTP pools) that fork would copy mid-lock.
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=len(configs), mp_context=ctx) as pool:
+            futures = {
+                pool.submit(
+                    _portfolio_worker,
+                    shm.name,
+                    matrix.shape,
+                    pending_route_id,
+                    depot,
+                    orders,
+                    vehicles,
+                    reference_time_iso,
+                    service_time_seconds,
+                    search,
+                    deadline,
+                    initial_routes,
+                ): search
+                for search in configs
+            }
+            for future in as_completed(futures):
+                search = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.warning("Solver portfolio run %s failed: %s", search.name, e)
+                    runs.append({"config": search.name, "status": "error", "error": str(e)[:200]})
+                    continue
+                runs.append(
+                    {
+                        "config": search.name,
+                        "status": result.get("status"),
+                        "objective": result.get("objective"),
+                        "stopped_by": result.get("solver_metadata", {}).get("search", {}).get("stopped_by"),
+                    }
+                )
+                fallback = fallback or result
+                if result.get("status") == "ok" and (best is None or result["objective"] < best[1]["objective"]):
+                    best = (search, result)
+    finally:
+        shm.close()
+        shm.unlink()
+
+    if best is None:
+        if fallback is not None:
+            return fallback
+        logger.warning("Every solver portfolio run failed, solving in-process")
+        return _solve_once(
+            pending_route_id,
+            depot,
+            orders,
+            vehicles,
+            durations,
+            reference_time_iso,
+            service_time_seconds,
+            max(1.0, deadline - time.time()),
+            initial_routes=initial_routes,
+        )
+
+    search, result = best
+    runs.sort(key=lambda r: (r.get("objective") is None, r.get("objective") or 0))
+    result.setdefault("solver_metadata", {}).update({"portfolio": runs, "winner": search.name})
+    logger.info("Solver portfolio winner %s objective=%s (%s runs)", search.name, result["objective"], len(runs))
+    return result
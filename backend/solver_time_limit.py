@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from backend import db
+
+logger = logging.getLogger(__name__)
+
+# Predict each job's time limit from logged runs; SOLVER_TIME_LIMIT_SECONDS becomes the cap.
+# Opt-in: turn it on once `solver_runs` holds enough history for the deployment.
+SOLVER_ADAPTIVE_TIME_LIMIT = os.environ.get("SOLVER_ADAPTIVE_TIME_LIMIT", "false").lower() == "true"
+# Log every top-level solve to `solver_runs` (only when DATABASE_URL is set).
+SOLVER_LOG_RUNS = os.environ.get("SOLVER_LOG_RUNS", "true").lower() == "true"
+SOLVER_MIN_TIME_LIMIT_SECONDS = float(os.environ.get("SOLVER_MIN_TIME_LIMIT_SECONDS", "1"))
+# Stop the search once the objective has not improved for this long. Opt-in (0 disables):
+# guided local search often improves again after a long flat stretch on large instances.
+SOLVER_PLATEAU_SECONDS = float(os.environ.get("SOLVER_PLATEAU_SECONDS", "0"))
+# With the plateau stop on, the search also runs in slices this long, resumed from the best
+# solution, so a search that stops finding solutions is caught at a slice boundary. Each
+# slice restarts guided local search (its penalties are lost), so keep it well above the window.
+SOLVER_PLATEAU_SLICE_SECONDS = float(os.environ.get("SOLVER_PLATEAU_SLICE_SECONDS", "30"))
+# Relative objective drop that counts as an improvement for the plateau monitor.
+SOLVER_PLATEAU_MIN_IMPROVEMENT = float(os.environ.get("SOLVER_PLATEAU_MIN_IMPROVEMENT", "0.001"))
+# Logged runs the model is fitted on, and how many it needs before limits are predicted.
+SOLVER_TIME_MODEL_RUNS = int(os.environ.get("SOLVER_TIME_MODEL_RUNS", "500"))
+SOLVER_TIME_MODEL_MIN_RUNS = int(os.environ.get("SOLVER_TIME_MODEL_MIN_RUNS", "20"))
+# Limit = the time-to-best this share of similar past runs stayed under.
+SOLVER_TIME_MODEL_QUANTILE = float(os.environ.get("SOLVER_TIME_MODEL_QUANTILE", "0.9"))
+# A process refits the model from `solver_runs` at most this often.
+SOLVER_TIME_MODEL_REFRESH_SECONDS = float(os.environ.get("SOLVER_TIME_MODEL_REFRESH_SECONDS", "3600"))
+
+# Runs still improving this close to their limit were cut short; their target is inflated
+# so the model can learn to grant more time instead of anchoring to the old limit.
+_CENSORED_SHARE = 0.8
+_CENSORED_GROWTH = 1.5
+_HORIZON_SECONDS = 60 * 60 * 24
+_RIDGE = 1e-3
+
+
+@dataclass
+class InstanceFeatures:
+    n_orders: int
+    n_vehicles: int
+    tw_tightness: float  # mean share of the day an order's window excludes, 0 = no windows
+
+    def as_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def instance_features(orders: Sequence[Any], n_vehicles: int) -> InstanceFeatures:
+    """Features of a prepared instance; `orders` need `tw_start` / `tw_end` in seconds."""
+    if orders:
+        widths = np.array([max(0, int(o.tw_end) - int(o.tw_start)) for o in orders], dtype=np.float64)
+        tightness = float(np.mean(1.0 - np.clip(widths / _HORIZON_SECONDS, 0.0, 1.0)))
+    else:
+        tightness = 0.0
+    return InstanceFeatures(len(orders), int(n_vehicles), round(tightness, 4))
+
+
+def _design(n_orders: np.ndarray, n_vehicles: np.ndarray, tightness: np.ndarray) -> np.ndarray:
+    return np.column_stack([np.ones_like(tightness), np.log1p(n_orders), np.log1p(n_vehicles), tightness])
+
+
+class TimeLimitModel:
+    """Log-linear fit of time-to-best on instance features, with a residual quantile margin."""
+
+    def __init__(self, coef: Optional[np.ndarray] = None, margin: float = 0.0, samples: int = 0):
+        self.coef = coef
+        self.margin = margin
+        self.samples = samples
+
+    @classmethod
+    def fit(cls, runs: List[Dict[str, Any]]) -> "TimeLimitModel":
+        if len(runs) < max(2, SOLVER_TIME_MODEL_MIN_RUNS):
+            return cls(samples=len(runs))
+        n_orders = np.array([r["n_orders"] for r in runs], dtype=np.float64)
+        n_vehicles = np.array([r["n_vehicles"] for r in runs], dtype=np.float64)
+        tightness = np.array([r["tw_tightness"] for r in runs], dtype=np.float64)
+        target = np.array([r["time_to_best_s"] for r in runs], dtype=np.float64)
+        limit = np.array([r["time_limit_s"] for r in runs], dtype=np.float64)
+        censored = np.array([r["stopped_by"] == "time_limit" for r in runs]) & (target >= _CENSORED_SHARE * limit)
+        target = np.where(censored, limit * _CENSORED_GROWTH, target)
+
+        x = _design(n_orders, n_vehicles, tightness)
+        y = np.log(np.maximum(target, 0.05))
+        coef = np.linalg.solve(x.T @ x + _RIDGE * np.eye(x.shape[1]), x.T @ y)
+        residuals = y - x @ coef
+        margin = float(np.quantile(residuals, np.clip(SOLVER_TIME_MODEL_QUANTILE, 0.0, 1.0)))
+        return cls(coef, margin, len(runs))
+
+    @classmethod
+    def load(cls) -> "TimeLimitModel":
+        if not db.is_configured():
+            return cls()
+        try:
+            runs = db.fetch_solver_runs(SOLVER_TIME_MODEL_RUNS)
+        except Exception as e:
+            logger.warning("Solver run history unavailable, using the fixed time limit: %s", e)
+            runs = []
+        return cls.fit(runs)
+
+    def predict(self, features: InstanceFeatures, max_seconds: float) -> Tuple[float, str]:
+        """Time limit for an instance, clamped to [SOLVER_MIN_TIME_LIMIT_SECONDS, max_seconds]."""
+        if self.coef is None:
+            # Not enough history yet: keep the configured limit.
+            return max_seconds, "fixed"
+        low = min(SOLVER_MIN_TIME_LIMIT_SECONDS, max_seconds)
+        x = _design(
+            np.array([features.n_orders], dtype=np.float64),
+            np.array([features.n_vehicles], dtype=np.float64),
+            np.array([features.tw_tightness], dtype=np.float64),
+        )
+        seconds = float(np.exp(min(float((x @ self.coef)[0]) + self.margin, 20.0)))
+        return round(float(np.clip(seconds, low, max_seconds)), 2), "model"
+
+
+_model: Optional[TimeLimitModel] = None
+_model_loaded_at = 0.0
+_model_lock = threading.Lock()
+
+
+def get_model() -> TimeLimitModel:
+    """The process's time-limit model, refit from `solver_runs` every SOLVER_TIME_MODEL_REFRESH_SECONDS."""
+    global _model, _model_loaded_at
+    with _model_lock:
+        if _model is None or time.monotonic() - _model_loaded_at > SOLVER_TIME_MODEL_REFRESH_SECONDS:
+            _model = TimeLimitModel.load()
+            _model_loaded_at = time.monotonic()
+        return _model
+
+
+def choose_time_limit(features: InstanceFeatures, max_seconds: float) -> Tuple[float, Dict[str, Any]]:
+    """Per-job time limit from the logged-run model, plus a report for `solver_metadata`."""
+    model = get_model()
+    seconds, source = model.predict(features, max_seconds)
+    return seconds, {
+        "seconds": seconds,
+        "max_seconds": max_seconds,
+        "source": source,
+        "training_runs": model.samples,
+        **features.as_dict(),
+    }
+
+
+def record_solver_run(features: InstanceFeatures, time_limit_seconds: float, search: Dict[str, Any]) -> None:
+    """Log one finished search so later jobs can predict their limit from it."""
+    if not SOLVER_LOG_RUNS or not db.is_configured():
+        return
+    try:
+        db.insert_solver_run(
+            {
+                **features.as_dict(),
+                "time_limit_s": float(time_limit_seconds),
+                "time_to_best_s": float(search["time_to_best"]),
+                "elapsed_s": float(search["seconds"]),
+                "stopped_by": search["stopped_by"],
+            }
+        )
+    except Exception as e:
+        logger.warning("Could not log solver run: %s", e)
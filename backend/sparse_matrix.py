@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import logging
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from backend.duration_matrix import DurationMatrix
+from backend.matrix_cache import MISSING, CacheStats, get_cache, location_keys
+from backend.ors import ORS_MATRIX_MAX_ELEMENTS, ORS_PROFILE, UNREACHABLE, fill_missing
+from backend.ors_fallback import estimate_duration_matrix
+
+logger = logging.getLogger(__name__)
+
+# Real durations are fetched for each stop's k nearest neighbours (both directions) and the depot.
+SPARSE_MATRIX_K = int(os.environ.get("SPARSE_MATRIX_K", "20"))
+# Blocks bigger than one ORS request are split until they hold at most this many cells per
+# wanted cell; smaller blocks are kept whole, since splitting them only adds requests.
+SPARSE_MATRIX_BLOCK_OVERHEAD = float(os.environ.get("SPARSE_MATRIX_BLOCK_OVERHEAD", "1.5"))
+
+_KM_PER_DEG_LAT = 110.574
+_KM_PER_DEG_LON = 111.320
+
+
+class GridIndex:
+    """Uniform grid over projected coordinates for k-nearest-neighbour queries."""
+
+    def __init__(self, points_lonlat: Sequence[Sequence[float]], per_cell: int = 8):
+        pts = np.asarray(points_lonlat, dtype=np.float64).reshape(-1, 2)
+        lat0 = np.radians(pts[:, 1].mean()) if len(pts) else 0.0
+        self.xy = np.stack(
+            [pts[:, 0] * _KM_PER_DEG_LON * np.cos(lat0), pts[:, 1] * _KM_PER_DEG_LAT],
+            axis=1,
+        )
+        span = np.ptp(self.xy, axis=0) if len(pts) else np.zeros(2)
+        area = max(float(span[0] * span[1]), 1e-6)
+        self.cell = max(np.sqrt(area * per_cell / max(len(pts), 1)), 1e-3)
+        self.cells = np.floor(self.xy / self.cell).astype(np.int64)
+
+        order = np.lexsort((self.cells[:, 1], self.cells[:, 0]))
+        keys, starts = np.unique(self.cells[order], axis=0, return_index=True)
+        ends = np.append(starts[1:], len(order))
+        self._members: Dict[Tuple[int, int], np.ndarray] = {
+            (int(cx), int(cy)): order[s:e] for (cx, cy), s, e in zip(keys, starts, ends)
+        }
+
+    def _ring(self, cx: int, cy: int, r: int) -> List[np.ndarray]:
+        if r == 0:
+            found = self._members.get((cx, cy))
+            return [found] if found is not None else []
+        out = []
+        for dx in range(-r, r + 1):
+            for dy in (-r, r) if abs(dx) != r else range(-r, r + 1):
+                found = self._members.get((cx + dx, cy + dy))
+                if found is not None:
+                    out.append(found)
+        return out
+
+    def neighbours(self, k: int) -> np.ndarray:
+        """(n, k') indices of each point's nearest other points, k' = min(k, n - 1)."""
+        n = len(self.xy)
+        k = min(k, n - 1)
+        out = np.zeros((n, max(k, 0)), dtype=np.intp)
+        if k <= 0:
+            return out
+        for i in range(n):
+            cx, cy = (int(c) for c in self.cells[i])
+            parts: List[np.ndarray] = []
+            count, r = 0, 0
+            while True:
+                ring = self._ring(cx, cy, r)
+                parts.extend(ring)
+                count += sum(len(p) for p in ring)
+                if count > k:
+                    cand = np.concatenate(parts)
+                    cand = cand[cand != i]
+                    d = np.hypot(*(self.xy[cand] - self.xy[i]).T)
+                    nearest = np.argpartition(d, k - 1)[:k]
+                    # Points beyond ring r are at least r cells away.
+                    if d[nearest].max() <= r * self.cell:
+                        out[i] = cand[nearest[np.argsort(d[nearest])]]
+                        break
+                r += 1
+        return out
+
+
+def _split_block(
+    xy: np.ndarray,
+    rows: np.ndarray,
+    sub: np.ndarray,
+    blocks: List[Tuple[List[int], List[int]]],
+) -> None:
+    """Bisect sources along their wider axis until the block fits one request or wastes little."""
+    cols = sub.any(axis=0)
+    size = len(rows) * int(cols.sum())
+    if len(rows) == 1 or size <= max(ORS_MATRIX_MAX_ELEMENTS, SPARSE_MATRIX_BLOCK_OVERHEAD * sub.sum()):
+        blocks.append((rows.tolist(), np.flatnonzero(cols).tolist()))
+        return
+    axis = int(np.argmax(np.ptp(xy, axis=0)))
+    order = np.argsort(xy[:, axis], kind="stable")
+    for half in (order[: len(order) // 2], order[len(order) // 2:]):
+        _split_block(xy[half], rows[half], sub[half], blocks)
+
+
+def _source_blocks(
+    index: GridIndex,
+    wanted: np.ndarray,
+    offset: int,
+) -> List[Tuple[List[int], List[int]]]:
+    """Group wanted cells by source grid cell: neighbouring stops share most destinations.
+
+    A cell's sources ask for the union of their neighbours' destinations, so blocks
+    larger than one request are split (see SPARSE_MATRIX_BLOCK_OVERHEAD) and the
+    cells actually sent to ORS are counted in CacheStats.requested.
+    """
+    blocks: List[Tuple[List[int], List[int]]] = []
+    for members in index._members.values():
+        sub = wanted[members + offset]
+        has = sub.any(axis=1)
+        if not has.any():
+            continue
+        _split_block(index.xy[members[has]], members[has] + offset, sub[has], blocks)
+    return blocks
+
+
+def get_sparse_duration_matrix(
+    locations_lonlat: List[List[float]],
+    k: int = SPARSE_MATRIX_K,
+    stats: Optional[CacheStats] = None,
+) -> Tuple[DurationMatrix, np.ndarray]:
+    """Durations measured for k-nearest neighbours and the depot, estimated elsewhere.
+
+    Location 0 is the depot. Returns the matrix and the boolean mask of cells
+    holding real (cached or ORS) durations; O(N*k) cells are wanted instead
+    of N^2, and the block grouping sends a small multiple of that to ORS. Estimated cells are scaled by the median measured/estimate
+    ratio so both kinds of cell agree on average.
+    """
+    stats = stats if stats is not None else CacheStats()
+    n = len(locations_lonlat)
+    keys = location_keys(locations_lonlat)
+
+    wanted = np.zeros((n, n), dtype=bool)
+    wanted[0, :] = True
+    wanted[:, 0] = True
+    if n > 2:
+        index = GridIndex(locations_lonlat[1:])
+        knn = index.neighbours(k) + 1
+        rows = np.repeat(np.arange(1, n), knn.shape[1])
+        cols = knn.ravel()
+        wanted[rows, cols] = True
+        wanted[cols, rows] = True
+    np.fill_diagonal(wanted, False)
+
+    matrix = np.full((n, n), UNREACHABLE, dtype=np.int32)
+    np.fill_diagonal(matrix, 0)
+    wi, wj = np.nonzero(wanted)
+    cached = get_cache().lookup_pairs(ORS_PROFILE, keys, wi, wj, stats)
+    hit = cached != MISSING
+    matrix[wi[hit], wj[hit]] = cached[hit]
+    missing = np.zeros((n, n), dtype=bool)
+    missing[wi[~hit], wj[~hit]] = True
+
+    blocks: List[Tuple[List[int], List[int]]] = []
+    if missing[0].any():
+        blocks.append(([0], np.flatnonzero(missing[0]).tolist()))
+    if missing[1:, 0].any():
+        blocks.append(((np.flatnonzero(missing[1:, 0]) + 1).tolist(), [0]))
+    if n > 2:
+        inner = missing.copy()
+        inner[0, :] = False
+        inner[:, 0] = False
+        blocks += _source_blocks(index, inner, offset=1)
+    requests_made = fill_missing(locations_lonlat, matrix, missing, stats, blocks=blocks) if blocks else 0
+
+    measured = wanted & (matrix < UNREACHABLE)
+    np.fill_diagonal(measured, True)
+    estimate = estimate_duration_matrix(locations_lonlat)
+    mi, mj = np.nonzero(measured & (estimate > 0))
+    ratio = float(np.median(matrix[mi, mj] / estimate[mi, mj])) if len(mi) else 1.0
+    ratio = float(np.clip(ratio, 0.5, 3.0))
+    fill = ~measured
+    matrix[fill] = np.rint(estimate[fill] * ratio).astype(np.int32)
+    stats.estimated += int(fill.sum())
+
+    logger.info(
+        "Sparse matrix %sx%s k=%s: measured=%s (%.1f%%) ors_requests=%s estimate_ratio=%.2f",
+        n,
+        n,
+        k,
+        int(measured.sum()),
+        100.0 * measured.sum() / max(n * n, 1),
+        requests_made,
+        ratio,
+    )
+    return DurationMatrix(matrix), measured
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import logging
+import os
+from dataclasses import replace
+from typing import TYPE_CHECKING, Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from backend.solver import Node
+
+logger = logging.getLogger(__name__)
+
+# Locations closer than this (same grid cell) share one matrix row/column.
+LOCATION_DEDUP_METERS = float(os.environ.get("LOCATION_DEDUP_METERS", "5"))
+
+_METERS_PER_DEG_LAT = 111_320.0
+
+
+def dedupe_locations(
+    locations_lonlat: Sequence[Sequence[float]],
+    meters: float = LOCATION_DEDUP_METERS,
+) -> Tuple[List[List[float]], np.ndarray]:
+    """Collapse identical or near-identical coordinates.
+
+    Returns the unique locations (first occurrence kept, in input order, so the
+    depot stays at 0) and, for every input location, its index among them.
+    """
+    pts = np.asarray(locations_lonlat, dtype=np.float64).reshape(-1, 2)
+    if not len(pts):
+        return [], np.zeros(0, dtype=np.intp)
+
+    step = max(float(meters), 0.1) / _METERS_PER_DEG_LAT
+    lon_scale = np.maximum(np.cos(np.radians(pts[:, 1])), 0.01)
+    cells = np.stack(
+        [np.floor(pts[:, 0] * lon_scale / step), np.floor(pts[:, 1] / step)],
+        axis=1,
+    ).astype(np.int64)
+    _, first, inverse = np.unique(cells, axis=0, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return pts[first[order]].tolist(), rank[inverse.reshape(-1)].astype(np.intp)
+
+
+def _capacity(x: float) -> int:
+    return int(round(x * 1000))
+
+
+def merge_colocated_orders(
+    orders: List[Node],
+    max_weight: int,
+    max_volume: int,
+    meters: float = LOCATION_DEDUP_METERS,
+) -> Tuple[List[Node], List[List[int]]]:
+    """Merge orders at the same stop into single solver nodes.
+
+    Orders are merged when they share a location, require the same skills, have
+    overlapping time windows (the merged node gets the intersection) and their
+    summed weight/volume still fits the largest vehicle (`max_*` in solver units).
+    Returns the merged nodes and, for each, the indices of its member orders.
+    """
+    if not orders:
+        return [], []
+    _, location = dedupe_locations([[o.lon, o.lat] for o in orders], meters)
+
+    merged: List[Node] = []
+    groups: List[List[int]] = []
+    open_by_stop: Dict[Tuple[int, Tuple[str, ...]], List[int]] = {}
+    for i in sorted(range(len(orders)), key=lambda k: (int(location[k]), orders[k].tw_start)):
+        order = orders[i]
+        stop = (int(location[i]), tuple(sorted(order.skills_required or [])))
+        for g in open_by_stop.get(stop, []):
+            node = merged[g]
+            tw_start = max(node.tw_start, order.tw_start)
+            tw_end = min(node.tw_end, order.tw_end)
+            weight = node.weight + order.weight
+            volume = node.volume + order.volume
+            if tw_start <= tw_end and _capacity(weight) <= max_weight and _capacity(volume) <= max_volume:
+                merged[g] = replace(node, weight=weight, volume=volume, tw_start=tw_start, tw_end=tw_end)
+                groups[g].append(i)
+                break
+        else:
+            open_by_stop.setdefault(stop, []).append(len(merged))
+            merged.append(replace(order))
+            groups.append([i])
+
+    return merged, groups
+
+
+def expand_merged_result(
+    result: Dict[str, Any],
+    orders: List[Node],
+    merged: List[Node],
+    groups: List[List[int]],
+) -> Dict[str, Any]:
+    """Rewrite a result solved on merged nodes in terms of the original orders.
+
+    Members of a merged stop are listed consecutively with the stop's arrival
+    time; loads step up by each member's demand as in the unmerged model.
+    """
+    by_id = {node.id: group for node, group in zip(merged, groups)}
+
+    for route in result.get("vehicles", []):
+        stops: List[Dict[str, Any]] = []
+        for stop in route["stops"]:
+            group = by_id.get(stop["id"]) if stop["kind"] == "order" else None
+            if group is None:
+                stops.append(stop)
+                continue
+            load_weight, load_volume = stop["load_weight"], stop["load_volume"]
+            for i in group:
+                order = orders[i]
+                stops.append(
+                    {
+                        **stop,
+                        "id": order.id,
+                        "lat": order.lat,
+                        "lon": order.lon,
+                        "load_weight": load_weight,
+                        "load_volume": load_volume,
+                    }
+                )
+                load_weight += _capacity(order.weight)
+                load_volume += _capacity(order.volume)
+        route["stops"] = stops
+
+    result["unassigned"] = [orders[i].id for node_id in result.get("unassigned", []) for i in by_id.get(node_id, [])]
+    result["colocated_merge"] = {"orders": len(orders), "nodes": len(merged)}
+    return result
@@ -0,0 +1,296 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from backend import db
+from backend import local_router
+from backend.duration_matrix import DurationMatrix
+from backend.matrix_cache import CacheStats
+from backend.hedged_matrix import MATRIX_HEDGE_DEADLINE_SECONDS
+from backend.matrix_service import build_duration_matrix_within
+from backend.ors import DEFAULT_ORS_MATRIX_URL, ORS_MATRIX_URL
+from backend.ors_directions import (
+    ORS_DIRECTIONS_ASYMMETRY_MIN_SAMPLES,
+    ORS_DIRECTIONS_ASYMMETRY_SAMPLE,
+    ORS_DIRECTIONS_RATE_PER_MINUTE,
+    ORS_DIRECTIONS_SYMMETRIC,
+    get_duration_matrix_via_directions,
+)
+from backend.ors_fallback import get_duration_matrix_fallback
+from backend.ors_quota import get_key_pool
+from backend.sparse_matrix import SPARSE_MATRIX_K, get_sparse_duration_matrix
+
+logger = logging.getLogger(__name__)
+
+# Cheapest (in quality lost) first; fallback always fits and never trips.
+STRATEGIES = ("local_router", "ors_matrix", "ors_sparse", "ors_directions", "fallback")
+# Strategies fetching through ors.fill_missing, which counts the cells it sends in CacheStats.requested.
+_COUNTED_STRATEGIES = ("ors_matrix", "ors_sparse")
+
+# Seconds the matrix step may take in total, across strategy attempts.
+MATRIX_TIME_BUDGET_SECONDS = float(os.environ.get("MATRIX_TIME_BUDGET_SECONDS", "120"))
+# Breaker opens after this many consecutive failures or this smoothed error rate.
+STRATEGY_BREAKER_FAILURES = int(os.environ.get("STRATEGY_BREAKER_FAILURES", "3"))
+STRATEGY_BREAKER_ERROR_RATE = float(os.environ.get("STRATEGY_BREAKER_ERROR_RATE", "0.5"))
+STRATEGY_BREAKER_COOLDOWN_SECONDS = float(os.environ.get("STRATEGY_BREAKER_COOLDOWN_SECONDS", "300"))
+
+EWMA_ALPHA = 0.3
+MIN_SAMPLES_FOR_RATE = 4
+
+# Priors (seconds per matrix cell) until a strategy has been observed.
+_PRIOR_SECONDS_PER_CELL = {
+    "local_router": 1e-6,
+    "ors_matrix": 2e-4,
+    "ors_sparse": 2e-4,
+    "ors_directions": 60.0 / max(ORS_DIRECTIONS_RATE_PER_MINUTE, 1e-6),
+    "fallback": 0.0,
+}
+
+
+# Prior for cells the sparse mode sends to ORS per location: its kNN cells plus the unwanted
+# cells its sources x destinations blocks carry (about 3-5x the wanted ones).
+_PRIOR_SPARSE_CELLS_PER_LOCATION = 4 * SPARSE_MATRIX_K + 2
+
+
+def _cells(strategy: str, n_locations: int, per_location: Optional[float] = None) -> int:
+    """Cells a strategy requests: the observed per-location count or O(N*k) prior for the sparse mode, N^2 otherwise."""
+    if strategy == "ors_sparse":
+        per_location = per_location if per_location is not None else _PRIOR_SPARSE_CELLS_PER_LOCATION
+        return min(n_locations * n_locations, int(n_locations * per_location))
+    if strategy == "ors_directions" and ORS_DIRECTIONS_SYMMETRIC:
+        upper = n_locations * (n_locations - 1) // 2
+        sampled = max(ORS_DIRECTIONS_ASYMMETRY_MIN_SAMPLES, int(round(upper * ORS_DIRECTIONS_ASYMMETRY_SAMPLE)))
+        return upper + min(upper, sampled)
+    return n_locations * n_locations
+
+
+def _uses_key_pool(strategy: str) -> bool:
+    # Matrix strategies only spend key quota against the public API.
+    return strategy == "ors_directions" or ORS_MATRIX_URL == DEFAULT_ORS_MATRIX_URL
+
+
+@dataclass
+class StrategyStats:
+    samples: int = 0
+    seconds_per_cell: Optional[float] = None
+    error_rate: float = 0.0
+    rate_limited_rate: float = 0.0
+    consecutive_failures: int = 0
+    open_until: float = 0.0  # wall-clock epoch seconds
+    cells_per_location: Optional[float] = None  # sparse mode: cells actually sent to ORS
+
+    def record(self, cells: int, seconds: float, ok: bool, rate_limited: bool) -> None:
+        self.samples += 1
+        if ok and cells > 0:
+            observed = seconds / cells
+            self.seconds_per_cell = (
+                observed
+                if self.seconds_per_cell is None
+                else (1 - EWMA_ALPHA) * self.seconds_per_cell + EWMA_ALPHA * observed
+            )
+        self.error_rate = (1 - EWMA_ALPHA) * self.error_rate + EWMA_ALPHA * (0.0 if ok else 1.0)
+        self.rate_limited_rate = (1 - EWMA_ALPHA) * self.rate_limited_rate + EWMA_ALPHA * (1.0 if rate_limited else 0.0)
+        self.consecutive_failures = 0 if ok else self.consecutive_failures + 1
+
+        unhealthy = self.consecutive_failures >= STRATEGY_BREAKER_FAILURES or (
+            self.samples >= MIN_SAMPLES_FOR_RATE and self.error_rate >= STRATEGY_BREAKER_ERROR_RATE
+        )
+        if not ok and unhealthy:
+            self.open_until = time.time() + STRATEGY_BREAKER_COOLDOWN_SECONDS
+        elif ok:
+            self.open_until = 0.0
+
+
+@dataclass
+class StrategyDecision:
+    strategy: str
+    reasons: List[str] = field(default_factory=list)
+    attempts: List[Dict[str, Any]] = field(default_factory=list)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class StrategySelector:
+    """Chooses the matrix strategy from rolling per-strategy health, persisted in Postgres."""
+
+    def __init__(self, stats: Optional[Dict[str, StrategyStats]] = None):
+        self.stats: Dict[str, StrategyStats] = stats or {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls) -> "StrategySelector":
+        stats: Dict[str, StrategyStats] = {}
+        try:
+            for name, raw in db.fetch_strategy_stats().items():
+                known = {k: v for k, v in (raw or {}).items() if k in StrategyStats.__dataclass_fields__}
+                stats[name] = StrategyStats(**known)
+        except Exception as e:
+            logger.warning("Strategy stats unavailable, starting from priors: %s", e)
+        return cls(stats)
+
+    def _stats(self, strategy: str) -> StrategyStats:
+        return self.stats.setdefault(strategy, StrategyStats())
+
+    def predict_seconds(self, strategy: str, n_locations: int) -> float:
+        st = self._stats(strategy)
+        per_cell = st.seconds_per_cell if st.seconds_per_cell is not None else _PRIOR_SECONDS_PER_CELL[strategy]
+        if st.seconds_per_cell is None and strategy == "ors_directions":
+            per_cell /= max(1, len(get_key_pool().keys))
+        # Each 429 costs roughly a retry round; inflate by the observed share.
+        return per_cell * _cells(strategy, n_locations, st.cells_per_location) * (1.0 + 4.0 * st.rate_limited_rate)
+
+    def available(self, strategy: str) -> Tuple[bool, str]:
+        if strategy == "local_router" and not local_router.is_available():
+            return False, "no local router graph configured"
+        if strategy in ("ors_matrix", "ors_sparse", "ors_directions") and _uses_key_pool(strategy):
+            pool = get_key_pool()
+            if not pool.keys:
+                return False, "ORS_API_KEY not set"
+            endpoint = "directions" if strategy == "ors_directions" else "matrix"
+            try:
+                if pool.total_daily_headroom(endpoint) <= 0:
+                    return False, f"daily {endpoint} quota exhausted on all {len(pool.keys)} key(s)"
+            except Exception as e:
+                logger.warning("ORS quota headroom unavailable: %s", e)
+        st = self._stats(strategy)
+        if st.open_until > time.time():
+            return False, (
+                f"circuit open for {st.open_until - time.time():.0f}s "
+                f"(error_rate={st.error_rate:.2f}, consecutive_failures={st.consecutive_failures})"
+            )
+        return True, ""
+
+    def choose(
+        self,
+        n_locations: int,
+        budget_seconds: float,
+        exclude: Tuple[str, ...] = (),
+    ) -> StrategyDecision:
+        reasons: List[str] = []
+        for strategy in STRATEGIES:
+            if strategy in exclude:
+                continue
+            if strategy == "fallback":
+                reasons.append("fallback: always available")
+                return StrategyDecision("fallback", reasons)
+            ok, why = self.available(strategy)
+            if not ok:
+                reasons.append(f"{strategy}: {why}")
+                continue
+            predicted = self.predict_seconds(strategy, n_locations)
+            if predicted > budget_seconds:
+                reasons.append(f"{strategy}: predicted {predicted:.1f}s exceeds remaining budget {budget_seconds:.1f}s")
+                continue
+            reasons.append(f"{strategy}: predicted {predicted:.1f}s within budget {budget_seconds:.1f}s")
+            return StrategyDecision(strategy, reasons)
+        return StrategyDecision("fallback", reasons)
+
+    def record(
+        self,
+        strategy: str,
+        n_locations: int,
+        seconds: float,
+        ok: bool,
+        rate_limited: bool = False,
+        cells: Optional[int] = None,
+    ) -> None:
+        """`cells` is what the strategy actually requested, when it knows; else it is predicted from `n_locations`."""
+        with self._lock:
+            st = self._stats(strategy)
+            # A warm cache requests nothing; that says nothing about how big a cold request is.
+            if cells and ok and n_locations > 0 and strategy == "ors_sparse":
+                observed = cells / n_locations
+                st.cells_per_location = (
+                    observed
+                    if st.cells_per_location is None
+                    else (1 - EWMA_ALPHA) * st.cells_per_location + EWMA_ALPHA * observed
+                )
+            st.record(cells if cells is not None else _cells(strategy, n_locations, st.cells_per_location), seconds, ok, rate_limited)
+            snapshot = asdict(st)
+        try:
+            db.upsert_strategy_stats(strategy, snapshot)
+        except Exception as e:
+            logger.warning("Could not persist strategy stats for %s: %s", strategy, e)
+
+
+def compute_matrix(
+    locations_lonlat: List[List[float]],
+    pending_route_id: Optional[str] = None,
+    parent_pending_route_id: Optional[str] = None,
+    reference_time_iso: Optional[str] = None,
+    stats: Optional[CacheStats] = None,
+    budget_seconds: float = MATRIX_TIME_BUDGET_SECONDS,
+    selector: Optional[StrategySelector] = None,
+    first: Optional[StrategyDecision] = None,
+) -> Tuple[DurationMatrix, StrategyDecision]:
+    """Run strategies in selector order until one succeeds within the time budget."""
+    stats = stats if stats is not None else CacheStats()
+    selector = selector or StrategySelector.load()
+    n = len(locations_lonlat)
+    runners: Dict[str, Callable[[], DurationMatrix]] = {
+        "local_router": lambda: local_router.get_duration_matrix_local(locations_lonlat, stats),
+        "ors_matrix": lambda: build_duration_matrix_within(
+            locations_lonlat,
+            # Hedged: past the deadline, delivered ORS cells plus estimates are used.
+            deadline_seconds=(
+                min(MATRIX_HEDGE_DEADLINE_SECONDS, max(1.0, deadline - time.monotonic()))
+                if MATRIX_HEDGE_DEADLINE_SECONDS > 0
+                else 0.0
+            ),
+            pending_route_id=pending_route_id,
+            parent_pending_route_id=parent_pending_route_id,
+            stats=stats,
+            reference_time_iso=reference_time_iso,
+        ),
+        "ors_sparse": lambda: get_sparse_duration_matrix(locations_lonlat, stats=stats)[0],
+        "ors_directions": lambda: get_duration_matrix_via_directions(locations_lonlat, stats),
+        "fallback": lambda: get_duration_matrix_fallback(locations_lonlat),
+    }
+
+    deadline = time.monotonic() + budget_seconds
+    decision = first or selector.choose(n, budget_seconds)
+    tried: List[str] = []
+    attempts: List[Dict[str, Any]] = []
+    while True:
+        strategy = decision.strategy
+        tried.append(strategy)
+        rate_limited_before = stats.rate_limited
+        requested_before = stats.requested
+        started = time.monotonic()
+        try:
+            matrix = runners[strategy]()
+        except Exception as e:
+            elapsed = time.monotonic() - started
+            logger.warning("Matrix strategy %s failed after %.1fs: %s", strategy, elapsed, e)
+            attempts.append({"strategy": strategy, "ok": False, "seconds": round(elapsed, 3), "error": str(e)[:200]})
+            if strategy == "fallback":
+                raise
+            selector.record(strategy, n, elapsed, ok=False, rate_limited=stats.rate_limited > rate_limited_before)
+            following = selector.choose(n, max(0.0, deadline - time.monotonic()), exclude=tuple(tried))
+            decision = StrategyDecision(following.strategy, decision.reasons + following.reasons)
+            continue
+
+        elapsed = time.monotonic() - started
+        attempts.append({"strategy": strategy, "ok": True, "seconds": round(elapsed, 3)})
+        # A hedge that hit its deadline says nothing about how long ORS takes.
+        cut_short = bool(stats.hedge) and not stats.hedge.get("completed")
+        if strategy != "fallback" and not cut_short:
+            selector.record(
+                strategy,
+                n,
+                elapsed,
+                ok=True,
+                rate_limited=stats.rate_limited > rate_limited_before,
+                # Cached, shared or derived cells cost nothing and sparse blocks carry unwanted
+                # ones: charge the cells actually sent, so warm runs don't lower the per-cell cost.
+                cells=stats.requested - requested_before if strategy in _COUNTED_STRATEGIES else None,
+            )
+        decision.attempts = attempts
+        logger.info("Matrix strategy %s succeeded in %.1fs (%s)", strategy, elapsed, "; ".join(decision.reasons))
+        return matrix, decision
@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Sequence
+from zoneinfo import ZoneInfo
+
+import numpy as np
+from dateutil import parser as dtparser
+
+from backend.duration_matrix import DurationMatrix
+from backend.logging_utils import setup_logging
+from backend.matrix_cache import MISSING, CacheStats, get_cache, location_keys
+from backend.ors import ORS_PROFILE, UNREACHABLE
+
+logger = logging.getLogger(__name__)
+
+HOURS_PER_WEEK = 7 * 24
+
+# Local clock the hour-of-week is read in (rush hours are local).
+TRAFFIC_TIMEZONE = os.environ.get("TRAFFIC_TIMEZONE", "UTC")
+# Default weekday profile: these hours (inclusive ranges) are slowed by TRAFFIC_RUSH_FACTOR.
+TRAFFIC_RUSH_HOURS = os.environ.get("TRAFFIC_RUSH_HOURS", "7-9,17-19")
+TRAFFIC_RUSH_FACTOR = float(os.environ.get("TRAFFIC_RUSH_FACTOR", "1.3"))
+# Optional JSON list of 168 factors (Monday 00h first) replacing the default profile.
+TRAFFIC_PROFILE_PATH = os.environ.get("TRAFFIC_PROFILE_PATH")
+
+
+def _default_factors() -> np.ndarray:
+    factors = np.ones(HOURS_PER_WEEK, dtype=np.float64)
+    for part in filter(None, (p.strip() for p in TRAFFIC_RUSH_HOURS.split(","))):
+        start, _, end = part.partition("-")
+        hours = range(int(start), int(end or start) + 1)
+        for day in range(5):
+            for hour in hours:
+                factors[day * 24 + hour % 24] = TRAFFIC_RUSH_FACTOR
+    return factors
+
+
+_factors: Optional[np.ndarray] = None
+_factors_lock = threading.Lock()
+
+
+def congestion_factors() -> np.ndarray:
+    """Duration multiplier per hour-of-week bucket (Monday 00h = bucket 0)."""
+    global _factors
+    with _factors_lock:
+        if _factors is None:
+            factors = _default_factors()
+            if TRAFFIC_PROFILE_PATH:
+                try:
+                    with open(TRAFFIC_PROFILE_PATH, "r", encoding="utf-8") as f:
+                        loaded = np.asarray(json.load(f), dtype=np.float64)
+                    if loaded.shape != (HOURS_PER_WEEK,) or not np.all(loaded > 0):
+                        raise ValueError(f"expected {HOURS_PER_WEEK} positive factors")
+                    factors = loaded
+                except (OSError, ValueError) as e:
+                    logger.warning("Ignoring traffic profile %s: %s", TRAFFIC_PROFILE_PATH, e)
+            _factors = factors
+        return _factors
+
+
+def hour_of_week(reference_time_iso: str) -> int:
+    dt = dtparser.isoparse(reference_time_iso)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    local = dt.astimezone(ZoneInfo(TRAFFIC_TIMEZONE))
+    return local.weekday() * 24 + local.hour
+
+
+def active_bucket(reference_time_iso: Optional[str]) -> Optional[int]:
+    """Hour-of-week bucket for a departure, or None when it plans on free-flow times."""
+    if not reference_time_iso:
+        return None
+    bucket = hour_of_week(reference_time_iso)
+    return bucket if congestion_factors()[bucket] != 1.0 else None
+
+
+def bucket_profile(bucket: int, profile: str = ORS_PROFILE) -> str:
+    """Cache tier of a bucket, versioned by its congestion factor.
+
+    Changing the profile gives the bucket a new tier, so cells scaled with the old
+    factor are never served again (they age out of the LRU; disk rows are orphaned).
+    """
+    return f"{profile}@how{bucket:03d}x{congestion_factors()[bucket]:.4f}"
+
+
+def bucket_matrix(
+    locations_lonlat: Sequence[Sequence[float]],
+    bucket: int,
+    free_flow: Callable[[], DurationMatrix],
+    stats: Optional[CacheStats] = None,
+    profile: str = ORS_PROFILE,
+) -> DurationMatrix:
+    """Matrix for an hour-of-week bucket, served from the bucket tier of the cache.
+
+    ORS has no departure-time aware matrix, so cells the bucket has not seen are
+    derived from the free-flow matrix scaled by the bucket's congestion factor
+    and stored under the bucket. Cells written there by other means (e.g. an
+    imported observed profile) take precedence over the scaled estimate.
+    """
+    keys = location_keys(locations_lonlat)
+    cache = get_cache()
+    tier = bucket_profile(bucket, profile)
+    lookup_stats = CacheStats()
+    matrix = cache.lookup(tier, keys, lookup_stats)
+    if stats is not None:
+        stats.bucket_hits += lookup_stats.hits
+
+    missing = matrix == MISSING
+    if missing.any():
+        base = free_flow().array
+        factor = congestion_factors()[bucket]
+        scaled = np.where(base < UNREACHABLE, np.rint(base * factor), UNREACHABLE).astype(np.int32)
+        matrix[missing] = scaled[missing]
+        new_i, new_j = np.nonzero(missing & (matrix < UNREACHABLE))
+        values = matrix[new_i, new_j].tolist()
+        cache.store(tier, ((keys[i], keys[j], v) for i, j, v in zip(new_i.tolist(), new_j.tolist(), values)))
+        if stats is not None:
+            stats.bucket_filled += len(values)
+
+    logger.info(
+        "Traffic bucket %s (x%.2f): served=%s derived=%s",
+        bucket,
+        congestion_factors()[bucket],
+        lookup_stats.hits,
+        int(missing.sum()),
+    )
+    return DurationMatrix(matrix)
+
+
+def _payload_locations_and_time(payload: dict) -> tuple[List[List[float]], str]:
+    from backend.models import PendingPayload
+
+    parsed = PendingPayload.model_validate(payload)
+    locations = [[float(parsed.depot.lon), float(parsed.depot.lat)]]
+    locations += [[float(o.lon), float(o.lat)] for o in parsed.orders]
+    starts = [o.ventana_inicio for o in parsed.orders]
+    if parsed.depot.ventana_inicio is not None:
+        starts.append(parsed.depot.ventana_inicio)
+    t0 = min(starts) if starts else datetime.now(timezone.utc)
+    if t0.tzinfo is None:
+        t0 = t0.replace(tzinfo=timezone.utc)
+    return locations, t0.isoformat()
+
+
+def precompute(limit: int, all_buckets: bool = False) -> None:
+    """Warm the free-flow and bucket tiers for routes still waiting to be optimized."""
+    from backend import db
+    from backend.matrix_service import build_duration_matrix
+
+    rush = [b for b in range(HOURS_PER_WEEK) if congestion_factors()[b] != 1.0]
+    for row in db.fetch_pending_route_payloads(limit):
+        started = time.monotonic()
+        try:
+            locations, reference_time_iso = _payload_locations_and_time(row["payload"])
+            stats = CacheStats()
+            base = build_duration_matrix(locations, stats=stats)
+            buckets = rush if all_buckets else [b for b in [active_bucket(reference_time_iso)] if b is not None]
+            for bucket in buckets:
+                bucket_matrix(locations, bucket, lambda: base, stats)
+        except Exception as e:
+            logger.warning("Precompute failed for pending_route_id=%s: %s", row["id"], e)
+            continue
+        logger.info(
+            "Precomputed pending_route_id=%s buckets=%s in %.1fs: %s",
+            row["id"],
+            buckets,
+            time.monotonic() - started,
+            stats.as_dict(),
+        )
+
+
+def main() -> None:
+    setup_logging()
+    parser = argparse.ArgumentParser(description="Precompute hour-of-week matrices for pending routes (run off-peak)")
+    parser.add_argument("--limit", type=int, default=50, help="pending routes to warm")
+    parser.add_argument("--all-buckets", action="store_true", help="fill every congested bucket, not just each route's own")
+    args = parser.parse_args()
+    precompute(args.limit, all_buckets=args.all_buckets)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+from backend.logging_utils import setup_logging
+from backend.matrix_cache import COORD_PRECISION, get_cache
+from backend.ors_fallback import haversine_km_matrix
+
+logger = logging.getLogger(__name__)
+
+TRAVEL_TIME_MODEL_PATH = os.environ.get(
+    "TRAVEL_TIME_MODEL_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "route_optimizer", "travel_time_model.npz"),
+)
+
+REGION_DEG = 0.1  # ~11 km: one detour/pace model per region
+CELL_DEG = 0.02  # ~2 km: cell-to-cell correction table
+MIN_REGION_SAMPLES = 30
+MIN_PAIR_SAMPLES = 3
+MIN_TRAINING_KM = 0.05
+
+
+def _cell_ids(lon: np.ndarray, lat: np.ndarray, size: float) -> np.ndarray:
+    cx = np.floor(np.asarray(lon) / size).astype(np.int64) + (1 << 15)
+    cy = np.floor(np.asarray(lat) / size).astype(np.int64) + (1 << 15)
+    return ((cx << 16) | cy).astype(np.uint64)
+
+
+def _pair_keys(src_cells: np.ndarray, dst_cells: np.ndarray) -> np.ndarray:
+    return (src_cells << np.uint64(32)) | dst_cells
+
+
+@dataclass
+class TravelTimeEstimator:
+    """Haversine-based estimator calibrated on stored ORS durations.
+
+    Each region has `seconds = offset + seconds_per_km * km` (the slope folds in
+    the road detour factor and the average speed); a cell-to-cell table then
+    applies the median observed correction where enough samples exist.
+    """
+
+    region_keys: np.ndarray
+    region_offset: np.ndarray
+    region_slope: np.ndarray
+    global_offset: float
+    global_slope: float
+    pair_keys: np.ndarray
+    pair_factor: np.ndarray
+    samples: int = 0
+
+    def _region_params(self, lon: np.ndarray, lat: np.ndarray):
+        ids = _cell_ids(lon, lat, REGION_DEG)
+        pos = np.searchsorted(self.region_keys, ids)
+        pos = np.minimum(pos, max(len(self.region_keys) - 1, 0))
+        found = self.region_keys[pos] == ids if len(self.region_keys) else np.zeros(len(ids), dtype=bool)
+        offset = np.where(found, self.region_offset[pos] if len(self.region_keys) else 0.0, self.global_offset)
+        slope = np.where(found, self.region_slope[pos] if len(self.region_keys) else 0.0, self.global_slope)
+        return offset, slope
+
+    def _pair_correction(self, src_cells: np.ndarray, dst_cells: np.ndarray) -> np.ndarray:
+        keys = _pair_keys(src_cells[:, None], dst_cells[None, :])
+        if not len(self.pair_keys):
+            return np.ones(keys.shape)
+        pos = np.minimum(np.searchsorted(self.pair_keys, keys), len(self.pair_keys) - 1)
+        return np.where(self.pair_keys[pos] == keys, self.pair_factor[pos], 1.0)
+
+    def predict_seconds(
+        self,
+        sources_lonlat: Sequence[Sequence[float]],
+        destinations_lonlat: Optional[Sequence[Sequence[float]]] = None,
+    ) -> np.ndarray:
+        src = np.asarray(sources_lonlat, dtype=np.float64).reshape(-1, 2)
+        dst = src if destinations_lonlat is None else np.asarray(destinations_lonlat, dtype=np.float64).reshape(-1, 2)
+        km = haversine_km_matrix(src, dst)
+        offset, slope = self._region_params(src[:, 0], src[:, 1])
+        seconds = offset[:, None] + slope[:, None] * km
+        seconds *= self._pair_correction(
+            _cell_ids(src[:, 0], src[:, 1], CELL_DEG),
+            _cell_ids(dst[:, 0], dst[:, 1], CELL_DEG),
+        )
+        seconds[km <= 0] = 0.0
+        return np.clip(seconds, 0, None).astype(np.int32)
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f"{path}.tmp.npz"
+        np.savez(
+            tmp,
+            region_keys=self.region_keys,
+            region_offset=self.region_offset,
+            region_slope=self.region_slope,
+            global_params=np.array([self.global_offset, self.global_slope, self.samples], dtype=np.float64),
+            pair_keys=self.pair_keys,
+            pair_factor=self.pair_factor,
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "TravelTimeEstimator":
+        with np.load(path) as data:
+            g = data["global_params"]
+            return cls(
+                region_keys=data["region_keys"],
+                region_offset=data["region_offset"],
+                region_slope=data["region_slope"],
+                global_offset=float(g[0]),
+                global_slope=float(g[1]),
+                pair_keys=data["pair_keys"],
+                pair_factor=data["pair_factor"],
+                samples=int(g[2]),
+            )
+
+
+def _fit_lines(groups: np.ndarray, n_groups: int, x: np.ndarray, y: np.ndarray):
+    n = np.bincount(groups, minlength=n_groups).astype(np.float64)
+    sx = np.bincount(groups, x, n_groups)
+    sy = np.bincount(groups, y, n_groups)
+    sxx = np.bincount(groups, x * x, n_groups)
+    sxy = np.bincount(groups, x * y, n_groups)
+    denom = n * sxx - sx * sx
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = np.where(denom > 0, (n * sxy - sx * sy) / denom, np.nan)
+        offset = (sy - slope * sx) / n
+    return n, offset, slope
+
+
+def train_estimator(cells: np.ndarray, precision: int = COORD_PRECISION) -> TravelTimeEstimator:
+    """Fit the estimator from an (n, 5) array of quantized src/dst keys and durations."""
+    cells = np.asarray(cells, dtype=np.int64).reshape(-1, 5)
+    scale = float(10**precision)
+    src = cells[:, 0:2] / scale
+    dst = cells[:, 2:4] / scale
+    y = cells[:, 4].astype(np.float64)
+
+    src_r, dst_r = np.radians(src), np.radians(dst)
+    h = (
+        np.sin((dst_r[:, 1] - src_r[:, 1]) / 2) ** 2
+        + np.cos(src_r[:, 1]) * np.cos(dst_r[:, 1]) * np.sin((dst_r[:, 0] - src_r[:, 0]) / 2) ** 2
+    )
+    km = 2 * 6371.0 * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+    keep = (km >= MIN_TRAINING_KM) & (y > 0) & (y < 10**9)
+    src, dst, y, km = src[keep], dst[keep], y[keep], km[keep]
+    if len(y) < MIN_REGION_SAMPLES:
+        raise RuntimeError(f"Not enough travel-time samples to train ({len(y)})")
+
+    _, g_offset, g_slope = _fit_lines(np.zeros(len(y), dtype=np.int64), 1, km, y)
+    global_offset = float(max(g_offset[0], 0.0))
+    global_slope = float(g_slope[0]) if g_slope[0] > 0 else float(np.median(y / km))
+
+    region_ids = _cell_ids(src[:, 0], src[:, 1], REGION_DEG)
+    region_keys, region_idx = np.unique(region_ids, return_inverse=True)
+    n, offset, slope = _fit_lines(region_idx, len(region_keys), km, y)
+    good = (n >= MIN_REGION_SAMPLES) & (slope > 0) & (offset >= 0)
+    region_keys, offset, slope = region_keys[good], offset[good], slope[good]
+
+    model = TravelTimeEstimator(
+        region_keys=region_keys,
+        region_offset=offset,
+        region_slope=slope,
+        global_offset=global_offset,
+        global_slope=global_slope,
+        pair_keys=np.zeros(0, dtype=np.uint64),
+        pair_factor=np.zeros(0, dtype=np.float64),
+        samples=int(len(y)),
+    )
+
+    r_offset, r_slope = model._region_params(src[:, 0], src[:, 1])
+    base = np.maximum(r_offset + r_slope * km, 1.0)
+    pairs = _pair_keys(_cell_ids(src[:, 0], src[:, 1], CELL_DEG), _cell_ids(dst[:, 0], dst[:, 1], CELL_DEG))
+    pair_keys, pair_idx = np.unique(pairs, return_inverse=True)
+    counts = np.bincount(pair_idx, minlength=len(pair_keys))
+    # Geometric mean of observed / region prediction per cell pair.
+    factor = np.exp(np.bincount(pair_idx, np.log(y / base), len(pair_keys)) / np.maximum(counts, 1))
+    good = counts >= MIN_PAIR_SAMPLES
+    model.pair_keys = pair_keys[good]
+    model.pair_factor = factor[good]
+    return model
+
+
+_model: Optional[TravelTimeEstimator] = None
+_model_mtime: float = -1.0
+_model_lock = threading.Lock()
+
+
+def get_estimator(path: Optional[str] = None) -> Optional[TravelTimeEstimator]:
+    """Trained estimator if one exists on disk (reloaded when the file changes)."""
+    global _model, _model_mtime
+    path = path or TRAVEL_TIME_MODEL_PATH
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    with _model_lock:
+        if _model is None or mtime != _model_mtime:
+            try:
+                _model = TravelTimeEstimator.load(path)
+                _model_mtime = mtime
+            except (OSError, KeyError, ValueError) as e:
+                logger.warning("Could not load travel-time model %s: %s", path, e)
+                return None
+        return _model
+
+
+def collect_training_cells(profile: str, use_db: bool = True) -> np.ndarray:
+    parts = [get_cache().export_cells(profile)]
+    if use_db:
+        try:
+            from backend import db
+
+            rows = db.fetch_travel_time_cells(profile)
+            parts.append(np.asarray(rows, dtype=np.int64).reshape(-1, 5))
+        except Exception as e:
+            logger.warning("Shared travel-time store unavailable for training: %s", e)
+    cells = np.concatenate(parts) if parts else np.zeros((0, 5), dtype=np.int64)
+    return np.unique(cells, axis=0) if len(cells) else cells
+
+
+def main() -> None:
+    setup_logging()
+    from backend.ors import ORS_PROFILE
+
+    parser = argparse.ArgumentParser(description="Train the travel-time estimator from cached ORS cells")
+    parser.add_argument("--out", default=TRAVEL_TIME_MODEL_PATH)
+    parser.add_argument("--profile", default=ORS_PROFILE)
+    parser.add_argument("--no-db", action="store_true", help="only use the local SQLite cache")
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    cells = collect_training_cells(args.profile, use_db=not args.no_db)
+    model = train_estimator(cells)
+    model.save(args.out)
+    summary: Dict[str, object] = {
+        "samples": model.samples,
+        "regions": int(len(model.region_keys)),
+        "cell_pairs": int(len(model.pair_keys)),
+        "global_speed_kmh": round(3600.0 / model.global_slope, 1),
+    }
+    logger.info("Travel-time model written to %s in %.1fs: %s", args.out, time.monotonic() - started, summary)
+
+
+if __name__ == "__main__":
+    main()
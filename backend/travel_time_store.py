@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from backend import db
+from backend.duration_matrix import DurationMatrix, MatrixLike
+from backend.matrix_cache import CacheStats, LocationKey, get_cache, location_keys
+from backend.ors import ORS_PROFILE
+
+logger = logging.getLogger(__name__)
+
+SharedCells = Dict[Tuple[LocationKey, LocationKey], int]
+
+
+def load_shared_travel_times(
+    locations_lonlat: Sequence[Sequence[float]],
+    stats: Optional[CacheStats] = None,
+    profile: str = ORS_PROFILE,
+) -> SharedCells:
+    """Prime the local cache with cells other runners already stored in Postgres."""
+    try:
+        shared = db.fetch_travel_times(profile, location_keys(locations_lonlat))
+    except Exception as e:
+        logger.warning("Shared travel-time lookup failed: %s", e)
+        return {}
+
+    get_cache().store(profile, ((s, d, dur) for (s, d), dur in shared.items()))
+    if stats is not None:
+        stats.shared_loaded += len(shared)
+    logger.info("Loaded %s travel-time cells from shared store", len(shared))
+    return shared
+
+
+def save_shared_travel_times(
+    locations_lonlat: Sequence[Sequence[float]],
+    duration_matrix: MatrixLike,
+    shared: SharedCells,
+    stats: Optional[CacheStats] = None,
+    profile: str = ORS_PROFILE,
+    only: Optional[np.ndarray] = None,
+) -> int:
+    """Write back every cell of the matrix (or of the `only` mask) the shared store did not have yet."""
+    keys = location_keys(locations_lonlat)
+    matrix = DurationMatrix.coerce(duration_matrix).array
+    candidates = matrix < 10**9
+    if only is not None:
+        candidates &= only
+    cells: List[Tuple[LocationKey, LocationKey, int]] = []
+    seen = set(shared)
+    for i, j in zip(*(idx.tolist() for idx in candidates.nonzero())):
+        src, dst = keys[i], keys[j]
+        if src == dst or (src, dst) in seen:
+            continue
+        seen.add((src, dst))
+        cells.append((src, dst, int(matrix[i, j])))
+
+    try:
+        written = db.upsert_travel_times(profile, cells)
+    except Exception as e:
+        logger.warning("Shared travel-time write-back failed: %s", e)
+        return 0
+
+    if stats is not None:
+        stats.shared_written += written
+    logger.info("Stored %s new travel-time cells in shared store", written)
+    return written
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import logging
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from backend import db
+from backend.matrix_cache import quantize
+
+logger = logging.getLogger(__name__)
+
+# Seed OR-Tools with an earlier plan: the same (or parent) pending route, else the most similar recent one.
+WARM_START_ENABLED = os.environ.get("WARM_START_ENABLED", "true").lower() == "true"
+# Share of today's stop locations a historical plan must visit to be used.
+WARM_START_MIN_OVERLAP = float(os.environ.get("WARM_START_MIN_OVERLAP", "0.5"))
+WARM_START_CANDIDATES = int(os.environ.get("WARM_START_CANDIDATES", "20"))
+
+
+def _stop_keys(result: Dict[str, Any]) -> Tuple[Optional[Tuple[int, int]], set]:
+    depot = None
+    keys = set()
+    for vehicle in result.get("vehicles", []):
+        for stop in vehicle.get("stops", []):
+            key = quantize(stop["lon"], stop["lat"])
+            if stop.get("kind") == "depot":
+                depot = depot or key
+            else:
+                keys.add(key)
+    return depot, keys
+
+
+def find_initial_routes(
+    pending_route_id: Optional[str],
+    parent_pending_route_id: Optional[str],
+    depot: Any,
+    orders: Sequence[Any],
+) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
+    """Routes (`vehicles` of a stored result) to warm-start from, and where they came from.
+
+    `depot` and `orders` are solver nodes (anything with `lon`/`lat`).
+    """
+    if not WARM_START_ENABLED or not orders:
+        return None, None
+
+    try:
+        for pr_id in (pending_route_id, parent_pending_route_id):
+            if not pr_id:
+                continue
+            previous = db.fetch_latest_optimized_result(pr_id)
+            if previous and previous.get("vehicles"):
+                return previous["vehicles"], {"source": "pending_route", "pending_route_id": pr_id}
+
+        depot_key = quantize(depot.lon, depot.lat)
+        wanted = {quantize(o.lon, o.lat) for o in orders}
+        best: Optional[Tuple[float, str, Dict[str, Any]]] = None
+        for pr_id, result in db.fetch_recent_optimized_results(WARM_START_CANDIDATES):
+            if pr_id == pending_route_id or not result.get("vehicles"):
+                continue
+            plan_depot, keys = _stop_keys(result)
+            if plan_depot != depot_key:
+                continue
+            overlap = len(wanted & keys) / len(wanted)
+            if best is None or overlap > best[0]:
+                best = (overlap, pr_id, result)
+        if best is not None and best[0] >= WARM_START_MIN_OVERLAP:
+            overlap, pr_id, result = best
+            return result["vehicles"], {"source": "similar_plan", "pending_route_id": pr_id, "overlap": round(overlap, 3)}
+    except Exception as e:
+        logger.warning("Warm-start lookup failed: %s", e)
+    return None, None
+
+
+def record_source(result: Dict[str, Any], source: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if source and result.get("warm_start") is not None:
+        result["warm_start"].update(source)
+    return result
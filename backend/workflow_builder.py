@@ -6,6 +6,7 @@ import logging
 from typing import Dict, Any, List, Optional, Callable
 from langgraph.graph import StateGraph, END
 
+from backend.duration_matrix import DurationMatrix
 from nodes import NodeBase, registry
 
 logger = logging.getLogger(__name__)
@@ -82,11 +83,19 @@ def build_standard_optimization_workflow():
         },
         "get_matrix": {
             "ors_api_key": os.environ.get("ORS_API_KEY"),
-            "fallback_enabled": True
+            "matrix_backend": os.environ.get("MATRIX_BACKEND", "auto"),
+            "fallback_enabled": True,
+            "fallback_speed_kmh": float(os.environ.get("FALLBACK_SPEED_KMH", "50")),
+            "hedge_deadline_seconds": float(os.environ.get("MATRIX_HEDGE_DEADLINE_SECONDS", "0"))
         },
         "solve_optimization": {
             "time_limit_seconds": int(os.environ.get("SOLVER_TIME_LIMIT_SECONDS", "30")),
-            "service_time_seconds": int(os.environ.get("SERVICE_TIME_SECONDS", "0"))
+            "service_time_seconds": int(os.environ.get("SERVICE_TIME_SECONDS", "0")),
+            "merge_colocated_orders": os.environ.get("MERGE_COLOCATED_ORDERS", "false").lower() == "true",
+            "route_geometry": os.environ.get("ROUTE_GEOMETRY_ENABLED", "false").lower() == "true",
+            "solver_portfolio": os.environ.get("SOLVER_PORTFOLIO", "false").lower() == "true",
+            "adaptive_time_limit": os.environ.get("SOLVER_ADAPTIVE_TIME_LIMIT", "false").lower() == "true",
+            "warm_start": os.environ.get("WARM_START_ENABLED", "true").lower() == "true"
         },
         "save_results": {
             "notify_on_save": os.environ.get("NOTIFY_ON_SAVE", "false").lower() == "true",
@@ -123,7 +132,8 @@ def build_standard_optimization_workflow():
         orders: List[Dict[str, Any]]
         vehicles: List[Dict[str, Any]]
         locations_lonlat: List[List[float]]
-        duration_matrix: List[List[int]]
+        duration_matrix: DurationMatrix
+        matrix_cache_stats: Dict[str, int]
         reference_time_iso: str
         result: Dict[str, Any]
     
@@ -5,12 +5,20 @@ from .database_fetch_node import DatabaseFetchNode
 from .ors_matrix_node import ORSMatrixNode
 from .or_tools_solver_node import ORToolsSolverNode
 from .save_results_node import SaveResultsNode
+from .cluster_orders_node import ClusterOrdersByZoneNode
+from .assign_vehicles_node import AssignVehiclesToClustersNode
+from .parallel_optimize_node import ParallelOptimizeNode
+from .merge_routes_node import MergeOptimizedRoutesNode
 
 # Registrar nodos automáticamente
 registry.register(DatabaseFetchNode, "fetch_data")
 registry.register(ORSMatrixNode, "get_matrix")
 registry.register(ORToolsSolverNode, "solve_optimization")
 registry.register(SaveResultsNode, "save_results")
+registry.register(ClusterOrdersByZoneNode, "cluster_orders_by_zone")
+registry.register(AssignVehiclesToClustersNode, "assign_vehicles_to_clusters")
+registry.register(ParallelOptimizeNode, "parallel_optimize")
+registry.register(MergeOptimizedRoutesNode, "merge_optimized_routes")
 
 __all__ = [
     'NodeBase',
@@ -19,5 +27,9 @@ __all__ = [
     'DatabaseFetchNode',
     'ORSMatrixNode',
     'ORToolsSolverNode',
-    'SaveResultsNode'
+    'SaveResultsNode',
+    'ClusterOrdersByZoneNode',
+    'AssignVehiclesToClustersNode',
+    'ParallelOptimizeNode',
+    'MergeOptimizedRoutesNode'
 ]
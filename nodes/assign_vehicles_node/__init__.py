@@ -0,0 +1,3 @@
+from .node import AssignVehiclesToClustersNode
+
+__all__ = ['AssignVehiclesToClustersNode']
@@ -0,0 +1,136 @@
+import logging
+from typing import Dict, Any, List
+
+from ..base import NodeBase
+from backend.decomposition import allot_vehicles
+
+logger = logging.getLogger(__name__)
+
+class AssignVehiclesToClustersNode(NodeBase):
+    """
+    Nodo que reparte la flota entre las zonas según su carga
+    (pedidos, peso, volumen) y las habilidades que requieren
+    """
+
+    __version__ = "1.0.0"
+    __author__ = "Route Optimizer Team"
+
+    @classmethod
+    def get_dependencies(cls) -> List[str]:
+        return ["numpy"]
+
+    @classmethod
+    def get_input_schema(cls) -> Dict[str, Any]:
+        return {
+            "type": "object",
+            "properties": {
+                "orders": {"type": "array"},
+                "vehicles": {"type": "array"},
+                "clusters": {
+                    "type": "array",
+                    "description": "Opcional: sin zonas todos los pedidos forman una sola"
+                }
+            },
+            "required": ["orders", "vehicles"]
+        }
+
+    @classmethod
+    def get_output_schema(cls) -> Dict[str, Any]:
+        return {
+            "type": "object",
+            "properties": {
+                "clusters": {
+                    "type": "array",
+                    "description": "Zonas con vehicle_ids asignados"
+                }
+            },
+            "required": ["clusters"]
+        }
+
+    async def execute(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Asigna vehículos a cada zona"""
+        orders = state["orders"]
+        vehicles = state["vehicles"]
+        clusters = state.get("clusters") or [
+            {"cluster_id": 0, "order_ids": [str(o["id_pedido"]) for o in orders]}
+        ]
+
+        orders_by_id = {str(o["id_pedido"]): o for o in orders}
+        demands = []
+        required_skills = []
+        for cluster in clusters:
+            members = [orders_by_id[i] for i in cluster["order_ids"] if i in orders_by_id]
+            demands.append([
+                len(members),
+                sum(float(o.get("peso") or 0.0) for o in members),
+                sum(float(o.get("volumen") or 0.0) for o in members),
+            ])
+            required_skills.append({s for o in members for s in (o.get("skills_required") or [])})
+
+        capacities = [
+            [float(v["capacity_weight"]), float(v["capacity_volume"])] for v in vehicles
+        ]
+        vehicle_skills = [set(v.get("skills") or []) for v in vehicles]
+        allotted = allot_vehicles(demands, capacities, required_skills, vehicle_skills)
+
+        clusters = self._move_uncovered_orders(clusters, allotted, orders_by_id, vehicle_skills)
+
+        assigned = []
+        for cluster, members in zip(clusters, allotted):
+            vehicle_ids = [str(vehicles[i]["id_vehicle"]) for i in members]
+            if not vehicle_ids:
+                logger.warning(f"Zone {cluster['cluster_id']} got no vehicle; its orders go to the leftover pass")
+            assigned.append({**cluster, "vehicle_ids": vehicle_ids})
+
+        logger.info(
+            f"Assigned {len(vehicles)} vehicles to {len(clusters)} zones "
+            f"({[len(c['vehicle_ids']) for c in assigned]})"
+        )
+        return {"clusters": assigned}
+
+    def _move_uncovered_orders(
+        self,
+        clusters: List[Dict[str, Any]],
+        allotted: List[List[int]],
+        orders_by_id: Dict[str, Dict[str, Any]],
+        vehicle_skills: List[set],
+    ) -> List[Dict[str, Any]]:
+        """Mueve cada pedido cuyas habilidades no cubre ningún vehículo de su zona a la zona más cercana que sí las cubra"""
+        covered = [set().union(*(vehicle_skills[v] for v in members)) for members in allotted]
+        centroids = []
+        for cluster in clusters:
+            members = [orders_by_id[i] for i in cluster["order_ids"] if i in orders_by_id]
+            centroids.append(cluster.get("centroid") or [
+                sum(float(o["lon"]) for o in members) / max(1, len(members)),
+                sum(float(o["lat"]) for o in members) / max(1, len(members)),
+            ])
+
+        order_ids = [list(c["order_ids"]) for c in clusters]
+        moved = 0
+        for c, cluster in enumerate(clusters):
+            for order_id in cluster["order_ids"]:
+                needed = set((orders_by_id.get(order_id) or {}).get("skills_required") or [])
+                if not needed or needed <= covered[c]:
+                    continue
+                order = orders_by_id[order_id]
+                targets = [t for t in range(len(clusters)) if needed <= covered[t]]
+                if not targets:
+                    continue
+                target = min(
+                    targets,
+                    key=lambda t: (centroids[t][0] - float(order["lon"])) ** 2 + (centroids[t][1] - float(order["lat"])) ** 2,
+                )
+                order_ids[c].remove(order_id)
+                order_ids[target].append(order_id)
+                moved += 1
+
+        if moved:
+            logger.info(f"Moved {moved} orders to zones whose vehicles have the required skills")
+        return [
+            {**cluster, "order_ids": ids, "orders": len(ids)} if "orders" in cluster else {**cluster, "order_ids": ids}
+            for cluster, ids in zip(clusters, order_ids)
+        ]
+
+    def validate_input(self, state: Dict[str, Any]) -> bool:
+        """Valida que haya pedidos y vehículos"""
+        return "orders" in state and "vehicles" in state
@@ -0,0 +1,3 @@
+from .node import ClusterOrdersByZoneNode
+
+__all__ = ['ClusterOrdersByZoneNode']
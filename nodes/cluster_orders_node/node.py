@@ -0,0 +1,98 @@
+import asyncio
+import logging
+from typing import Dict, Any, List
+
+from ..base import NodeBase
+from backend.decomposition import DECOMPOSITION_MAX_CLUSTER_ORDERS, DECOMPOSITION_METHOD, cluster_points
+
+logger = logging.getLogger(__name__)
+
+class ClusterOrdersByZoneNode(NodeBase):
+    """
+    Nodo que agrupa los pedidos por zona geográfica (k-means o barrido
+    angular desde el depósito) para resolver cada zona por separado
+    """
+
+    __version__ = "1.0.0"
+    __author__ = "Route Optimizer Team"
+
+    @classmethod
+    def get_dependencies(cls) -> List[str]:
+        return ["numpy"]
+
+    @classmethod
+    def get_input_schema(cls) -> Dict[str, Any]:
+        return {
+            "type": "object",
+            "properties": {
+                "depot": {"type": "object"},
+                "orders": {"type": "array"},
+                "vehicles": {
+                    "type": "array",
+                    "description": "Opcional: limita el número de zonas al tamaño de la flota"
+                }
+            },
+            "required": ["depot", "orders"]
+        }
+
+    @classmethod
+    def get_output_schema(cls) -> Dict[str, Any]:
+        return {
+            "type": "object",
+            "properties": {
+                "clusters": {
+                    "type": "array",
+                    "description": "Zonas: cluster_id, order_ids, centroid [lon, lat], orders, weight, volume"
+                },
+                "decomposition_method": {"type": "string"}
+            },
+            "required": ["clusters"]
+        }
+
+    async def execute(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Agrupa los pedidos en zonas de tamaño acotado"""
+        depot = state["depot"]
+        orders = state["orders"]
+        vehicles = state.get("vehicles") or []
+        method = self.config.get("method", DECOMPOSITION_METHOD)
+        max_orders = int(self.config.get("max_cluster_orders", DECOMPOSITION_MAX_CLUSTER_ORDERS))
+
+        points = [[float(o["lon"]), float(o["lat"])] for o in orders]
+        demand = [float(o.get("peso") or 0.0) for o in orders]
+
+        groups = await asyncio.to_thread(
+            cluster_points,
+            points,
+            [float(depot["lon"]), float(depot["lat"])],
+            demand,
+            max_orders,
+            method,
+            len(vehicles) or None,
+        )
+
+        clusters = []
+        for cluster_id, members in enumerate(groups):
+            members_orders = [orders[i] for i in members]
+            clusters.append({
+                "cluster_id": cluster_id,
+                "order_ids": [str(o["id_pedido"]) for o in members_orders],
+                "centroid": [
+                    sum(points[i][0] for i in members) / len(members),
+                    sum(points[i][1] for i in members) / len(members),
+                ],
+                "orders": len(members),
+                "weight": sum(float(o.get("peso") or 0.0) for o in members_orders),
+                "volume": sum(float(o.get("volumen") or 0.0) for o in members_orders),
+            })
+
+        logger.info(
+            f"Clustered {len(orders)} orders into {len(clusters)} zones "
+            f"({method}, sizes={[c['orders'] for c in clusters]})"
+        )
+        return {"clusters": clusters, "decomposition_method": method}
+
+    def validate_input(self, state: Dict[str, Any]) -> bool:
+        """Valida que el depósito y los pedidos tengan coordenadas"""
+        if "depot" not in state or "orders" not in state:
+            return False
+        return all("lat" in o and "lon" in o for o in [state["depot"], *state["orders"]])
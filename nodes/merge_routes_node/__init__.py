@@ -0,0 +1,3 @@
+from .node import MergeOptimizedRoutesNode
+
+__all__ = ['MergeOptimizedRoutesNode']
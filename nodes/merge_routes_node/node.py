@@ -0,0 +1,74 @@
+import asyncio
+import logging
+from typing import Dict, Any
+
+from ..base import NodeBase
+from backend.decomposition import merge_cluster_results
+from backend.route_geometry import ROUTE_GEOMETRY_ENABLED, attach_route_geometry
+
+logger = logging.getLogger(__name__)
+
+class MergeOptimizedRoutesNode(NodeBase):
+    """
+    Nodo que une los resultados de cada zona en un único
+    resultado con el formato estándar del solver
+    """
+
+    __version__ = "1.0.0"
+    __author__ = "Route Optimizer Team"
+
+    @classmethod
+    def get_input_schema(cls) -> Dict[str, Any]:
+        return {
+            "type": "object",
+            "properties": {
+                "pending_route_id": {"type": "string"},
+                "reference_time_iso": {"type": "string"},
+                "cluster_results": {"type": "array"},
+                "cluster_ids": {"type": "array"},
+                "decomposition_method": {"type": "string"}
+            },
+            "required": ["cluster_results"]
+        }
+
+    @classmethod
+    def get_output_schema(cls) -> Dict[str, Any]:
+        return {
+            "type": "object",
+            "properties": {
+                "result": {
+                    "type": "object",
+                    "properties": {
+                        "status": {"type": "string"},
+                        "vehicles": {"type": "array"},
+                        "unassigned": {"type": "array"}
+                    }
+                }
+            },
+            "required": ["result"]
+        }
+
+    async def execute(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Une las rutas de todas las zonas"""
+        result = merge_cluster_results(
+            state.get("pending_route_id") or "multi",
+            state.get("reference_time_iso"),
+            state["cluster_results"],
+            state.get("cluster_ids"),
+        )
+        result["solver_metadata"]["decomposition"]["method"] = state.get("decomposition_method")
+
+        logger.info(
+            f"Merged {len(state['cluster_results'])} zone results: "
+            f"{len(result['vehicles'])} routes, {len(result['unassigned'])} unassigned"
+        )
+
+        # Geometría por vehículo: una petición de directions por ruta
+        if self.config.get("route_geometry", ROUTE_GEOMETRY_ENABLED) and result.get("status") == "ok":
+            await asyncio.to_thread(attach_route_geometry, result)
+
+        return {"result": result}
+
+    def validate_input(self, state: Dict[str, Any]) -> bool:
+        """Valida que haya resultados por zona"""
+        return "cluster_results" in state
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import logging
 from typing import Dict, Any, List, Optional
@@ -5,7 +6,9 @@ from datetime import datetime, timezone
 from dateutil import parser as dtparser
 
 from ..base import NodeBase
+from backend.route_geometry import ROUTE_GEOMETRY_ENABLED, attach_route_geometry
 from backend.solver import Node, VehicleSpec, solve_cvrptw
+from backend.warm_start import WARM_START_ENABLED, find_initial_routes, record_source
 
 logger = logging.getLogger(__name__)
 
@@ -32,7 +35,8 @@ class ORToolsSolverNode(NodeBase):
                 "orders": {"type": "array"},
                 "vehicles": {"type": "array"},
                 "duration_matrix": {"type": "array"},
-                "reference_time_iso": {"type": "string"}
+                "reference_time_iso": {"type": "string"},
+                "initial_routes": {"type": "array"}
             },
             "required": ["pending_route_id", "depot", "orders", "vehicles", "duration_matrix"]
         }
@@ -148,6 +152,18 @@ class ORToolsSolverNode(NodeBase):
         
         logger.info(f"Solving CVRPTW for route {pr_id}")
         
+        # Arranque en caliente: rutas previas del estado o del plan guardado más parecido
+        initial_routes = state.get("initial_routes")
+        warm_source = {"source": "state"} if initial_routes else None
+        if initial_routes is None and self.config.get("warm_start", WARM_START_ENABLED):
+            initial_routes, warm_source = await asyncio.to_thread(
+                find_initial_routes,
+                pr_id,
+                (state.get("payload") or {}).get("parent_pending_route_id"),
+                depot_node,
+                order_nodes,
+            )
+        
         try:
             # Ejecutar solver
             result = solve_cvrptw(
@@ -159,16 +175,26 @@ class ORToolsSolverNode(NodeBase):
                 reference_time_iso=state["reference_time_iso"],
                 service_time_seconds=service_time_seconds,
                 time_limit_seconds=time_limit_seconds,
+                merge_colocated=self.config.get("merge_colocated_orders"),
+                portfolio=self.config.get("solver_portfolio"),
+                initial_routes=initial_routes,
+                adaptive_time_limit=self.config.get("adaptive_time_limit"),
             )
+            record_source(result, warm_source)
             
             logger.info(
                 f"Solver completed: status={result.get('status')}, "
                 f"unassigned={len(result.get('unassigned', []))}"
             )
             
+            # Geometría por vehículo: una petición de directions por ruta
+            if self.config.get("route_geometry", ROUTE_GEOMETRY_ENABLED) and result.get("status") == "ok":
+                await asyncio.to_thread(attach_route_geometry, result)
+            
             # Enriquecer resultado con métricas
             if result.get("status") == "optimal" or result.get("status") == "feasible":
                 result["solver_metadata"] = {
+                    **result.get("solver_metadata", {}),
                     "solver": "ortools",
                     "time_limit": time_limit_seconds,
                     "service_time": service_time_seconds,
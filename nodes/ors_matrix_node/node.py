@@ -4,7 +4,12 @@ import asyncio
 from datetime import datetime
 
 from ..base import NodeBase
-from backend.ors import get_duration_matrix
+from backend.duration_matrix import DurationMatrix
+from backend.matrix_cache import CacheStats
+from backend.hedged_matrix import MATRIX_HEDGE_DEADLINE_SECONDS
+from backend.matrix_service import build_duration_matrix_within
+from backend import local_router
+from backend.ors_fallback import estimate_duration_matrix
 
 logger = logging.getLogger(__name__)
 
@@ -44,6 +49,10 @@ class ORSMatrixNode(NodeBase):
                         },
                         "required": ["lat", "lon"]
                     }
+                },
+                "reference_time_iso": {
+                    "type": "string",
+                    "description": "Salida de la ruta; elige el bucket horario de tráfico"
                 }
             },
             "required": ["depot", "orders"]
@@ -60,11 +69,15 @@ class ORSMatrixNode(NodeBase):
                 },
                 "duration_matrix": {
                     "type": "array",
-                    "description": "Matriz de duraciones en segundos"
+                    "description": "Matriz de duraciones en segundos (DurationMatrix int32)"
                 },
                 "distance_matrix": {
                     "type": "array",
                     "description": "Matriz de distancias en metros"
+                },
+                "matrix_cache_stats": {
+                    "type": "object",
+                    "description": "Aciertos/fallos de la caché de tiempos de viaje"
                 }
             },
             "required": ["locations_lonlat", "duration_matrix"]
@@ -91,16 +104,45 @@ class ORSMatrixNode(NodeBase):
         # Construir lista de ubicaciones
         locations_lonlat = self._build_locations_list(depot, orders)
         
+        # Motor local (grafo OSM precalculado) si está configurado
+        if self._use_local_router():
+            logger.info(f"Computing local router matrix for {len(locations_lonlat)} locations")
+            try:
+                duration_matrix = await asyncio.to_thread(
+                    local_router.get_duration_matrix_local,
+                    locations_lonlat
+                )
+                return {
+                    "locations_lonlat": locations_lonlat,
+                    "duration_matrix": duration_matrix,
+                    "matrix_backend": "local_router",
+                    "matrix_timestamp": datetime.utcnow().isoformat()
+                }
+            except Exception as e:
+                logger.error(f"Local router failed, falling back to ORS: {str(e)}")
+        
         logger.info(f"Requesting ORS matrix for {len(locations_lonlat)} locations")
         
         try:
-            # Obtener matriz de duraciones
+            # Obtener matriz de duraciones: reutiliza la matriz previa del linaje,
+            # el almacén compartido y la caché local antes de llamar a ORS
+            cache_stats = CacheStats()
+            # Con `hedge_deadline_seconds` > 0 la espera a ORS queda acotada: al vencer
+            # se usan las celdas ya recibidas más estimaciones
             duration_matrix = await asyncio.to_thread(
-                get_duration_matrix, 
-                locations_lonlat
+                build_duration_matrix_within,
+                locations_lonlat,
+                float(self.config.get("hedge_deadline_seconds", MATRIX_HEDGE_DEADLINE_SECONDS)),
+                state.get("pending_route_id"),
+                (state.get("payload") or {}).get("parent_pending_route_id"),
+                cache_stats,
+                state.get("reference_time_iso")
             )
             
-            logger.info("ORS matrix received successfully")
+            logger.info(
+                f"ORS matrix received successfully "
+                f"(cache hits={cache_stats.hits}, misses={cache_stats.misses})"
+            )
             
             # Calcular matriz de distancias si se necesita
             # (ORS devuelve duraciones, las distancias pueden aproximarse)
@@ -108,43 +150,35 @@ class ORSMatrixNode(NodeBase):
             return {
                 "locations_lonlat": locations_lonlat,
                 "duration_matrix": duration_matrix,
+                "matrix_cache_stats": cache_stats.as_dict(),
                 "matrix_timestamp": datetime.utcnow().isoformat()
             }
             
         except Exception as e:
             logger.error(f"Failed to get ORS matrix: {str(e)}")
             
-            # Fallback: matriz euclidiana aproximada
-            logger.warning("Using fallback euclidean distance matrix")
+            # Fallback: matriz haversine aproximada
+            logger.warning("Using fallback haversine distance matrix")
             return self._fallback_matrix(locations_lonlat)
     
+    def _use_local_router(self) -> bool:
+        """Decide si usar el motor local: config `matrix_backend` = ors | local | auto"""
+        backend = self.config.get("matrix_backend", "auto")
+        if backend == "local":
+            return True
+        return backend == "auto" and local_router.is_available()
+    
     def _fallback_matrix(self, locations: List[List[float]]) -> Dict[str, Any]:
-        """Genera matriz de fallback basada en distancias euclidianas"""
-        import math
-        
-        n = len(locations)
-        matrix = [[0] * n for _ in range(n)]
-        
-        for i in range(n):
-            for j in range(n):
-                if i != j:
-                    # Distancia euclidiana en metros (aproximado)
-                    lat1, lon1 = locations[i][1], locations[i][0]
-                    lat2, lon2 = locations[j][1], locations[j][0]
-                    
-                    # Conversión aproximada a metros
-                    lat_diff = (lat2 - lat1) * 111320  # 1 grado ≈ 111.32 km
-                    lon_diff = (lon2 - lon1) * 111320 * math.cos(math.radians(lat1))
-                    
-                    distance = math.sqrt(lat_diff**2 + lon_diff**2)
-                    # Asumir velocidad promedio de 30 km/h = 8.33 m/s
-                    duration = int(distance / 8.33)
-                    
-                    matrix[i][j] = duration
+        """Genera matriz de fallback con el estimador calibrado o distancias haversine"""
+        # Misma implementación vectorizada (y velocidad configurable) que backend.ors_fallback
+        matrix = estimate_duration_matrix(
+            locations,
+            speed_kmh=self.config.get("fallback_speed_kmh"),
+        )
         
         return {
             "locations_lonlat": locations,
-            "duration_matrix": matrix,
+            "duration_matrix": DurationMatrix(matrix),
             "fallback_used": True,
             "matrix_timestamp": datetime.utcnow().isoformat()
         }
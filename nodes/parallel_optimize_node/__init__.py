@@ -0,0 +1,3 @@
+from .node import ParallelOptimizeNode
+
+__all__ = ['ParallelOptimizeNode']
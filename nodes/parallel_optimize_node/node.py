@@ -0,0 +1,212 @@
+import asyncio
+import os
+import logging
+from typing import Dict, Any, List
+from dateutil import parser as dtparser
+
+from ..or_tools_solver_node import ORToolsSolverNode
+from ..assign_vehicles_node import AssignVehiclesToClustersNode
+from backend.decomposition import DECOMPOSITION_WORKERS, solve_clusters
+from backend.duration_matrix import DurationMatrix
+from backend.hedged_matrix import MATRIX_HEDGE_DEADLINE_SECONDS
+from backend.matrix_cache import CacheStats
+from backend.matrix_coalescer import coalescing
+from backend.matrix_service import build_duration_matrix_within
+from backend.ors import ORS_COALESCE_PARALLEL_WINDOW_MS
+from backend.ors_fallback import estimate_duration_matrix
+from backend.solver import Node, VehicleSpec
+
+logger = logging.getLogger(__name__)
+
+class ParallelOptimizeNode(ORToolsSolverNode):
+    """
+    Nodo que resuelve cada zona como un CVRPTW independiente en
+    procesos paralelos, con su propia matriz y sus vehículos asignados
+    """
+
+    __version__ = "1.0.0"
+    __author__ = "Route Optimizer Team"
+
+    @classmethod
+    def get_input_schema(cls) -> Dict[str, Any]:
+        return {
+            "type": "object",
+            "properties": {
+                "pending_route_id": {"type": "string"},
+                "depot": {"type": "object"},
+                "orders": {"type": "array"},
+                "vehicles": {"type": "array"},
+                "reference_time_iso": {"type": "string"},
+                "clusters": {
+                    "type": "array",
+                    "description": "Opcional: sin zonas se resuelve todo como una sola"
+                },
+                "duration_matrix": {
+                    "type": "array",
+                    "description": "Opcional: matriz completa (depósito + pedidos); si falta se pide una por zona"
+                }
+            },
+            "required": ["depot", "orders", "vehicles", "reference_time_iso"]
+        }
+
+    @classmethod
+    def get_output_schema(cls) -> Dict[str, Any]:
+        return {
+            "type": "object",
+            "properties": {
+                "cluster_results": {"type": "array"},
+                "cluster_ids": {"type": "array"}
+            },
+            "required": ["cluster_results", "cluster_ids"]
+        }
+
+    def _cluster_matrix(self, locations_lonlat: List[List[float]], state: Dict[str, Any]) -> DurationMatrix:
+        """Matriz de una zona (caché, ORS con plazo); estimación si ORS falla"""
+        try:
+            return build_duration_matrix_within(
+                locations_lonlat,
+                float(self.config.get("hedge_deadline_seconds", MATRIX_HEDGE_DEADLINE_SECONDS)),
+                None,
+                None,
+                CacheStats(),
+                state.get("reference_time_iso"),
+            )
+        except Exception as e:
+            logger.warning(f"Zone matrix failed, using estimated durations: {str(e)}")
+            return DurationMatrix(estimate_duration_matrix(locations_lonlat))
+
+    async def _matrices(
+        self,
+        state: Dict[str, Any],
+        depot_node: Node,
+        groups: List[List[Node]],
+        order_index: Dict[str, int],
+    ) -> List[DurationMatrix]:
+        """Recorta la matriz completa si viene en el estado; si no, pide una por zona a la vez"""
+        full = state.get("duration_matrix")
+        if full is not None and len(full) == len(order_index) + 1:
+            full = DurationMatrix.coerce(full)
+            return [full.take([0] + [order_index[n.id] + 1 for n in group]) for group in groups]
+
+        # Las peticiones concurrentes se agrupan en una sola pasada de ORS (matrix_coalescer);
+        # con una sola zona no hay con quién agrupar y la espera sobra
+        window_ms = float(self.config.get("coalesce_window_ms", ORS_COALESCE_PARALLEL_WINDOW_MS))
+        with coalescing(window_ms / 1000.0 if len(groups) > 1 else 0.0):
+            return await asyncio.gather(*(
+                asyncio.to_thread(
+                    self._cluster_matrix,
+                    [[depot_node.lon, depot_node.lat]] + [[n.lon, n.lat] for n in group],
+                    state,
+                )
+                for group in groups
+            ))
+
+    def _job(
+        self,
+        pr_id: str,
+        state: Dict[str, Any],
+        depot_node: Node,
+        order_nodes: List[Node],
+        vehicle_specs: List[VehicleSpec],
+        matrix: DurationMatrix,
+        service_time_seconds: int,
+        time_limit_seconds: int,
+    ) -> Dict[str, Any]:
+        return {
+            "pending_route_id": pr_id,
+            "depot": depot_node,
+            "orders": order_nodes,
+            "vehicles": vehicle_specs,
+            "duration_matrix": matrix.array,
+            "reference_time_iso": state["reference_time_iso"],
+            "service_time_seconds": service_time_seconds,
+            "time_limit_seconds": time_limit_seconds,
+        }
+
+    async def execute(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Resuelve las zonas en paralelo y reintenta los pedidos sobrantes con los vehículos libres"""
+        pr_id = state.get("pending_route_id") or "multi"
+        orders = state["orders"]
+        vehicles = state["vehicles"]
+        reference = dtparser.isoparse(state["reference_time_iso"])
+
+        clusters = state.get("clusters") or [
+            {"cluster_id": 0, "order_ids": [str(o["id_pedido"]) for o in orders]}
+        ]
+        if any("vehicle_ids" not in c for c in clusters):
+            assigned = await AssignVehiclesToClustersNode(self.config).execute({**state, "clusters": clusters})
+            clusters = assigned["clusters"]
+
+        depot_node = self._build_depot_node(state["depot"], reference)
+        order_nodes = self._build_order_nodes(orders, reference)
+        vehicle_specs = self._build_vehicle_specs(vehicles)
+        nodes_by_id = {n.id: n for n in order_nodes}
+        order_index = {n.id: i for i, n in enumerate(order_nodes)}
+        specs_by_id = {v.id_vehicle: v for v in vehicle_specs}
+
+        service_time_seconds = int(
+            os.environ.get("SERVICE_TIME_SECONDS", "0") or
+            self.config.get("service_time_seconds", "0")
+        )
+        time_limit_seconds = int(
+            os.environ.get("SOLVER_TIME_LIMIT_SECONDS", "30") or
+            self.config.get("time_limit_seconds", "30")
+        )
+        workers = int(self.config.get("workers", DECOMPOSITION_WORKERS))
+
+        # Zonas sin vehículo no se resuelven: sus pedidos pasan a la ronda de sobrantes
+        solvable = [c for c in clusters if c.get("vehicle_ids") and c.get("order_ids")]
+        stranded = [i for c in clusters if not c.get("vehicle_ids") for i in c.get("order_ids", [])]
+        groups = [[nodes_by_id[i] for i in c["order_ids"] if i in nodes_by_id] for c in solvable]
+
+        logger.info(f"Optimizing {len(solvable)} zones for route {pr_id} with {workers} workers")
+        matrices = await self._matrices(state, depot_node, groups, order_index)
+        jobs = [
+            self._job(
+                pr_id, state, depot_node, group,
+                [specs_by_id[v] for v in c["vehicle_ids"] if v in specs_by_id],
+                matrix, service_time_seconds, time_limit_seconds,
+            )
+            for c, group, matrix in zip(solvable, groups, matrices)
+        ]
+        results = await asyncio.to_thread(
+            solve_clusters, jobs, workers, self.config.get("adaptive_time_limit")
+        )
+        cluster_ids = [c["cluster_id"] for c in solvable]
+
+        # Ronda de sobrantes: pedidos no asignados con los vehículos que quedaron sin ruta
+        leftover = self._leftover(results, stranded)
+        if leftover and self.config.get("leftover_pass", True):
+            used = {r["id_vehicle"] for res in results for r in res.get("vehicles", [])}
+            free = [v for v in vehicle_specs if v.id_vehicle not in used]
+            group = [nodes_by_id[i] for i in leftover if i in nodes_by_id]
+            if free and group:
+                logger.info(f"Leftover pass: {len(group)} orders, {len(free)} free vehicles")
+                [matrix] = await self._matrices(state, depot_node, [group], order_index)
+                job = self._job(
+                    pr_id, state, depot_node, group, free,
+                    matrix, service_time_seconds, time_limit_seconds,
+                )
+                results += await asyncio.to_thread(
+                    solve_clusters, [job], 1, self.config.get("adaptive_time_limit")
+                )
+                cluster_ids.append("leftover")
+            elif stranded:
+                results.append({"status": "no_solution", "vehicles": [], "unassigned": stranded})
+                cluster_ids.append("unallotted")
+        elif stranded:
+            results.append({"status": "no_solution", "vehicles": [], "unassigned": stranded})
+            cluster_ids.append("unallotted")
+
+        return {"cluster_results": results, "cluster_ids": cluster_ids}
+
+    def _leftover(self, results: List[Dict[str, Any]], stranded: List[str]) -> List[str]:
+        """Pedidos sin ruta que todavía pueden servirse (los inalcanzables quedan fuera)"""
+        unreachable = {i for r in results for i in r.get("unreachable", [])}
+        pending = [i for r in results for i in r.get("unassigned", [])] + stranded
+        return [i for i in dict.fromkeys(pending) if i not in unreachable]
+
+    def validate_input(self, state: Dict[str, Any]) -> bool:
+        """Valida que todos los datos requeridos estén presentes"""
+        required = ["depot", "orders", "vehicles", "reference_time_iso"]
+        return all(key in state for key in required)
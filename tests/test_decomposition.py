@@ -0,0 +1,58 @@
+import numpy as np
+
+from backend.decomposition import allot_vehicles, cluster_points, merge_cluster_results
+
+DEPOT = [-70.60, -33.40]
+
+
+def _points(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.column_stack([DEPOT[0] + rng.normal(0, 0.05, n), DEPOT[1] + rng.normal(0, 0.05, n)]).tolist()
+
+
+def test_cluster_points_respects_size_target_and_count_cap():
+    points = _points(500)
+
+    clusters = cluster_points(points, DEPOT, max_cluster_orders=100, method="kmeans")
+    assert sorted(i for c in clusters for i in c) == list(range(500))
+    assert len(clusters) >= 5
+    assert max(len(c) for c in clusters) <= 150
+    assert [len(c) for c in clusters] == sorted((len(c) for c in clusters), reverse=True)
+
+    capped = cluster_points(points, DEPOT, max_cluster_orders=100, method="sweep", max_clusters=3)
+    assert len(capped) == 3
+    assert sorted(i for c in capped for i in c) == list(range(500))
+
+
+def test_allot_vehicles_gives_skilled_vehicles_to_zones_needing_them_first():
+    demands = [[50, 500.0, 5.0], [10, 100.0, 1.0]]
+    capacities = [[1000.0, 10.0], [1000.0, 10.0], [200.0, 2.0]]
+    skills = [set(), set(), {"frio"}]
+
+    allotted = allot_vehicles(demands, capacities, [set(), {"frio"}], skills)
+
+    assert 2 in allotted[1]
+    assert all(allotted)
+    assert sorted(v for a in allotted for v in a) == [0, 1, 2]
+
+
+def test_merge_counts_orders_served_by_the_leftover_pass_and_dedups_unassigned():
+    zone = {
+        "status": "ok",
+        "vehicles": [{"id_vehicle": "v1", "stops": [{"kind": "order", "id": "a"}]}],
+        "unassigned": ["b", "c"],
+    }
+    other = {"status": "ok", "vehicles": [], "unassigned": ["c"], "unreachable": ["d"]}
+    leftover = {
+        "status": "ok",
+        "vehicles": [{"id_vehicle": "v2", "stops": [{"kind": "order", "id": "b"}]}],
+        "unassigned": ["c"],
+    }
+
+    merged = merge_cluster_results("pr", "2026-01-01T08:00:00+00:00", [zone, other, leftover], [0, 1, "leftover"])
+
+    assert merged["status"] == "ok"
+    assert [r["cluster_id"] for r in merged["vehicles"]] == [0, "leftover"]
+    assert merged["unassigned"] == ["c"]
+    assert merged["unreachable"] == ["d"]
+    assert len(merged["solver_metadata"]["decomposition"]["clusters"]) == 3
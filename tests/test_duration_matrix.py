@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+from backend.duration_matrix import DurationMatrix
+
+
+def test_bytes_round_trip():
+    matrix = DurationMatrix(np.arange(16).reshape(4, 4))
+
+    data = matrix.tobytes()
+
+    assert isinstance(data, bytes) and len(data) == 64
+    assert DurationMatrix.frombytes(data) == matrix
+
+
+def test_frombytes_rejects_non_square_buffers():
+    with pytest.raises(ValueError):
+        DurationMatrix.frombytes(np.zeros(6, dtype="<i4").tobytes())
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from backend import matrix_lineage
+from backend.duration_matrix import DurationMatrix
+from backend.matrix_cache import CacheStats, TravelTimeCache, location_keys
+from backend.matrix_lineage import MatrixSnapshot, derive_matrix
+from backend.ors import ORS_PROFILE
+
+LOCATIONS = [[-70.60, -33.40], [-70.61, -33.41], [-70.62, -33.42], [-70.63, -33.43]]
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = TravelTimeCache()
+    monkeypatch.setattr(matrix_lineage, "get_cache", lambda: cache)
+    monkeypatch.setattr("backend.travel_time_store.get_cache", lambda: cache)
+    return cache
+
+
+@pytest.fixture
+def fetched(monkeypatch):
+    calls = []
+
+    def fake_fill_missing(locations_lonlat, matrix, missing, stats=None, blocks=None):
+        calls.append(missing.copy())
+        matrix[missing] = 999
+        return int(missing.any())
+
+    monkeypatch.setattr(matrix_lineage, "fill_missing", fake_fill_missing)
+    return calls
+
+
+def _previous():
+    # Snapshot of the first three locations; the fourth one is new.
+    keys = location_keys(LOCATIONS[:3])
+    durations = np.array([[0, 10, 20], [11, 0, 30], [21, 31, 0]], dtype=np.int32)
+    return MatrixSnapshot("pr-1", keys, DurationMatrix(durations))
+
+
+def _new_cells(durations):
+    keys = location_keys(LOCATIONS)
+    return [(keys[i], keys[3], durations) for i in range(3)] + [(keys[3], keys[i], durations) for i in range(3)]
+
+
+def test_new_cells_come_from_the_local_cache(cache, fetched, monkeypatch):
+    monkeypatch.setattr(matrix_lineage.db, "fetch_travel_times", lambda *a: pytest.fail("shared store queried"))
+    cache.store(ORS_PROFILE, _new_cells(42))
+
+    stats = CacheStats()
+    matrix, fetched_mask = derive_matrix(_previous(), LOCATIONS, stats)
+
+    assert not fetched_mask.any()
+    assert not fetched[0].any()
+    assert matrix.array[:3, 3].tolist() == [42, 42, 42]
+    assert matrix.array[0, 1] == 10
+    assert stats.misses == 0
+
+
+def test_shared_store_fills_before_ors(cache, fetched, monkeypatch):
+    keys = location_keys(LOCATIONS)
+    shared = {(s, d): 7 for s, d, _ in _new_cells(7)}
+    del shared[(keys[3], keys[0])]
+    monkeypatch.setattr(matrix_lineage.db, "fetch_travel_times", lambda profile, k: dict(shared))
+
+    matrix, fetched_mask = derive_matrix(_previous(), LOCATIONS, CacheStats())
+
+    assert np.argwhere(fetched_mask).tolist() == [[3, 0]]
+    assert matrix.array[3, 0] == 999
+    assert matrix.array[3, 1] == 7
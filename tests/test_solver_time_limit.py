@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from backend import solver_time_limit as stl
+from backend.solver_time_limit import InstanceFeatures, TimeLimitModel
+
+
+@pytest.fixture(autouse=True)
+def fresh_model(monkeypatch):
+    monkeypatch.setattr(stl, "_model", None)
+
+
+def _runs(count, seed=0):
+    rng = np.random.default_rng(seed)
+    runs = []
+    for _ in range(count):
+        n = int(rng.integers(5, 400))
+        tightness = float(rng.random())
+        runs.append(
+            {
+                "n_orders": n,
+                "n_vehicles": max(1, n // 15),
+                "tw_tightness": tightness,
+                "time_to_best_s": 0.02 * n ** 1.2 * (1 + tightness),
+                "time_limit_s": 300.0,
+                "elapsed_s": 300.0,
+                "stopped_by": "plateau",
+            }
+        )
+    return runs
+
+
+def test_without_database_keeps_fixed_limit_and_skips_queries(monkeypatch):
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+
+    def unexpected(*args, **kwargs):
+        raise AssertionError("database queried without DATABASE_URL")
+
+    monkeypatch.setattr(stl.db, "fetch_solver_runs", unexpected)
+    monkeypatch.setattr(stl.db, "insert_solver_run", unexpected)
+
+    seconds, report = stl.choose_time_limit(InstanceFeatures(5, 1, 0.0), 30)
+    stl.record_solver_run(InstanceFeatures(5, 1, 0.0), 30, {"time_to_best": 0.1, "seconds": 1.0, "stopped_by": "plateau"})
+
+    assert seconds == 30
+    assert report["source"] == "fixed"
+
+
+def test_model_is_loaded_once_per_process(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "postgresql://example")
+    calls = []
+    monkeypatch.setattr(stl.db, "fetch_solver_runs", lambda limit: calls.append(limit) or _runs(100))
+
+    for n in (5, 50, 300):
+        stl.choose_time_limit(InstanceFeatures(n, max(1, n // 15), 0.5), 120)
+
+    assert len(calls) == 1
+
+
+def test_too_little_history_keeps_fixed_limit():
+    model = TimeLimitModel.fit(_runs(stl.SOLVER_TIME_MODEL_MIN_RUNS - 1))
+
+    assert model.predict(InstanceFeatures(5, 1, 0.0), 30) == (30, "fixed")
+
+
+def test_prediction_grows_with_instance_size():
+    model = TimeLimitModel.fit(_runs(100))
+
+    small, source = model.predict(InstanceFeatures(5, 1, 0.5), 120)
+    large, _ = model.predict(InstanceFeatures(300, 20, 0.5), 120)
+
+    assert source == "model"
+    assert stl.SOLVER_MIN_TIME_LIMIT_SECONDS <= small < large <= 120
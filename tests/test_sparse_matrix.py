@@ -0,0 +1,66 @@
+import numpy as np
+
+from backend import sparse_matrix
+from backend.matrix_cache import CacheStats, TravelTimeCache
+from backend.strategy_selector import StrategySelector, _cells
+
+
+def _wanted(n, k, seed=0):
+    rng = np.random.default_rng(seed)
+    points = np.column_stack([-70.6 + rng.normal(0, 0.1, n), -33.4 + rng.normal(0, 0.1, n)]).tolist()
+    index = sparse_matrix.GridIndex(points)
+    knn = index.neighbours(k)
+    wanted = np.zeros((n, n), dtype=bool)
+    rows = np.repeat(np.arange(n), knn.shape[1])
+    wanted[rows, knn.ravel()] = True
+    wanted[knn.ravel(), rows] = True
+    np.fill_diagonal(wanted, False)
+    return index, wanted
+
+
+def test_source_blocks_cover_wanted_cells_and_cap_large_blocks(monkeypatch):
+    monkeypatch.setattr(sparse_matrix, "ORS_MATRIX_MAX_ELEMENTS", 200)
+    index, wanted = _wanted(1500, 20)
+
+    blocks = sparse_matrix._source_blocks(index, wanted, offset=0)
+
+    covered = np.zeros_like(wanted)
+    for src, dst in blocks:
+        covered[np.ix_(src, dst)] = True
+        size = len(src) * len(dst)
+        block_wanted = int(wanted[np.ix_(src, dst)].sum())
+        assert len(src) == 1 or size <= max(200, sparse_matrix.SPARSE_MATRIX_BLOCK_OVERHEAD * block_wanted)
+    assert not (wanted & ~covered).any()
+
+
+def test_selector_learns_requested_cells(monkeypatch):
+    monkeypatch.setattr("backend.strategy_selector.db.upsert_strategy_stats", lambda *a: None)
+    selector = StrategySelector()
+    n = 1000
+    prior = selector.predict_seconds("ors_sparse", n)
+
+    selector.record("ors_sparse", n, 10.0, ok=True, cells=200 * n)
+    assert selector.stats["ors_sparse"].cells_per_location == 200
+    assert selector.stats["ors_sparse"].seconds_per_cell == 10.0 / (200 * n)
+    assert selector.predict_seconds("ors_sparse", n) == 10.0
+
+    # A fully cached run requests nothing and leaves the learned size alone.
+    selector.record("ors_sparse", n, 0.1, ok=True, cells=0)
+    assert selector.stats["ors_sparse"].cells_per_location == 200
+    assert prior > 0 and _cells("ors_sparse", n) < 200 * n
+
+
+def test_fill_missing_counts_requested_cells(monkeypatch):
+    from backend import ors
+
+    monkeypatch.setattr(ors, "get_cache", TravelTimeCache)
+    monkeypatch.setattr(ors, "_fetch_block", lambda locs, src, dst, stats: np.ones((len(src), len(dst)), dtype=np.int32))
+    stats = CacheStats()
+    locations = [[-70.6 + i * 0.01, -33.4] for i in range(5)]
+    matrix = np.zeros((5, 5), dtype=np.int32)
+    missing = np.zeros((5, 5), dtype=bool)
+    missing[0, 1] = missing[2, 3] = True
+
+    ors.fill_missing(locations, matrix, missing, stats, blocks=[([0, 2], [1, 3])])
+
+    assert stats.requested == 4
@@ -0,0 +1,45 @@
+import pytest
+
+from backend import strategy_selector
+from backend.duration_matrix import DurationMatrix
+from backend.strategy_selector import StrategyDecision, StrategySelector, compute_matrix
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(strategy_selector.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(strategy_selector.db, "upsert_strategy_stats", lambda *a: None)
+    return now
+
+
+def _run(selector, monkeypatch, clock, n, seconds, fetched):
+    """One ors_matrix build of `n` locations taking `seconds`, sending `fetched` cells to ORS."""
+
+    def build(locations_lonlat, deadline_seconds, pending_route_id, parent_pending_route_id, stats, reference_time_iso):
+        clock[0] += seconds
+        stats.requested += fetched
+        return DurationMatrix.zeros(n)
+
+    monkeypatch.setattr(strategy_selector, "build_duration_matrix_within", build)
+    compute_matrix([[0.0, 0.0]] * n, selector=selector, first=StrategyDecision("ors_matrix"))
+
+
+def test_warm_runs_do_not_lower_the_cold_prediction(monkeypatch, clock):
+    selector = StrategySelector()
+    _run(selector, monkeypatch, clock, 201, 30.0, 201 * 201)
+    cold = selector.predict_seconds("ors_matrix", 2001)
+
+    for _ in range(20):
+        _run(selector, monkeypatch, clock, 201, 0.3, 0)
+
+    assert selector.predict_seconds("ors_matrix", 2001) == pytest.approx(cold)
+    assert cold > 2000
+
+
+def test_partially_cached_runs_are_charged_for_fetched_cells(monkeypatch, clock):
+    selector = StrategySelector()
+    _run(selector, monkeypatch, clock, 201, 3.0, 4000)
+
+    assert selector.stats["ors_matrix"].seconds_per_cell == pytest.approx(3.0 / 4000)
+    assert selector.stats["ors_matrix"].cells_per_location is None
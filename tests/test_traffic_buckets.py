@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from backend import traffic_buckets
+from backend.duration_matrix import DurationMatrix
+from backend.matrix_cache import TravelTimeCache
+
+LOCATIONS = [[-70.60, -33.40], [-70.61, -33.41]]
+BUCKET = 8
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = TravelTimeCache()
+    monkeypatch.setattr(traffic_buckets, "get_cache", lambda: cache)
+    return cache
+
+
+def _factors(monkeypatch, factor):
+    factors = np.ones(traffic_buckets.HOURS_PER_WEEK)
+    factors[BUCKET] = factor
+    monkeypatch.setattr(traffic_buckets, "_factors", factors)
+
+
+def _free_flow():
+    return DurationMatrix(np.array([[0, 100], [200, 0]], dtype=np.int32))
+
+
+def test_bucket_cells_are_reused_while_the_profile_is_unchanged(cache, monkeypatch):
+    _factors(monkeypatch, 1.5)
+    assert traffic_buckets.bucket_matrix(LOCATIONS, BUCKET, _free_flow).array[0, 1] == 150
+
+    traffic_buckets.bucket_matrix(LOCATIONS, BUCKET, lambda: pytest.fail("free-flow rebuilt"))
+
+
+def test_profile_change_ignores_cells_from_the_old_profile(cache, monkeypatch):
+    _factors(monkeypatch, 1.5)
+    traffic_buckets.bucket_matrix(LOCATIONS, BUCKET, _free_flow)
+
+    _factors(monkeypatch, 2.0)
+    matrix = traffic_buckets.bucket_matrix(LOCATIONS, BUCKET, _free_flow)
+
+    assert matrix.array.tolist() == [[0, 200], [400, 0]]
@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+
+import pytest
+
+from backend import warm_start
+
+DEPOT = SimpleNamespace(lon=-58.3816, lat=-34.6037)
+ORDERS = [SimpleNamespace(lon=-58.4333, lat=-34.6158), SimpleNamespace(lon=-58.4000, lat=-34.5875)]
+
+
+def _plan(*stops):
+    depot = {"kind": "depot", "id": "depot", "lon": DEPOT.lon, "lat": DEPOT.lat}
+    orders = [{"kind": "order", "id": f"P-{i}", "lon": s.lon, "lat": s.lat} for i, s in enumerate(stops)]
+    return {"vehicles": [{"id_vehicle": "VAN-1", "stops": [depot, *orders, depot]}]}
+
+
+@pytest.fixture(autouse=True)
+def enabled(monkeypatch):
+    monkeypatch.setattr(warm_start, "WARM_START_ENABLED", True)
+    monkeypatch.setattr(warm_start.db, "fetch_latest_optimized_result", lambda pr_id: None)
+    monkeypatch.setattr(warm_start.db, "fetch_recent_optimized_results", lambda limit: [])
+
+
+def test_prefers_previous_result_of_same_pending_route(monkeypatch):
+    plan = _plan(*ORDERS)
+    monkeypatch.setattr(warm_start.db, "fetch_latest_optimized_result", lambda pr_id: plan if pr_id == "pr-1" else None)
+
+    routes, source = warm_start.find_initial_routes("pr-1", None, DEPOT, ORDERS)
+
+    assert routes == plan["vehicles"]
+    assert source == {"source": "pending_route", "pending_route_id": "pr-1"}
+
+
+def test_falls_back_to_parent_pending_route(monkeypatch):
+    plan = _plan(*ORDERS)
+    monkeypatch.setattr(warm_start.db, "fetch_latest_optimized_result", lambda pr_id: plan if pr_id == "parent" else None)
+
+    routes, source = warm_start.find_initial_routes("pr-1", "parent", DEPOT, ORDERS)
+
+    assert routes == plan["vehicles"]
+    assert source["pending_route_id"] == "parent"
+
+
+def test_uses_most_overlapping_plan_from_same_depot(monkeypatch):
+    partial = _plan(ORDERS[0])
+    full = _plan(*ORDERS)
+    monkeypatch.setattr(
+        warm_start.db,
+        "fetch_recent_optimized_results",
+        lambda limit: [("pr-a", partial), ("pr-b", full)],
+    )
+
+    routes, source = warm_start.find_initial_routes("pr-1", None, DEPOT, ORDERS)
+
+    assert routes == full["vehicles"]
+    assert source == {"source": "similar_plan", "pending_route_id": "pr-b", "overlap": 1.0}
+
+
+def test_returns_pair_when_nothing_matches():
+    assert warm_start.find_initial_routes("pr-1", None, DEPOT, ORDERS) == (None, None)
+
+
+def test_returns_pair_when_lookup_fails(monkeypatch):
+    def boom(pr_id):
+        raise RuntimeError("DATABASE_URL is required")
+
+    monkeypatch.setattr(warm_start.db, "fetch_latest_optimized_result", boom)
+
+    assert warm_start.find_initial_routes("pr-1", None, DEPOT, ORDERS) == (None, None)
+
+
+def test_record_source_annotates_warm_started_result():
+    result = {"warm_start": {"seeded": 2}}
+
+    warm_start.record_source(result, {"source": "pending_route", "pending_route_id": "pr-1"})
+
+    assert result["warm_start"] == {"seeded": 2, "source": "pending_route", "pending_route_id": "pr-1"}